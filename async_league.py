@@ -0,0 +1,190 @@
+import asyncio
+
+import bulk
+import draft
+from league import League, ReturnCodes, Trade
+
+# how long a command waits for conflicting ones before giving up, for all of
+# its keys together. CONFLICT is the command's first reply, which discord
+# only takes within 3 seconds
+LOCK_TIMEOUT = 2
+
+
+class KeyedLocks:
+    """
+    asyncio locks created on demand per key. Keys are always taken in sorted
+    order so two commands locking overlapping keys can't deadlock, and a
+    lock is dropped again once nobody holds or waits for it.
+    """
+
+    def __init__(self):
+        self.locks = {}  # key -> [lock, users]
+
+    async def acquire(self, keys, timeout: float = None):
+        """Takes every key within `timeout` seconds in total, None if they couldn't all be had"""
+        acquired = []
+        try:
+            await asyncio.wait_for(self.acquire_all(sorted(set(keys)), acquired), timeout)
+        except BaseException as e:
+            # timed out or cancelled, give back what we already hold
+            self.release(acquired)
+            if isinstance(e, asyncio.TimeoutError):
+                return None
+            raise
+
+        return acquired
+
+    async def acquire_all(self, keys, acquired: list):
+        for key in keys:
+            entry = self.locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+
+            try:
+                await entry[0].acquire()
+            except BaseException:
+                self.forget(key)
+                raise
+
+            acquired.append(key)
+
+    def release(self, keys):
+        for key in keys:
+            self.locks[key][0].release()
+            self.forget(key)
+
+    def forget(self, key):
+        entry = self.locks[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.locks[key]
+
+
+def team_key(user_id: int):
+    return f'team:{user_id}'
+
+
+def player_key(player: str):
+    return f'player:{player}'
+
+
+def trade_keys(trade: Trade):
+    return [team_key(user_id) for user_id in trade.sides] + [player_key(player) for player in trade.players()]
+
+
+def draft_keys(order):
+    # a run of queued picks can reach any team in the draft
+    return ["draft"] + [team_key(user_id) for user_id in order]
+
+
+class AsyncLeague:
+    """
+    Async façade over a League for the bot. Reads are served straight from
+    memory, mutations update memory on the event loop and then wait for the
+    league's writer thread to make them durable without blocking the loop.
+
+    Each mutation locks only the teams and players it touches for its whole
+    check, update and flush, so conflicting commands are serialized while
+    unrelated ones run side by side. A command that can't get its locks
+    within LOCK_TIMEOUT gets ReturnCodes.CONFLICT. One whose change fails to
+    flush raises and marks the league `failed`.
+    """
+
+    def __init__(self, league: League):
+        self.league = league
+        self.locks = KeyedLocks()
+        # a change didn't make it to disk, the registry loads the league again
+        self.failed = False
+
+    def __getattr__(self, name):
+        # reads and everything else go straight to the league
+        return getattr(self.league, name)
+
+    @property
+    def busy(self):
+        # a command is halfway through a change, or waiting to start one
+        return bool(self.locks.locks)
+
+    async def flushed(self):
+        await asyncio.wrap_future(self.league.storage.barrier())
+
+    async def locked(self, keys, func, *args):
+        acquired = await self.locks.acquire(keys, LOCK_TIMEOUT)
+        if acquired is None:
+            return ReturnCodes.CONFLICT
+
+        try:
+            result = func(*args)
+            await self.flushed()
+            return result
+        except Exception:
+            # memory may be ahead of the disk now, nothing reads it anymore
+            self.failed = True
+            raise
+        finally:
+            self.locks.release(acquired)
+
+    async def create_team(self, user_id: int, team_name: str):
+        return await self.locked([team_key(user_id)], self.league.create_team, user_id, team_name)
+
+    async def delete_team(self, user_id: int):
+        # every roster change locks its team, so the team lock covers its players
+        return await self.locked([team_key(user_id)], self.league.delete_team, user_id)
+
+    async def add_player(self, user_id: int, player: str):
+        return await self.locked([team_key(user_id), player_key(player)], self.league.add_player, user_id, player)
+
+    async def remove_player(self, user_id: int, player: str):
+        return await self.locked([team_key(user_id), player_key(player)], self.league.remove_player, user_id, player)
+
+    async def create_trade(self, sides: dict, destinations: dict = None):
+        return await self.locked(trade_keys(Trade(sides)), self.league.create_trade, sides, destinations)
+
+    async def cancel_trade(self, trade: Trade, user_id: int = None):
+        return await self.locked(trade_keys(trade), self.league.cancel_trade, trade, user_id)
+
+    async def accept_trade(self, trade: Trade, user_id: int):
+        return await self.locked(trade_keys(trade), self.league.accept_trade, trade, user_id)
+
+    async def process_trade(self, trade: Trade):
+        return await self.locked(trade_keys(trade), self.league.process_trade, trade)
+
+    async def assign_trade_message(self, trade: Trade, message_id: int, channel_id: int = None):
+        try:
+            result = self.league.assign_trade_message(trade, message_id, channel_id)
+            await self.flushed()
+            return result
+        except Exception:
+            self.failed = True
+            raise
+
+    def running_draft_keys(self):
+        running = draft.running_draft(self.league)
+        return draft_keys(running.order if running else ())
+
+    async def start_draft(self, order: list, rounds: int, pick_seconds: float, snake: bool = True, channel_id: int = None):
+        return await self.locked(draft_keys(order), draft.start_draft, self.league, order, rounds, pick_seconds, snake, channel_id)
+
+    async def cancel_draft(self):
+        return await self.locked(self.running_draft_keys(), draft.cancel_draft, self.league)
+
+    async def draft_pick(self, user_id: int, player: str):
+        return await self.locked(self.running_draft_keys(), draft.make_pick, self.league, user_id, player)
+
+    async def draft_queue(self, user_id: int, players: list):
+        return await self.locked(self.running_draft_keys(), draft.queue_players, self.league, user_id, players)
+
+    async def draft_timeout(self, pick: int):
+        return await self.locked(self.running_draft_keys(), draft.pick_timed_out, self.league, pick)
+
+    async def import_league(self, data: dict, replace: bool = False):
+        # every team the import touches, and with replace every team it may delete.
+        # the upload isn't validated yet, entries bulk.validate() rejects lock nothing
+        teams = [team for team in data["teams"] if isinstance(team, dict) and isinstance(team.get("user_id"), int)]
+        user_ids = {team["user_id"] for team in teams}
+        if replace:
+            user_ids.update(self.league.teams)
+
+        players = {str(player).strip().upper() for team in teams if isinstance(team.get("players"), list) for player in team["players"]}
+        keys = [team_key(user_id) for user_id in user_ids] + [player_key(player) for player in players]
+
+        return await self.locked(keys, bulk.import_league, self.league, data, replace)
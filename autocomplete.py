@@ -0,0 +1,182 @@
+from bisect import bisect_left, insort
+from collections import Counter
+from difflib import SequenceMatcher
+
+# discord shows at most 25 autocomplete choices
+MAX_CHOICES = 25
+
+# match ranks, lower is better
+EXACT = 0
+PREFIX = 1
+WORD_PREFIX = 2
+SUBSTRING = 3
+FUZZY = 4
+
+FUZZY_RATIO = 0.75
+
+
+def normalize(text: str):
+    return " ".join(text.upper().split())
+
+
+def trigrams(text: str):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AutocompleteIndex:
+    """
+    Incrementally maintained index for autocomplete. Keeps a sorted key list
+    for prefix lookups, a sorted word list for word prefix lookups and a
+    trigram index for substring and typo tolerant matches.
+
+    Names that differ only in case or spacing share a key, every entry under
+    it is kept apart by its value.
+    """
+
+    def __init__(self, entries: dict = None):
+        self.entries = {}   # key -> {value: name}
+        self.keys = []      # sorted keys
+        self.words = []     # sorted (word, key)
+        self.grams = {}     # trigram -> {key}
+
+        # bulk load, sorting once is much cheaper than inserting one by one
+        for name, value in (entries or {}).items():
+            self.entries.setdefault(normalize(name), {})[name if value is None else value] = name
+
+        for key in self.entries:
+            self.words.extend((word, key) for word in key.split())
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, set()).add(key)
+
+        self.keys = sorted(self.entries)
+        self.words.sort()
+
+    def __len__(self):
+        return sum(len(named) for named in self.entries.values())
+
+    def __contains__(self, name: str):
+        return normalize(name) in self.entries
+
+    def add(self, name: str, value=None):
+        key = normalize(name)
+        named = self.entries.get(key)
+        if named is not None:
+            named[name if value is None else value] = name
+            return
+
+        self.entries[key] = {name if value is None else value: name}
+        insort(self.keys, key)
+
+        for word in key.split():
+            insort(self.words, (word, key))
+
+        for gram in trigrams(key):
+            self.grams.setdefault(gram, set()).add(key)
+
+    def remove(self, name: str, value=None):
+        """Removes the entry added with this name and value, other entries under the same key stay"""
+        key = normalize(name)
+        named = self.entries.get(key)
+        if named is None or named.pop(name if value is None else value, None) is None or named:
+            return
+
+        del self.entries[key]
+        del self.keys[bisect_left(self.keys, key)]
+
+        for word in key.split():
+            del self.words[bisect_left(self.words, (word, key))]
+
+        for gram in trigrams(key):
+            keys = self.grams[gram]
+            keys.discard(key)
+            if not keys:
+                del self.grams[gram]
+
+    def search(self, query: str, limit: int = MAX_CHOICES, exclude=()):
+        """
+        Returns up to `limit` (name, value) pairs, best matches first: exact,
+        prefix, word prefix, substring and then close misspellings. Entries
+        whose value is in `exclude` are left out.
+        """
+        query = normalize(query)
+        ranked = {}  # key -> (rank, -similarity)
+
+        def rank(key, score, similarity=1.0):
+            score = (score, -similarity)
+            if score < ranked.get(key, (FUZZY + 1,)):
+                ranked[key] = score
+
+        if not query:
+            for key in self.keys:
+                if len(ranked) >= limit + len(exclude):
+                    break
+                rank(key, PREFIX)
+
+            return self.results(ranked, limit, exclude)
+
+        if query in self.entries:
+            rank(query, EXACT)
+
+        # whole name prefix
+        i = bisect_left(self.keys, query)
+        while i < len(self.keys) and self.keys[i].startswith(query):
+            rank(self.keys[i], PREFIX)
+            i += 1
+
+        # prefix of any word in the name
+        first_word = query.split()[0]
+        i = bisect_left(self.words, (first_word,))
+        while i < len(self.words) and self.words[i][0].startswith(first_word):
+            key = self.words[i][1]
+            if query in key:
+                rank(key, WORD_PREFIX)
+            i += 1
+
+        # substrings and typos only need to look at names sharing a trigram
+        if len(ranked) < limit:
+            for key in self.candidates(query):
+                if key in ranked:
+                    continue
+
+                if query in key:
+                    rank(key, SUBSTRING)
+                else:
+                    similarity = self.similarity(query, key)
+                    if similarity >= FUZZY_RATIO:
+                        rank(key, FUZZY, similarity)
+
+        return self.results(ranked, limit, exclude)
+
+    def candidates(self, query: str):
+        # a name has to share a good part of the query's trigrams to be worth
+        # comparing character by character
+        grams = trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.grams.get(gram, ()))
+
+        needed = max(1, len(grams) // 3)
+        return [key for key, count in shared.items() if count >= needed]
+
+    @staticmethod
+    def similarity(query: str, key: str):
+        # best match against every run of words as long as the query
+        words = key.split()
+        length = len(query.split())
+        best = 0.0
+        for i in range(len(words) - length + 1):
+            matcher = SequenceMatcher(None, query, " ".join(words[i:i + length]))
+            if matcher.real_quick_ratio() >= FUZZY_RATIO and matcher.quick_ratio() >= FUZZY_RATIO:
+                best = max(best, matcher.ratio())
+
+        return best
+
+    def results(self, ranked: dict, limit: int, exclude=()):
+        best = sorted(ranked, key=lambda key: (ranked[key], len(key), key))
+        results = [(name, value) for key in best for value, name in self.entries[key].items() if value not in exclude]
+        return results[:limit]
+
+    def choices(self, query: str, limit: int = MAX_CHOICES, exclude=()):
+        """Results in the dict form send_autocomplete expects"""
+        return {name: value for name, value in self.search(query, limit, exclude)}
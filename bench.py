@@ -0,0 +1,235 @@
+"""
+Microbenchmarks for League operations on synthetic leagues.
+
+    python bench.py                                   # print how each operation scales
+    python bench.py --save bench.json                 # also keep the results
+    python bench.py --compare bench.json              # exit 1 if anything got slower than --threshold
+
+Every league has N teams with rosters drawn from charachters.txt, padded
+with generated players once the real pool runs out, and a number of
+pending trades per team. Loading is measured both from the binary snapshot
+and from the json snapshots alone, like the first start after an upgrade.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from league import League, load_characters
+from storage import binary_snapshot_path, write_snapshot
+
+SIZES = [10, 100, 1000]
+ROSTER_SIZE = 6
+TRADES_PER_TEAM = 2
+REPEAT = 200
+
+
+def make_pool(size: int):
+    pool = list(load_characters())
+    pool += [f'GENERATED PLAYER {i}' for i in range(max(0, size - len(pool)))]
+    return pool
+
+
+def make_league(directory: str, teams: int, roster_size: int = ROSTER_SIZE, trades_per_team: int = TRADES_PER_TEAM, seed: int = 0):
+    rng = random.Random(seed)
+
+    # half of the pool stays in free agency
+    pool = make_pool(teams * roster_size * 2)
+    players = rng.sample(pool, teams * roster_size)
+
+    team_docs = {}
+    for i in range(teams):
+        user_id = i + 1
+        team_docs[user_id] = {"user_id": user_id, "team_name": f'Team {user_id}', "players": players[i * roster_size:(i + 1) * roster_size]}
+
+    trade_docs = {}
+    for _ in range(teams * trades_per_team):
+        user1_id, user2_id = rng.sample(range(1, teams + 1), 2)
+        trade_id = len(trade_docs) + 1
+        trade_docs[trade_id] = {
+            "sides": [[user1_id, [rng.choice(team_docs[user1_id]["players"])]], [user2_id, [rng.choice(team_docs[user2_id]["players"])]]],
+            "destinations": [],
+            "accepted": [],
+            "message_id": trade_id,
+            "channel_id": 1,
+        }
+
+    # write the snapshots directly instead of paying for thousands of commits
+    teams_path = os.path.join(directory, "league.json")
+    trades_path = os.path.join(directory, "trades.json")
+    write_snapshot(teams_path, dict(enumerate(team_docs.values(), start=1)))
+    write_snapshot(trades_path, trade_docs)
+
+    return League(teams_path, trades_path, characters=pool)
+
+
+def measure(run, setup=None, teardown=None, repeat: int = REPEAT):
+    """Median seconds per call of run(state), setup and teardown aren't timed"""
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+
+        start = time.perf_counter()
+        result = run(state)
+        times.append(time.perf_counter() - start)
+
+        if teardown:
+            teardown(state, result)
+
+    return statistics.median(times)
+
+
+def bench_league(league: League, rng: random.Random, repeat: int):
+    user_ids = list(league.teams)
+
+    def random_team():
+        return rng.choice(user_ids)
+
+    def two_teams():
+        # teams can lose their last player to trades, only pick ones with players
+        while True:
+            user1_id, user2_id = rng.sample(user_ids, 2)
+            if league.get_players(user1_id) and league.get_players(user2_id):
+                return user1_id, user2_id
+
+    def free_agent_pick():
+        return random_team(), rng.choice(league.get_free_agents())
+
+    def owned_player():
+        user_id, player = free_agent_pick()
+        league.add_player(user_id, player)
+        return user_id, player
+
+    def trade_proposal():
+        user1_id, user2_id = two_teams()
+        return {user1_id: [rng.choice(league.get_players(user1_id))], user2_id: [rng.choice(league.get_players(user2_id))]}
+
+    def pending_trade():
+        trade = league.create_trade(trade_proposal())
+        league.assign_trade_message(trade, rng.getrandbits(48), 1)
+        return trade
+
+    def existing_trade():
+        trades = league.get_trades()
+        return rng.choice(trades) if trades else pending_trade()
+
+    # read only operations go first, trades processed later expire the
+    # conflicting proposals and shrink the trade book
+    return {
+        "get_team": measure(lambda state: league.get_team(random_team()), repeat=repeat),
+        "get_free_agents": measure(lambda state: league.get_free_agents(), repeat=repeat),
+        "get_trades": measure(lambda state: league.get_trades(), repeat=repeat),
+        "validate_trade": measure(lambda trade: trade.validate_trade(league), setup=existing_trade, repeat=repeat),
+        "validate_trades": measure(lambda trades: league.validate_trades(trades), setup=league.get_trades, repeat=repeat),
+        "add_player": measure(
+            lambda state: league.add_player(*state),
+            setup=free_agent_pick,
+            teardown=lambda state, result: league.remove_player(*state),
+            repeat=repeat,
+        ),
+        "remove_player": measure(lambda state: league.remove_player(*state), setup=owned_player, repeat=repeat),
+        "create_trade": measure(
+            lambda state: league.create_trade(state),
+            setup=trade_proposal,
+            teardown=lambda state, trade: league.cancel_trade(trade),
+            repeat=repeat,
+        ),
+        "process_trade": measure(lambda trade: league.process_trade(trade), setup=pending_trade, repeat=repeat),
+    }
+
+
+def bench_startup(league: League, repeat: int):
+    teams_path = league.storage.teams_path
+    trades_path = league.storage.trades_path
+
+    def load(state):
+        return League(teams_path, trades_path, characters=league.characters)
+
+    def drop_binary_snapshot():
+        os.remove(binary_snapshot_path(teams_path))
+
+    # closing writes the binary snapshot again if it was missing
+    return {
+        "load_league": measure(load, teardown=lambda state, loaded: loaded.close(), repeat=repeat),
+        "load_league_json": measure(load, setup=drop_binary_snapshot, teardown=lambda state, loaded: loaded.close(), repeat=repeat),
+    }
+
+
+def run(sizes, repeat: int):
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            league = make_league(directory, size)
+            timings = bench_league(league, random.Random(size), repeat)
+            league.close()
+
+            # loads are slow enough that a handful of runs is plenty
+            timings.update(bench_startup(league, max(3, repeat // 20)))
+
+        for operation, seconds in timings.items():
+            results.setdefault(operation, {})[str(size)] = seconds
+
+    return {"sizes": sizes, "results": results}
+
+
+def report(run_results):
+    sizes = [str(size) for size in run_results["sizes"]]
+    print(f'{"operation":<16}' + "".join(f'{size + " teams":>14}' for size in sizes) + f'{"scaling":>10}')
+
+    for operation, timings in run_results["results"].items():
+        row = f'{operation:<16}' + "".join(f'{timings[size] * 1e6:>12.1f}us' for size in sizes)
+
+        # growth from the smallest to the largest league
+        scaling = timings[sizes[-1]] / timings[sizes[0]] if timings[sizes[0]] else float("inf")
+        print(row + f'{scaling:>9.1f}x')
+
+
+def compare(run_results, baseline, threshold: float):
+    regressions = []
+    for operation, timings in run_results["results"].items():
+        for size, seconds in timings.items():
+            before = baseline["results"].get(operation, {}).get(size)
+            if before and seconds > before * (1 + threshold):
+                regressions.append(f'{operation} ({size} teams): {before * 1e6:.1f}us -> {seconds * 1e6:.1f}us')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark League operations")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="number of teams in each league")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="calls per operation and size")
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--compare", help="fail if slower than the results in this json file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown when comparing, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    results = run(args.sizes, args.repeat)
+    report(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f'- {regression}')
+            sys.exit(1)
+
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Bulk import and export of whole leagues, used by the /admin commands and
+from the command line:
+
+    python bulk.py export data/league.json season1.json
+    python bulk.py import data/league.json season1.csv --replace
+
+JSON holds teams, rosters and pending trades:
+
+    {"teams": [{"user_id": 1, "team_name": "...", "players": ["MARIO"]}],
+     "trades": [{"sides": [[1, ["MARIO"]], [2, ["LUIGI", "PEACH"]]]}]}
+
+A trade lists the players every team gives up, the proposing team first.
+Trades between more than two teams also need `"destinations": [[player,
+user_id], ...]` for every player. The older one for one form with
+user1_id, user2_id, user1_trade and user2_trade is still accepted.
+
+CSV holds teams and rosters only, one `user_id,team_name,player` row per
+player and a row with an empty player for a team without any.
+
+Every team in an import gets exactly the roster it lists, teams that aren't
+listed are left alone unless `replace` is set, in which case they are
+deleted along with every pending trade. The whole batch is validated first
+and then applied as a single commit.
+
+A running bot is asked to unload the league first and loads it again on
+its next command, see cluster.py.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+
+import cluster
+from league import League, ReturnCodes, Trade
+
+logger = logging.getLogger(__name__)
+
+CSV_FIELDS = ["user_id", "team_name", "player"]
+
+# errors shown to an admin are cut off after this many
+MAX_ERRORS = 20
+
+
+def export_league(league: League):
+    teams = [{"user_id": team["user_id"], "team_name": team["team_name"], "players": list(team["players"])} for team in league.get_teams()]
+    trades = [dict(trade.to_dict(), trade_id=trade.trade_id) for trade in league.get_trades()]
+    return {"teams": teams, "trades": trades}
+
+
+def export_csv(league: League):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(CSV_FIELDS)
+
+    for team in league.get_teams():
+        for player in team["players"] or [""]:
+            writer.writerow([team["user_id"], team["team_name"], player.title()])
+
+    return out.getvalue()
+
+
+def dumps(league: League, fmt: str = "json"):
+    if fmt == "csv":
+        return export_csv(league)
+
+    return json.dumps(export_league(league), indent=2)
+
+
+def parse_json(text: str):
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("expected an object with teams and trades")
+
+    teams = data.get("teams") or []
+    trades = data.get("trades") or []
+    if not isinstance(teams, list) or not isinstance(trades, list):
+        raise ValueError("teams and trades must be lists")
+
+    return {"teams": teams, "trades": trades}
+
+
+def parse_csv(text: str):
+    teams = {}
+    for line, row in enumerate(csv.DictReader(io.StringIO(text)), start=2):
+        try:
+            user_id = int(row["user_id"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'line {line}: user_id must be a number')
+
+        team = teams.setdefault(user_id, {"user_id": user_id, "team_name": (row.get("team_name") or "").strip(), "players": []})
+        if (row.get("player") or "").strip():
+            team["players"].append(row["player"])
+
+    return {"teams": list(teams.values()), "trades": []}
+
+
+def parse(text: str, filename: str = ""):
+    # csv by extension, json otherwise
+    if filename.lower().endswith(".csv"):
+        return parse_csv(text)
+
+    return parse_json(text)
+
+
+def validate(league: League, data: dict, replace: bool = False):
+    """
+    Checks a parsed import against the character pool and the ownership it
+    would leave behind, and normalizes it in place. Returns a list of
+    problems, empty if the batch can be applied.
+    """
+    errors = []
+    teams = data["teams"]
+    trades = data["trades"]
+
+    # owners after the import, teams that are being replaced start out empty
+    incoming = set()
+    for team in teams:
+        if isinstance(team, dict) and isinstance(team.get("user_id"), int):
+            incoming.add(team["user_id"])
+
+    owners = {}
+    if not replace:
+        for user_id, team in league.teams.items():
+            if user_id not in incoming:
+                for player in team["players"]:
+                    owners[player] = user_id
+
+    seen = set()
+    for i, team in enumerate(teams, start=1):
+        if not isinstance(team, dict) or not isinstance(team.get("user_id"), int):
+            errors.append(f'team #{i}: user_id must be a number')
+            continue
+
+        user_id = team["user_id"]
+        if user_id in seen:
+            errors.append(f'team {user_id}: listed more than once')
+            continue
+        seen.add(user_id)
+
+        team_name = team.get("team_name")
+        if not isinstance(team_name, str) or not team_name.strip():
+            errors.append(f'team {user_id}: team_name is missing')
+        else:
+            team["team_name"] = team_name.strip()
+
+        players = team.get("players") or []
+        if not isinstance(players, list):
+            errors.append(f'team {user_id}: players must be a list')
+            continue
+
+        team["players"] = [str(player).strip().upper() for player in players]
+        for player in team["players"]:
+            if not league.is_character(player):
+                errors.append(f'team {user_id}: {player.title()} is not a character')
+            elif player in owners:
+                errors.append(f'team {user_id}: {player.title()} is already on team {owners[player]}')
+            else:
+                owners[player] = user_id
+
+    team_ids = incoming | (set() if replace else set(league.teams))
+    messages = {}  # message_id -> number of the trade using it
+    for i, trade_dict in enumerate(trades, start=1):
+        try:
+            trade = Trade.from_dict(trade_dict)
+            trade = Trade(
+                {user_id: [str(player).strip().upper() for player in players] for user_id, players in trade.sides.items()},
+                trade.message_id,
+                channel_id=trade.channel_id,
+                destinations={str(player).strip().upper(): user_id for player, user_id in trade.destinations.items()},
+            )
+        except (AttributeError, KeyError, TypeError, ValueError):
+            errors.append(f'trade #{i}: needs sides, or user1_id, user2_id, user1_trade and user2_trade')
+            continue
+
+        # a message shows one trade, buttons on it act on whichever trade has it
+        if trade.message_id is not None:
+            if trade.message_id in messages:
+                errors.append(f'trade #{i}: message {trade.message_id} already belongs to trade #{messages[trade.message_id]}')
+            elif not replace and trade.message_id in league.trades.by_message:
+                errors.append(f'trade #{i}: message {trade.message_id} already belongs to a pending trade')
+            messages.setdefault(trade.message_id, i)
+
+        result = trade.check()
+        if result == ReturnCodes.SAME_TEAM:
+            errors.append(f'trade #{i}: needs at least two different teams')
+        elif result != ReturnCodes.SUCCESS:
+            errors.append(f'trade #{i}: every team must give up a player and every player must go to another team in the trade')
+        elif not all(user_id in team_ids for user_id in trade.sides):
+            errors.append(f'trade #{i}: every side needs a team')
+        else:
+            for player, from_id, _ in trade.moves():
+                if owners.get(player) != from_id:
+                    errors.append(f'trade #{i}: {player.title()} is not on team {from_id}')
+                    break
+
+        trades[i - 1] = trade.to_dict()
+
+    return errors
+
+
+def import_league(league: League, data: dict, replace: bool = False):
+    """Validates and applies a parsed import, returns SUCCESS or the list of problems"""
+    errors = validate(league, data, replace)
+    if errors:
+        return errors
+
+    league.import_league(data["teams"], data["trades"], replace)
+    return ReturnCodes.SUCCESS
+
+
+def trades_path_for(teams_path: str):
+    # sqlite keeps trades in the same file, tinydb next to the teams
+    if teams_path.endswith(".db"):
+        return None
+
+    return os.path.join(os.path.dirname(teams_path), "trades.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import or export a whole league")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="write a league to a json or csv file")
+    export_parser.add_argument("league", help="league.json or league.db of the league")
+    export_parser.add_argument("file", help="file to write, csv by extension and json otherwise")
+
+    import_parser = subparsers.add_parser("import", help="load teams, rosters and trades from a json or csv file")
+    import_parser.add_argument("league", help="league.json or league.db of the league")
+    import_parser.add_argument("file", help="file to read, csv by extension and json otherwise")
+    import_parser.add_argument("--replace", action="store_true", help="delete teams and trades that aren't in the file")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        lock = cluster.lock_league(args.league, cluster.Bus())
+    except cluster.LeagueBusy as e:
+        print(e)
+        sys.exit(1)
+
+    league = League(args.league, trades_path_for(args.league))
+    try:
+        if args.command == "export":
+            fmt = "csv" if args.file.lower().endswith(".csv") else "json"
+            with open(args.file, "w", newline="") as f:
+                f.write(dumps(league, fmt))
+
+            logger.info(f'Exported {len(league.teams)} teams to {args.file}')
+            return
+
+        with open(args.file, newline="") as f:
+            data = parse(f.read(), args.file)
+
+        result = import_league(league, data, args.replace)
+        if result != ReturnCodes.SUCCESS:
+            for error in result:
+                print(error)
+            sys.exit(1)
+
+        logger.info(f'Imported {len(data["teams"])} teams and {len(data["trades"])} trades from {args.file}')
+    finally:
+        league.close()
+        lock.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Running the bot as several worker processes that share one data directory:
+
+    python cluster.py --workers 4 --shards 8
+
+starts 4 copies of main.py that each connect a share of the bot's 8 gateway
+shards through AutoShardedBot, so every guild is served by exactly one
+worker. A worker that dies is restarted on its own while the others keep
+serving their guilds.
+
+Processes coordinate through the data directory:
+
+- a process holds an exclusive lock on a league for as long as it has it
+  loaded, so only one process ever writes a league and its in-memory copy
+  can't go stale behind its back
+- every process listens on a unix datagram socket in data/.bus/, one that
+  needs a league another process holds (a worker after its shards moved,
+  or bulk.py) asks everyone to release it and the holder flushes and
+  unloads it
+
+Both are left out on platforms without flock or unix sockets, where there
+is only ever one process.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BUS_DIR = os.getenv("BUS_DIR") or os.path.join("data", ".bus")
+
+# message asking whoever has a league loaded to unload it
+RELEASE = "release"
+
+# how long to wait for another process to release a league
+LOCK_TIMEOUT = 5
+LOCK_POLL = 0.05
+
+# a datagram is one message, these are tiny
+MAX_MESSAGE = 4096
+
+# a worker that dies sooner than this after starting is restarted with backoff
+MIN_UPTIME = 60
+MAX_RESTART_DELAY = 60
+
+
+class LeagueBusy(Exception):
+    def __init__(self, path: str):
+        super().__init__(f'{path} is in use by another process')
+        self.path = path
+
+
+class FileLock:
+    """Exclusive flock on a file, released when the holder closes it or dies"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def acquire(self, timeout: float = 0):
+        """True once held, False if another process kept it for `timeout` seconds"""
+        if fcntl is None:
+            return True
+
+        self.file = open(self.path, "a")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self.file.close()
+                    self.file = None
+                    return False
+
+                time.sleep(LOCK_POLL)
+
+    def release(self):
+        if self.file:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+
+def lock_path(teams_path: str):
+    # the same for every process no matter how it spelled the path
+    return os.path.realpath(teams_path + ".lock")
+
+
+def lock_league(teams_path: str, bus: "Bus" = None, timeout: float = LOCK_TIMEOUT):
+    """
+    Locks a league for this process. If another process has it, asks it to
+    release the league over the bus until it does or `timeout` runs out,
+    then raises LeagueBusy.
+    """
+    directory = os.path.dirname(teams_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    lock = FileLock(lock_path(teams_path))
+    deadline = time.monotonic() + timeout
+    while not lock.acquire():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LeagueBusy(teams_path)
+
+        # asked again every round, the holder may have loaded it again meanwhile
+        if bus:
+            bus.broadcast({"type": RELEASE, "path": lock.path})
+
+        if lock.acquire(min(remaining, 1)):
+            break
+
+    return lock
+
+
+async def lock_league_async(teams_path: str, bus: "Bus" = None, timeout: float = LOCK_TIMEOUT):
+    """lock_league for the event loop, polls without blocking it while the holder lets go"""
+    directory = os.path.dirname(teams_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    lock = FileLock(lock_path(teams_path))
+    deadline = time.monotonic() + timeout
+    asked = None
+    while not lock.acquire():
+        now = time.monotonic()
+        if now >= deadline:
+            raise LeagueBusy(teams_path)
+
+        # asked again every second, the holder may have loaded it again meanwhile
+        if bus and (asked is None or now - asked >= 1):
+            bus.broadcast({"type": RELEASE, "path": lock.path})
+            asked = now
+
+        await asyncio.sleep(LOCK_POLL)
+
+    return lock
+
+
+class Bus:
+    """
+    Fire and forget messages between the processes sharing a data directory.
+    Every process binds `<directory>/<pid>.sock`, broadcast() sends a json
+    message to all the others.
+    """
+
+    def __init__(self, directory: str = BUS_DIR, on_message=None):
+        self.directory = directory
+        self.on_message = on_message
+        self.path = os.path.join(directory, f'{os.getpid()}.sock')
+        self.sock = None
+        self.loop = None
+
+    def start(self):
+        """Starts receiving on the running event loop"""
+        if not hasattr(socket, "AF_UNIX"):
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            # left behind by an earlier process with the same pid
+            os.remove(self.path)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.sock.fileno(), self.receive)
+
+    def receive(self):
+        while True:
+            try:
+                data = self.sock.recv(MAX_MESSAGE)
+            except BlockingIOError:
+                return
+
+            try:
+                message = json.loads(data)
+            except ValueError:
+                logger.warning(f'Ignoring malformed bus message {data[:100]!r}')
+                continue
+
+            try:
+                self.on_message(message)
+            except Exception:
+                logger.exception("Bus message handler failed")
+
+    def broadcast(self, message: dict):
+        """Sends a message to every other process, returns how many got it"""
+        if not hasattr(socket, "AF_UNIX") or not os.path.isdir(self.directory):
+            return 0
+
+        data = json.dumps(message).encode()
+        sent = 0
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if path == self.path or not name.endswith(".sock"):
+                    continue
+
+                try:
+                    sock.sendto(data, path)
+                    sent += 1
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # nobody is listening anymore, the process is gone
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                except OSError as e:
+                    logger.warning(f'Could not send bus message to {name}: {e!r}')
+
+        return sent
+
+    def close(self):
+        if self.sock:
+            # also fine once the loop has been closed
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def worker_env(worker: int, workers: int, shards: int):
+    env = dict(os.environ, SHARD_COUNT=str(shards), SHARD_IDS=",".join(str(shard) for shard in range(worker, shards, workers)))
+
+    # metrics are per process, give each worker its own port and file
+    if os.getenv("METRICS_PORT"):
+        env["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + worker)
+    if os.getenv("METRICS_FILE"):
+        env["METRICS_FILE"] = f'{os.environ["METRICS_FILE"]}.{worker}'
+
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as several worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--shards", type=int, default=None, help="gateway shards split between the workers, one per worker by default")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    workers = max(1, args.workers)
+    shards = max(workers, args.shards or workers)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+    processes = {}  # worker -> (Popen, started)
+    delays = {worker: 1 for worker in range(workers)}
+    restarts = {}   # worker -> monotonic time to restart at
+    stopping = False
+
+    def spawn(worker: int):
+        env = worker_env(worker, workers, shards)
+        logger.info(f'Starting worker {worker} with shards {env["SHARD_IDS"]} of {shards}')
+        processes[worker] = (subprocess.Popen([sys.executable, script], env=env), time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process, _ in processes.values():
+            process.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker in range(workers):
+        spawn(worker)
+
+    while processes or (restarts and not stopping):
+        time.sleep(0.5)
+
+        for worker, (process, started) in list(processes.items()):
+            if process.poll() is None:
+                continue
+
+            del processes[worker]
+            if stopping:
+                continue
+
+            # crash loops back off, a worker that ran for a while starts over right away
+            if time.monotonic() - started < MIN_UPTIME:
+                delays[worker] = min(MAX_RESTART_DELAY, delays[worker] * 2)
+            else:
+                delays[worker] = 1
+
+            logger.warning(f'Worker {worker} exited with {process.returncode}, restarting in {delays[worker]}s')
+            restarts[worker] = time.monotonic() + delays[worker]
+
+        for worker, at in list(restarts.items()):
+            if stopping:
+                restarts.clear()
+            elif at <= time.monotonic():
+                del restarts[worker]
+                spawn(worker)
+
+    logger.info("All workers stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Snake drafts. Teams pick one player at a time in a set order, reversed every
+other round with `snake`, and each pick has `pick_seconds` on the clock.
+
+- a team can queue players ahead of time. When its turn comes the first
+  queued player that's still available is picked right away, players taken
+  in the meantime are skipped
+- a run of teams with usable queues is picked through in one go, no waiting
+  on a timer or a command in between
+- a team that runs out of time gets its first available queued player, or
+  the first free agent in pool order if nothing in its queue is left
+
+Every pick goes through League.add_players, and all picks made in one go are
+committed together with the new draft state as a single record, so the
+draft can't get ahead of or behind the rosters and picks up where it left
+off after a restart.
+
+The state lives in the league's draft document, DraftClock runs one asyncio
+timer per league for the pick on the clock.
+"""
+import asyncio
+import logging
+import time
+
+from league import League, ReturnCodes
+
+logger = logging.getLogger(__name__)
+
+# how a pick was made
+PICKED = "picked"
+QUEUED = "queued"
+AUTO = "auto"
+# the team was deleted before its turn
+SKIPPED = "skipped"
+
+DEFAULT_PICK_SECONDS = 120
+
+
+class Draft:
+    def __init__(self, order: list, rounds: int, pick_seconds: float = DEFAULT_PICK_SECONDS, snake: bool = True, pick: int = 0, deadline: float = None,
+                 queues: dict = None, picks: list = None, channel_id: int = None, cancelled: bool = False):
+        self.order = list(order)
+        self.rounds = rounds
+        self.pick_seconds = pick_seconds
+        self.snake = snake
+        # index of the pick on the clock
+        self.pick = pick
+        # time.time() the pick on the clock runs out at
+        self.deadline = deadline
+        self.queues = queues or {}  # user_id -> [player]
+        self.picks = picks or []    # [user_id, player, how] for every pick made so far
+        # where picks are announced
+        self.channel_id = channel_id
+        self.cancelled = cancelled
+
+    @property
+    def total_picks(self):
+        return len(self.order) * self.rounds
+
+    @property
+    def done(self):
+        return self.cancelled or self.pick >= self.total_picks
+
+    def picker(self, pick: int):
+        number, slot = divmod(pick, len(self.order))
+        if self.snake and number % 2 == 1:
+            slot = len(self.order) - 1 - slot
+
+        return self.order[slot]
+
+    @property
+    def on_the_clock(self):
+        return None if self.done else self.picker(self.pick)
+
+    def record(self, user_id: int, player: str, how: str):
+        self.picks.append([user_id, player, how])
+        self.pick += 1
+
+    def end(self):
+        # no players left to pick
+        self.pick = self.total_picks
+
+    @staticmethod
+    def from_dict(draft_dict: dict):
+        return Draft(
+            draft_dict["order"],
+            draft_dict["rounds"],
+            draft_dict["pick_seconds"],
+            draft_dict["snake"],
+            draft_dict["pick"],
+            draft_dict.get("deadline"),
+            {user_id: list(players) for user_id, players in draft_dict.get("queues", [])},
+            [list(pick) for pick in draft_dict.get("picks", [])],
+            draft_dict.get("channel_id"),
+            draft_dict.get("cancelled", False),
+        )
+
+    def to_dict(self):
+        # a fresh document every time, stored ones are never changed in place
+        return {
+            "order": list(self.order),
+            "rounds": self.rounds,
+            "pick_seconds": self.pick_seconds,
+            "snake": self.snake,
+            "pick": self.pick,
+            "deadline": self.deadline,
+            # pairs since json object keys can only be strings
+            "queues": [[user_id, list(players)] for user_id, players in self.queues.items() if players],
+            "picks": [list(pick) for pick in self.picks],
+            "channel_id": self.channel_id,
+            "cancelled": self.cancelled,
+        }
+
+
+def get_draft(league: League):
+    return Draft.from_dict(league.draft) if league.draft else None
+
+
+def running_draft(league: League):
+    draft = get_draft(league)
+    return draft if draft and not draft.done else None
+
+
+def available(league: League, player: str, taken):
+    return player not in taken and league.is_free_agent(player)
+
+
+def take_queued(league: League, draft: Draft, user_id: int, taken):
+    """Pops user_id's queue up to its first available player, None if there is none"""
+    queue = draft.queues.get(user_id, [])
+    while queue:
+        player = queue.pop(0)
+        if available(league, player, taken):
+            return player
+
+    return None
+
+
+def advance(league: League, draft: Draft, picks: list, taken: set, now: float):
+    """
+    Makes every pick that's already decided by a queue, until a team has to
+    choose itself or the draft is over, and starts the clock for that team.
+    """
+    while not draft.done:
+        user_id = draft.on_the_clock
+        if user_id not in league.teams:
+            draft.record(user_id, None, SKIPPED)
+            continue
+
+        if league.next_free_agent(taken) is None:
+            draft.end()
+            break
+
+        player = take_queued(league, draft, user_id, taken)
+        if player is None:
+            break
+
+        make(draft, picks, taken, user_id, player, QUEUED)
+
+    draft.deadline = None if draft.done else now + draft.pick_seconds
+
+
+def make(draft: Draft, picks: list, taken: set, user_id: int, player: str, how: str):
+    picks.append((draft.pick, user_id, player, how))
+    taken.add(player)
+    draft.record(user_id, player, how)
+
+
+def commit(league: League, draft: Draft, picks: list):
+    """Applies picks and the new draft state as one record, returns the picks"""
+    league.add_players([(user_id, player) for _, user_id, player, _ in picks], draft.to_dict())
+    if picks:
+        logger.info(f'Draft made {len(picks)} picks, now at pick {draft.pick} of {draft.total_picks}')
+
+    return picks
+
+
+def start_draft(league: League, order: list, rounds: int, pick_seconds: float = DEFAULT_PICK_SECONDS, snake: bool = True, channel_id: int = None, now: float = None):
+    if running_draft(league):
+        return ReturnCodes.DRAFT_IN_PROGRESS
+
+    order = list(dict.fromkeys(order))
+    if not order or any(user_id not in league.teams for user_id in order):
+        return ReturnCodes.NO_TEAM
+
+    draft = Draft(order, rounds, pick_seconds, snake, channel_id=channel_id)
+    advance(league, draft, [], set(), time.time() if now is None else now)
+    commit(league, draft, [])
+
+    return draft
+
+
+def cancel_draft(league: League):
+    draft = running_draft(league)
+    if draft is None:
+        return ReturnCodes.NO_DRAFT
+
+    draft.cancelled = True
+    draft.deadline = None
+    league.set_draft(draft.to_dict())
+
+    return ReturnCodes.SUCCESS
+
+
+def make_pick(league: League, user_id: int, player: str, now: float = None):
+    """Picks a player for the team on the clock, returns every pick made as (pick, user_id, player, how)"""
+    draft = running_draft(league)
+    if draft is None:
+        return ReturnCodes.NO_DRAFT
+
+    if draft.on_the_clock != user_id:
+        return ReturnCodes.NOT_YOUR_PICK
+
+    if user_id not in league.teams:
+        return ReturnCodes.NO_TEAM
+
+    if not league.is_free_agent(player):
+        return ReturnCodes.NOT_FREE_AGENT
+
+    picks = []
+    taken = set()
+    make(draft, picks, taken, user_id, player, PICKED)
+    advance(league, draft, picks, taken, time.time() if now is None else now)
+
+    return commit(league, draft, picks)
+
+
+def queue_players(league: League, user_id: int, players: list, now: float = None):
+    """
+    Replaces user_id's queue. A team that's on the clock picks from it right
+    away, returns the picks made like make_pick.
+    """
+    draft = running_draft(league)
+    if draft is None:
+        return ReturnCodes.NO_DRAFT
+
+    if user_id not in draft.order:
+        return ReturnCodes.NO_TEAM
+
+    if any(not league.is_character(player) for player in players):
+        return ReturnCodes.NOT_FREE_AGENT
+
+    draft.queues[user_id] = list(dict.fromkeys(players))
+
+    picks = []
+    if draft.on_the_clock == user_id:
+        # keeps the time left on the clock if nothing in the queue is available
+        deadline = draft.deadline
+        advance(league, draft, picks, set(), time.time() if now is None else now)
+        if not picks:
+            draft.deadline = deadline
+
+    return commit(league, draft, picks)
+
+
+def pick_timed_out(league: League, pick: int, now: float = None):
+    """
+    Auto-picks for the team on the clock if `pick` is still on the clock and
+    out of time, then lets the next queues pick. Returns the picks made.
+    """
+    now = time.time() if now is None else now
+    draft = running_draft(league)
+    if draft is None or draft.pick != pick or draft.deadline > now:
+        # picked in the meantime, the timer of the new pick is already set
+        return []
+
+    picks = []
+    taken = set()
+    user_id = draft.on_the_clock
+    if user_id in league.teams:
+        player = take_queued(league, draft, user_id, taken) or league.next_free_agent()
+        if player is None:
+            draft.end()
+        else:
+            make(draft, picks, taken, user_id, player, AUTO)
+    else:
+        draft.record(user_id, None, SKIPPED)
+
+    advance(league, draft, picks, taken, now)
+
+    return commit(league, draft, picks)
+
+
+class DraftClock:
+    """
+    One asyncio timer per league with a running draft, due at the deadline
+    of the pick on the clock. Nothing polls, `on_timeout(guild_id, pick)`
+    is awaited when a timer goes off.
+    """
+
+    def __init__(self, on_timeout):
+        self.on_timeout = on_timeout
+        self.timers = {}  # guild_id -> asyncio.TimerHandle
+        self.tasks = set()
+
+    def schedule(self, guild_id: int, draft: Draft):
+        """Sets the timer for the draft's current pick, replacing the one set before"""
+        self.cancel(guild_id)
+        if draft is None or draft.done:
+            return
+
+        delay = max(0, draft.deadline - time.time())
+        self.timers[guild_id] = asyncio.get_running_loop().call_later(delay, self.fire, guild_id, draft.pick)
+
+    def fire(self, guild_id: int, pick: int):
+        self.timers.pop(guild_id, None)
+
+        task = asyncio.create_task(self.on_timeout(guild_id, pick))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def cancel(self, guild_id: int):
+        timer = self.timers.pop(guild_id, None)
+        if timer:
+            timer.cancel()
+
+    def close(self):
+        for guild_id in list(self.timers):
+            self.cancel(guild_id)
@@ -0,0 +1,23 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def fan_out(func, items, limit: int = 8):
+    """
+    Await func(item) for every item concurrently with at most `limit` calls
+    in flight. Results come back in the same order as `items`. A call that
+    raises doesn't abort the others, its exception is returned in its place.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            try:
+                return await func(item)
+            except Exception as e:
+                logger.warning(f'{getattr(func, "__name__", func)}({item!r}) failed: {e!r}')
+                return e
+
+    return await asyncio.gather(*(run(item) for item in items))
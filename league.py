@@ -1,14 +1,27 @@
-import tinydb
 from enum import Enum
+from functools import lru_cache
+from itertools import compress
 import logging
+import time
+from storage import open_storage
+from autocomplete import AutocompleteIndex
+import ledger
+from ledger import LeagueStats
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-with open("charachters.txt") as f:
-    ALL_CHARACHTERS = f.readlines()
+# events between snapshots of the league statistics
+STATS_SNAPSHOT_EVERY = 500
 
-ALL_CHARACHTERS = [x.strip().upper() for x in ALL_CHARACHTERS]  
+
+@lru_cache(maxsize=None)
+def load_characters(path: str = "charachters.txt"):
+    # read on first use rather than on import
+    with open(path) as f:
+        return tuple(x.strip().upper() for x in f if x.strip())
+
+# maps the "0" and "1" of bin() to falsy and truthy bytes
+BIT_FLAGS = bytes.maketrans(b"01", b"\x00\x01")
 
 class ReturnCodes(Enum):
     SUCCESS = 0
@@ -18,27 +31,264 @@ class ReturnCodes(Enum):
     NOT_ON_TEAM = 4
     INVALID_TRADE = 5
     SAME_TEAM = 6
+    CONFLICT = 7
+    WAITING_FOR_TEAMS = 8
+    DRAFT_IN_PROGRESS = 9
+    NO_DRAFT = 10
+    NOT_YOUR_PICK = 11
+
+
+class CharacterPool:
+    """
+    Interns player names to small integer ids so rosters can be bitsets,
+    bit i of a roster is set when the player with id i is on it. Players
+    that aren't in the pool (renamed or removed from charachters.txt) get
+    ids past the pool so they can still be owned but never become free agents.
+    """
+
+    def __init__(self, characters: list):
+        self.names = list(dict.fromkeys(characters))
+        self.ids = {player: i for i, player in enumerate(self.names)}
+
+        # ids below size are the pool itself
+        self.size = len(self.names)
+        self.mask = (1 << self.size) - 1
+
+    def intern(self, player: str):
+        player_id = self.ids.get(player)
+        if player_id is None:
+            player_id = self.ids[player] = len(self.names)
+            self.names.append(player)
+
+        return player_id
+
+    def bits(self, players):
+        mask = 0
+        for player in players:
+            mask |= 1 << self.intern(player)
+
+        return mask
+
+    def players(self, mask: int):
+        # lowest bit first so players come out in pool order, done with
+        # string and bytes ops instead of a python loop over the bits
+        bits = bin(mask)[:1:-1].encode().translate(BIT_FLAGS)
+        return list(compress(self.names, bits))
 
 
 class League:
-    def __init__(self, teams_db: str, trades_db: str):
-        self.teams_db = tinydb.TinyDB(teams_db)
-        logger.info("Teams DB: %s Loaded Successfully", teams_db)
+    def __init__(self, teams_db: str, trades_db: str = None, guild_id: int = None, characters: list = None, write_behind: bool = False):
+        self.guild_id = guild_id
 
-        self.trades_db = tinydb.TinyDB(trades_db)
-        logger.info("Trades DB: %s Loaded Successfully", trades_db)
+        # the player pool, every league uses charachters.txt unless told otherwise
+        self.characters = load_characters() if characters is None else characters
+        self.pool = CharacterPool(self.characters)
 
+        self.storage = open_storage(teams_db, trades_db, write_behind)
+        teams, trades = self.storage.load()
+        logger.info("Teams DB: %s Loaded Successfully", teams_db)
+        logger.info("Trades DB: %s Loaded Successfully", trades_db)
 
-        self.free_agents = self.get_free_agents()
-        logger.info(f"Free Agents: {len(self.free_agents)}")
+        # in-memory indexes, the storage is only used for persistence
+        self.teams = {}          # user_id -> team
+        self.player_owners = {}  # player -> user_id
+        self.rosters = {}        # user_id -> bitset of player ids
+        self.owned = 0           # union of every roster
 
-        logger.info(f'Loaded {len(self.teams_db)} teams and {len(self.trades_db)} trades')
+        # autocomplete indexes, built on the first search and kept up to
+        # date as rosters change after that
+        self.character_index = None
+        self.free_agent_index = None
+        self.roster_indexes = {}  # user_id -> AutocompleteIndex
+        self.team_index = None
+
+        for team in teams.values():
+            self.index_team(team)
+
+        self.trades = TradeBook()
+        for trade_id, trade_dict in trades.items():
+            self.trades.add(trade_id, trade_dict)
+
+        # statistics from the last snapshot plus the events recorded since
+        stats, events = self.storage.load_stats()
+        self.stats = LeagueStats.from_dict(stats) if stats else LeagueStats()
+        if self.stats.last_trade is None:
+            self.stats.last_trade = max((event["trade_id"] for event in self.storage.read_events() if "trade_id" in event), default=0)
+        for event in events:
+            self.stats.apply(event)
+
+        # past every trade still pending and every one the ledger remembers,
+        # so finished trades don't share their id with a new one
+        self.next_trade_id = max(max(trades, default=0), self.stats.last_trade) + 1
+
+        self.next_event_id = self.stats.last_event + 1
+        self.unsaved_events = len(events)
+
+        # the document draft.py keeps its state in, None until the first draft
+        self.draft = self.storage.load_draft()
+
+        # called with (players, user_ids, expired_trades) after every roster change
+        self.listeners = []
+
+        # bumped by every change, anything derived from the league is current
+        # as long as the version it was built at is
+        self.version = 0
+
+        logger.info(f'Loaded {len(self.teams)} teams and {len(self.trades)} trades')
+
+    def close(self):
+        if self.unsaved_events:
+            self.storage.save_stats(self.stats.to_dict())
+            self.unsaved_events = 0
+
+        self.storage.close()
+
+    def event(self, kind: str, trade: "Trade" = None, **fields):
+        event = {"id": self.next_event_id, "time": time.time(), "type": kind}
+        self.next_event_id += 1
+
+        if trade is not None:
+            event.update(trade_id=trade.trade_id, sides=trade.to_dict()["sides"], moves=[list(move) for move in trade.moves()])
+
+        event.update(fields)
+        return event
+
+    def commit(self, teams: dict = None, trades: dict = None, events: list = (), draft: dict = None):
+        """Persists one operation along with its ledger events and folds them into the statistics"""
+        self.storage.commit(teams=teams, trades=trades, events=list(events), draft=draft)
+        self.version += 1
+        if draft is not None:
+            self.draft = draft
+
+        for event in events:
+            self.stats.apply(event)
+
+        self.unsaved_events += len(events)
+        if self.unsaved_events >= STATS_SNAPSHOT_EVERY:
+            self.storage.save_stats(self.stats.to_dict())
+            self.unsaved_events = 0
+
+    def expire_events(self, expired):
+        return [self.event(ledger.EXPIRE, trade) for trade in expired]
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def expire_trades(self, players=(), user_ids=()):
+        # only trades touching the changed players or teams can have become invalid
+        trade_ids = set()
+        for player in players:
+            trade_ids.update(self.trades.for_player(player))
+        for user_id in user_ids:
+            trade_ids.update(self.trades.for_user(user_id))
+
+        return self.remove_invalid_trades([Trade.from_dict(self.trades.get(trade_id), trade_id) for trade_id in sorted(trade_ids)])
+
+    def remove_invalid_trades(self, trades):
+        expired = []
+        for trade, result in zip(trades, self.validate_trades(trades)):
+            if result != ReturnCodes.SUCCESS:
+                self.trades.remove(trade.trade_id)
+                expired.append(trade)
+
+        return expired
+
+    def sweep_trades(self):
+        # full check of every open trade, for data written before roster
+        # changes expired trades on their own
+        expired = self.remove_invalid_trades(self.get_trades())
+        if expired:
+            self.commit(trades={trade.trade_id: None for trade in expired}, events=self.expire_events(expired))
+            self.roster_changed(expired=expired)
+
+        return expired
+
+    def roster_changed(self, players=(), user_ids=(), expired=()):
+        if expired:
+            logger.info(f'Expired {len(expired)} trades')
+
+        for listener in self.listeners:
+            try:
+                listener(players, user_ids, expired)
+            except Exception:
+                logger.exception("Roster change listener failed")
+
+    def index_team(self, team: dict):
+        self.teams[team["user_id"]] = team
+        if self.team_index is not None:
+            self.team_index.add(team["team_name"], str(team["user_id"]))
+
+        for player in team["players"]:
+            self.player_owners[player] = team["user_id"]
+
+        roster = self.pool.bits(team["players"])
+        self.rosters[team["user_id"]] = roster
+        self.owned |= roster
+
+    def unindex_team(self, team: dict):
+        # players on a deleted team go back into the free agent pool, the
+        # team keeps its list so callers can still see who was released
+        players = list(team["players"])
+        for player in players:
+            self.move_player(player, None)
+        team["players"] = players
+
+        del self.teams[team["user_id"]]
+        self.roster_indexes.pop(team["user_id"], None)
+        del self.rosters[team["user_id"]]
+        if self.team_index is not None:
+            self.team_index.remove(team["team_name"], str(team["user_id"]))
+
+    def move_player(self, player: str, user_id: int):
+        """Moves a player onto user_id's team, or into free agency if user_id is None"""
+        bit = 1 << self.pool.intern(player)
+
+        old_owner = self.player_owners.pop(player, None)
+        if old_owner is None:
+            old_index = self.free_agent_index
+        else:
+            # the bit is known to be set, xor clears it without building ~bit
+            self.rosters[old_owner] ^= bit
+            self.owned ^= bit
+            self.teams[old_owner]["players"].remove(player)
+            old_index = self.roster_indexes.get(old_owner)
+
+        if user_id is None:
+            new_index = self.free_agent_index
+        else:
+            self.rosters[user_id] |= bit
+            self.owned |= bit
+            self.player_owners[player] = user_id
+            self.teams[user_id]["players"].append(player)
+            new_index = self.roster_indexes.get(user_id)
+
+        # indexes that haven't been built yet will see the change when they are
+        if old_index is not None:
+            old_index.remove(player.title())
+        if new_index is not None:
+            new_index.add(player.title())
 
     def get_team(self, user_id: int):
-        return self.teams_db.get(tinydb.Query().user_id == user_id)
+        return self.teams.get(user_id)
+
+    def get_owner(self, player: str):
+        return self.player_owners.get(player)
+
+    def is_character(self, player: str):
+        player_id = self.pool.ids.get(player)
+        return player_id is not None and player_id < self.pool.size
+
+    def owns(self, user_id: int, player: str):
+        # shifting the bit down is much cheaper than masking a wide roster
+        player_id = self.pool.ids.get(player)
+        return player_id is not None and bool(self.rosters.get(user_id, 0) >> player_id & 1)
+
+    def is_free_agent(self, player: str):
+        player_id = self.pool.ids.get(player)
+        return player_id is not None and player_id < self.pool.size and not self.owned >> player_id & 1
 
     def get_teams(self, as_choices: bool = False):
-        teams = self.teams_db.all()
+        teams = list(self.teams.values())
 
         if as_choices:
             choices = {}
@@ -51,28 +301,86 @@ class League:
 
     def create_team(self, user_id: int, team_name: str):
         # check if user already has a team
-        if self.teams_db.contains(tinydb.Query().user_id == user_id):
+        if user_id in self.teams:
             return ReturnCodes.ALREADY_HAS_TEAM
 
         else:
-            self.teams_db.insert({"user_id": user_id, "team_name": team_name, "players": []})
-            return self.get_team(user_id)
+            team = {"user_id": user_id, "team_name": team_name, "players": []}
+            self.commit(teams={user_id: team}, events=[self.event(ledger.CREATE, user_id=user_id, team_name=team_name)])
+            self.index_team(team)
+            return team
+
+    def import_league(self, teams: list, trades: list = (), replace: bool = False):
+        """
+        Applies a bulk import that bulk.validate() accepted as one commit.
+        Every listed team gets exactly the listed roster, with `replace` the
+        teams that aren't listed and all pending trades are dropped.
+        """
+        incoming = {team["user_id"] for team in teams}
+        removed = [user_id for user_id in self.teams if user_id not in incoming] if replace else []
+
+        # the free agent index is rebuilt on the next search instead of
+        # being updated player by player
+        self.free_agent_index = None
+
+        players = set()
+        for user_id in removed + [user_id for user_id in incoming if user_id in self.teams]:
+            team = self.teams[user_id]
+            self.unindex_team(team)
+            players.update(team["players"])
+
+        team_docs = {user_id: None for user_id in removed}
+        for team in teams:
+            team = {"user_id": team["user_id"], "team_name": team["team_name"], "players": list(team["players"])}
+            self.index_team(team)
+            team_docs[team["user_id"]] = team
+            players.update(team["players"])
+
+        if replace:
+            expired = [Trade.from_dict(trade_dict, trade_id) for trade_id, trade_dict in list(self.trades.items())]
+            for trade in expired:
+                self.trades.remove(trade.trade_id)
+        else:
+            expired = self.expire_trades(players, list(team_docs))
+
+        trade_docs = {trade.trade_id: None for trade in expired}
+        for trade_dict in trades:
+            trade = Trade.from_dict(trade_dict, self.next_trade_id)
+            self.next_trade_id += 1
+            trade_docs[trade.trade_id] = trade.to_dict()
+            self.trades.add(trade.trade_id, trade_docs[trade.trade_id])
+
+        events = [self.event(
+            ledger.IMPORT,
+            teams=[[team["user_id"], team["players"]] for team in team_docs.values() if team],
+            removed=removed,
+            released=sorted(player for player in players if player not in self.player_owners),
+        )]
+        events += self.expire_events(expired)
+
+        self.commit(teams=team_docs, trades=trade_docs, events=events)
+        self.roster_changed(sorted(players), list(team_docs), expired)
+
+        logger.info(f'Imported {len(teams)} teams and {len(trades)} trades, removed {len(removed)} teams')
+        return ReturnCodes.SUCCESS
 
     def delete_team(self, user_id: int):
         team = self.get_team(user_id)
 
         if team:
-            self.teams_db.remove(tinydb.Query().user_id == user_id)
+            self.unindex_team(team)
+            expired = self.expire_trades(user_ids=[user_id])
+            events = [self.event(ledger.DELETE, user_id=user_id, team_name=team["team_name"], players=team["players"])]
+            self.commit(teams={user_id: None}, trades={trade.trade_id: None for trade in expired}, events=events + self.expire_events(expired))
+            self.roster_changed(team["players"], [user_id], expired)
+
             return ReturnCodes.SUCCESS
         else:
             return ReturnCodes.NO_TEAM
 
     def get_free_agents(self, as_choices: bool = False):
-        all_players = ALL_CHARACHTERS.copy()
-        
-        for team in self.teams_db.all():
-            for player in team["players"]:
-                all_players.remove(player)
+        # everyone in the pool that isn't on any roster
+        all_players = self.pool.players(self.pool.mask & ~self.owned)
 
         if as_choices:
             choices = {}
@@ -84,34 +392,105 @@ class League:
         return all_players
 
     def add_player(self, user_id: int, player: str):
-        team = self.get_team(user_id)
-        if team:
-            if player not in self.free_agents:
-                return ReturnCodes.NOT_FREE_AGENT
+        return self.add_players([(user_id, player)])[0]
+
+    def add_players(self, picks, draft: dict = None):
+        """
+        add_player for a batch of (user_id, player) picks, in order, persisted
+        as one record along with the new draft state if given. Returns the
+        ReturnCodes of every pick.
+        """
+        results = []
+        players = []
+        user_ids = []
+        for user_id, player in picks:
+            if user_id not in self.teams:
+                results.append(ReturnCodes.NO_TEAM)
+            elif not self.is_free_agent(player):
+                results.append(ReturnCodes.NOT_FREE_AGENT)
+            else:
+                self.move_player(player, user_id)
+                players.append(player)
+                user_ids.append(user_id)
+                results.append(ReturnCodes.SUCCESS)
+
+        if not players and draft is None:
+            return results
+
+        expired = self.expire_trades(players=players)
+        events = [self.event(ledger.ADD, user_id=user_id, player=player) for user_id, player in zip(user_ids, players)] + self.expire_events(expired)
+        self.commit(teams={user_id: self.teams[user_id] for user_id in user_ids}, trades={trade.trade_id: None for trade in expired}, events=events, draft=draft)
+        if players:
+            self.roster_changed(players, list(dict.fromkeys(user_ids)), expired)
+
+        return results
+
+    def next_free_agent(self, exclude=()):
+        """The first free agent in pool order that isn't in `exclude`, None if there is none"""
+        free = self.pool.mask & ~self.owned
+        for player in exclude:
+            player_id = self.pool.ids.get(player)
+            if player_id is not None:
+                free &= ~(1 << player_id)
+
+        if not free:
+            return None
 
-            team["players"].append(player)
-            self.teams_db.update(team, tinydb.Query().user_id == user_id)
-            self.free_agents.remove(player)
+        # lowest set bit
+        return self.pool.names[(free & -free).bit_length() - 1]
 
-            return ReturnCodes.SUCCESS
-        else:
-            return ReturnCodes.NO_TEAM
+    def set_draft(self, draft: dict):
+        self.commit(draft=draft)
 
     def remove_player(self, user_id: int, player: str):
         team = self.get_team(user_id)
 
         if team:
-            if player not in team["players"]:
+            if not self.owns(user_id, player):
                 return ReturnCodes.NOT_ON_TEAM
 
-            team["players"].remove(player)
-            self.teams_db.update(team, tinydb.Query().user_id == user_id)
-            self.free_agents.append(player)
+            self.move_player(player, None)
+            expired = self.expire_trades(players=[player])
+            events = [self.event(ledger.DROP, user_id=user_id, player=player)] + self.expire_events(expired)
+            self.commit(teams={user_id: team}, trades={trade.trade_id: None for trade in expired}, events=events)
+            self.roster_changed([player], [user_id], expired)
 
             return ReturnCodes.SUCCESS
         else:
             return ReturnCodes.NO_TEAM
 
+    def search_free_agents(self, query: str):
+        if self.free_agent_index is None:
+            self.free_agent_index = AutocompleteIndex({player.title(): None for player in self.get_free_agents()})
+
+        return [name for name, _ in self.free_agent_index.search(query)]
+
+    def search_roster(self, user_id: int, query: str):
+        team = self.get_team(user_id)
+        if team is None:
+            return []
+
+        roster = self.roster_indexes.get(user_id)
+        if roster is None:
+            roster = self.roster_indexes[user_id] = AutocompleteIndex({player.title(): None for player in team["players"]})
+
+        return [name for name, _ in roster.search(query)]
+
+    def search_characters(self, query: str, limit: int = 1):
+        if self.character_index is None:
+            self.character_index = AutocompleteIndex({player.title(): None for player in self.characters})
+
+        return [name for name, _ in self.character_index.search(query, limit)]
+
+    def search_teams(self, query: str, exclude_user_id: int = None):
+        # choices are team name -> user id
+        exclude = () if exclude_user_id is None else (str(exclude_user_id),)
+
+        if self.team_index is None:
+            self.team_index = AutocompleteIndex(self.get_teams(as_choices=True))
+
+        return self.team_index.choices(query, exclude=exclude)
+
     def get_players(self, user_id: int):
         team = self.get_team(user_id)
 
@@ -120,89 +499,300 @@ class League:
         else:
             return ReturnCodes.NO_TEAM
 
-    def create_trade(self, user1_id: int, user2_id: int, user1_trade: str, user2_trade: str):
-        trade = Trade(user1_id, user2_id, user1_trade, user2_trade)
-        
+    def validate_trades(self, trades):
+        """
+        Checks a batch of trades against the current rosters in one pass and
+        returns a ReturnCodes for each. Every side is one subset test of the
+        players it gives up against its roster bitset.
+        """
+        ids = self.pool.ids
+        rosters = self.rosters
+
+        results = []
+        for trade in trades:
+            result = trade.check()
+            if result == ReturnCodes.SUCCESS and any(user_id not in rosters for user_id in trade.sides):
+                result = ReturnCodes.NO_TEAM
+
+            if result == ReturnCodes.SUCCESS:
+                for user_id, players in trade.sides.items():
+                    # players are unique within a trade, so the bits can be summed
+                    player_ids = [ids.get(player) for player in players]
+                    mask = 0 if None in player_ids else sum(1 << i for i in player_ids)
+                    if not mask or mask & rosters[user_id] != mask:
+                        result = ReturnCodes.NOT_ON_TEAM
+                        break
+
+            results.append(result)
+
+        return results
+
+    def create_trade(self, sides: dict, destinations: dict = None):
+        """sides maps each team to the players it gives up, the proposer first"""
+        trade = Trade(sides, destinations=destinations)
+
         if trade.validate_trade(self) == ReturnCodes.SUCCESS:
+            trade.trade_id = self.next_trade_id
+            self.next_trade_id += 1
+
             # add trade to db
-            self.trades_db.insert({"user1_id": user1_id, "user2_id": user2_id, "user1_trade": user1_trade, "user2_trade": user2_trade})
+            trade_dict = trade.to_dict()
+            self.commit(trades={trade.trade_id: trade_dict}, events=[self.event(ledger.PROPOSE, trade)])
+            self.trades.add(trade.trade_id, trade_dict)
             return trade
         else:
             return ReturnCodes.INVALID_TRADE
-        
-    def cancel_trade(self, trade: "Trade"):
-        trade = self.get_trade(trade.message_id)
+
+    def cancel_trade(self, trade: "Trade", user_id: int = None):
+        """Withdrawn by the proposing team, or denied if user_id is one of the other teams"""
+        trade = self.find_trade(trade)
         if trade:
-            self.trades_db.remove(tinydb.Query().message_id == trade.message_id)
+            kind = ledger.DENY if user_id in trade.partners() else ledger.CANCEL
+            self.commit(trades={trade.trade_id: None}, events=[self.event(kind, trade, user_id=user_id or trade.proposer)])
+            self.trades.remove(trade.trade_id)
             return ReturnCodes.SUCCESS
         else:
             return ReturnCodes.INVALID_TRADE
-        
-    def process_trade(self, trade: "Trade"):
-        trade = self.get_trade(trade.message_id)
-        if trade and trade.validate_trade(self) == ReturnCodes.SUCCESS:
-            user1_team = self.get_team(trade.user1_id)
-            user2_team = self.get_team(trade.user2_id)
 
-            user1_team["players"].remove(trade.user1_trade)
-            user1_team["players"].append(trade.user2_trade)
+    def accept_trade(self, trade: "Trade", user_id: int):
+        """
+        Records user_id's acceptance. The trade goes through once every team
+        besides the proposer has accepted, until then WAITING_FOR_TEAMS.
+        """
+        trade = self.find_trade(trade)
+        if not trade or user_id not in trade.partners() or trade.validate_trade(self) != ReturnCodes.SUCCESS:
+            return ReturnCodes.INVALID_TRADE
 
-            user2_team["players"].remove(trade.user2_trade)
-            user2_team["players"].append(trade.user1_trade)
+        trade.accepted.add(user_id)
+        if trade.accepted.issuperset(trade.partners()):
+            return self.process_trade(trade)
 
-            self.teams_db.update(user1_team, tinydb.Query().user_id == trade.user1_id)
-            self.teams_db.update(user2_team, tinydb.Query().user_id == trade.user2_id)
+        self.trades.set_accepted(trade.trade_id, trade.accepted)
+        self.commit(trades={trade.trade_id: self.trades.get(trade.trade_id)})
+        return ReturnCodes.WAITING_FOR_TEAMS
 
-            self.trades_db.remove(tinydb.Query().message_id == trade.message_id)
+    def process_trade(self, trade: "Trade"):
+        trade = self.find_trade(trade)
+        if trade and trade.validate_trade(self) == ReturnCodes.SUCCESS:
+            for player, _, to_id in trade.moves():
+                self.move_player(player, to_id)
+            self.trades.remove(trade.trade_id)
+
+            # other proposals for the same players can't go through anymore
+            players = trade.players()
+            expired = self.expire_trades(players=players)
+
+            # every roster and the trade removals are persisted as one record
+            trades = {t.trade_id: None for t in expired}
+            trades[trade.trade_id] = None
+            self.commit(
+                teams={user_id: self.get_team(user_id) for user_id in trade.sides},
+                trades=trades,
+                events=[self.event(ledger.ACCEPT, trade)] + self.expire_events(expired),
+            )
+            self.roster_changed(players, list(trade.sides), expired)
 
             return ReturnCodes.SUCCESS
         else:
             return ReturnCodes.INVALID_TRADE
-        
-    def assign_trade_message(self, trade: "Trade", message_id: int):
-        self.trades_db.update({"message_id": message_id}, tinydb.Query().user1_id == trade.user1_id and tinydb.Query().user2_id == trade.user2_id and tinydb.Query().user1_trade == trade.user1_trade and tinydb.Query().user2_trade == trade.user2_trade)
+
+    def assign_trade_message(self, trade: "Trade", message_id: int, channel_id: int = None):
+        trade_dict = self.trades.get(trade.trade_id)
+        if trade_dict is None:
+            return ReturnCodes.INVALID_TRADE
+
+        self.trades.set_message(trade.trade_id, message_id, channel_id)
+        self.commit(trades={trade.trade_id: trade_dict})
+        trade.message_id = message_id
+        trade.channel_id = channel_id
+
+        return ReturnCodes.SUCCESS
 
     def get_trade(self, msg_id: int):
-        if self.trades_db.get(tinydb.Query().message_id == int(msg_id)) is None:
+        trade_id = self.trades.by_message.get(int(msg_id))
+        if trade_id is None:
             return None
-        
-        return Trade.from_dict(self.trades_db.get(tinydb.Query().message_id == msg_id))
+
+        return Trade.from_dict(self.trades.get(trade_id), trade_id)
+
+    def find_trade(self, trade: "Trade"):
+        # the trade id is exact, older callers may only know the message
+        if trade.trade_id is not None:
+            trade_dict = self.trades.get(trade.trade_id)
+            return Trade.from_dict(trade_dict, trade.trade_id) if trade_dict else None
+
+        if trade.message_id is not None:
+            return self.get_trade(trade.message_id)
+
+        return None
     
     def get_trades(self):
-        return [Trade.from_dict(trade) for trade in self.trades_db.all()]
+        return [Trade.from_dict(trade, trade_id) for trade_id, trade in self.trades.items()]
+
+    def get_user_trades(self, user_id: int):
+        return [Trade.from_dict(self.trades.get(trade_id), trade_id) for trade_id in self.trades.for_user(user_id)]
+
+    def get_player_trades(self, player: str):
+        return [Trade.from_dict(self.trades.get(trade_id), trade_id) for trade_id in self.trades.for_player(player)]
+
+
+class TradeBook:
+    """Pending trades with hash indexes on message, participant and player"""
+
+    def __init__(self):
+        self.trades = {}      # trade_id -> trade dict
+        self.by_message = {}  # message_id -> trade_id
+        self.by_user = {}     # user_id -> {trade_id}
+        self.by_player = {}   # player -> {trade_id}
+
+    def __len__(self):
+        return len(self.trades)
+
+    def __contains__(self, trade_id: int):
+        return trade_id in self.trades
+
+    def get(self, trade_id: int):
+        return self.trades.get(trade_id)
+
+    def items(self):
+        return self.trades.items()
+
+    def add(self, trade_id: int, trade_dict: dict):
+        self.trades[trade_id] = trade_dict
+
+        if trade_dict.get("message_id") is not None:
+            self.by_message[trade_dict["message_id"]] = trade_id
+
+        trade = Trade.from_dict(trade_dict)
+        for user_id in trade.sides:
+            self.by_user.setdefault(user_id, set()).add(trade_id)
+
+        for player in trade.players():
+            self.by_player.setdefault(player, set()).add(trade_id)
+
+    def remove(self, trade_id: int):
+        trade_dict = self.trades.pop(trade_id)
+
+        if trade_dict.get("message_id") is not None:
+            self.by_message.pop(trade_dict["message_id"], None)
+
+        trade = Trade.from_dict(trade_dict)
+        for index, keys in ((self.by_user, trade.sides), (self.by_player, trade.players())):
+            for key in keys:
+                trade_ids = index.get(key)
+                if trade_ids is not None:
+                    trade_ids.discard(trade_id)
+                    if not trade_ids:
+                        del index[key]
+
+        return trade_dict
+
+    def set_message(self, trade_id: int, message_id: int, channel_id: int = None):
+        trade_dict = self.trades[trade_id]
+        if trade_dict.get("message_id") is not None:
+            self.by_message.pop(trade_dict["message_id"], None)
+
+        trade_dict["message_id"] = message_id
+        trade_dict["channel_id"] = channel_id
+        self.by_message[message_id] = trade_id
+
+    def set_accepted(self, trade_id: int, accepted):
+        self.trades[trade_id]["accepted"] = sorted(accepted)
+
+    def for_user(self, user_id: int):
+        return sorted(self.by_user.get(user_id, ()))
+
+    def for_player(self, player: str):
+        return sorted(self.by_player.get(player, ()))
     
         
 
     
 class Trade:
-    def __init__(self, user1_id: int, user2_id: int, user1_trade: str, user2_trade: str, message_id: int = None):
-        self.user1_id = user1_id
-        self.user2_id = user2_id
-        self.user1_trade = user1_trade
-        self.user2_trade = user2_trade
+    """
+    Players changing hands between two or more teams. `sides` maps every
+    team in the trade to the players it gives up, the first side is the
+    team that proposed it. In a two team trade each side's players go to
+    the other side, with more teams `destinations` says where every player
+    goes. Every team besides the proposer has to accept.
+    """
+
+    def __init__(self, sides: dict, message_id: int = None, trade_id: int = None, channel_id: int = None, destinations: dict = None, accepted=()):
+        self.sides = {user_id: tuple(players) for user_id, players in sides.items()}
+        self.destinations = dict(destinations or {})  # player -> user_id
         self.message_id = message_id
+        self.trade_id = trade_id
+        self.channel_id = channel_id
+        self.accepted = set(accepted)  # teams that have accepted so far
 
     def __str__(self):
-        return f'{self.user1_id} trades {self.user1_trade} for {self.user2_id}"s {self.user2_trade}'
-    
-    @staticmethod
-    def from_dict(trade_dict: dict):
-        return Trade(trade_dict["user1_id"], trade_dict["user2_id"], trade_dict["user1_trade"], trade_dict["user2_trade"], trade_dict["message_id"])
+        return ", ".join(f'{player} from {from_id} to {to_id}' for player, from_id, to_id in self.moves())
 
-    def validate_trade(self, league: League):
-        user1_team = league.get_team(self.user1_id)
-        user2_team = league.get_team(self.user2_id)
+    @property
+    def proposer(self):
+        return next(iter(self.sides))
+
+    def partners(self):
+        """The teams that have to accept"""
+        return list(self.sides)[1:]
+
+    def players(self):
+        return [player for players in self.sides.values() for player in players]
+
+    def moves(self):
+        """(player, from user_id, to user_id) for every player in the trade"""
+        if len(self.sides) == 2:
+            user1_id, user2_id = self.sides
+            return [(player, user1_id, user2_id) for player in self.sides[user1_id]] + \
+                   [(player, user2_id, user1_id) for player in self.sides[user2_id]]
+
+        return [(player, user_id, self.destinations.get(player)) for user_id, players in self.sides.items() for player in players]
 
-        if user1_team == user2_team:
+    def receives(self, user_id: int):
+        return [player for player, _, to_id in self.moves() if to_id == user_id]
+
+    def check(self):
+        """Checks the shape of the trade, ownership is up to League.validate_trades"""
+        if len(self.sides) < 2:
             return ReturnCodes.SAME_TEAM
 
-        if user1_team and user2_team:
-            if self.user1_trade not in user1_team["players"]:
-                return ReturnCodes.NOT_ON_TEAM
+        players = self.players()
+        if len(set(players)) != len(players) or not all(self.sides.values()):
+            return ReturnCodes.INVALID_TRADE
 
-            if self.user2_trade not in user2_team["players"]:
-                return ReturnCodes.NOT_ON_TEAM
+        if len(self.sides) > 2:
+            # every player goes to another team in the trade and every team gets someone
+            receivers = set()
+            for player, from_id, to_id in self.moves():
+                if to_id not in self.sides or to_id == from_id:
+                    return ReturnCodes.INVALID_TRADE
+                receivers.add(to_id)
 
-            return ReturnCodes.SUCCESS
+            if len(receivers) != len(self.sides):
+                return ReturnCodes.INVALID_TRADE
+
+        return ReturnCodes.SUCCESS
+
+    @staticmethod
+    def from_dict(trade_dict: dict, trade_id: int = None):
+        if "sides" in trade_dict:
+            sides = {user_id: players for user_id, players in trade_dict["sides"]}
+            destinations = {player: user_id for player, user_id in trade_dict.get("destinations") or ()}
         else:
-            return ReturnCodes.NO_TEAM
+            # one for one trades saved before trades could have more players
+            sides = {trade_dict["user1_id"]: [trade_dict["user1_trade"]], trade_dict["user2_id"]: [trade_dict["user2_trade"]]}
+            destinations = None
+
+        return Trade(sides, trade_dict.get("message_id"), trade_id, trade_dict.get("channel_id"), destinations, trade_dict.get("accepted") or ())
+
+    def to_dict(self):
+        return {
+            "sides": [[user_id, list(players)] for user_id, players in self.sides.items()],
+            "destinations": [[player, user_id] for player, user_id in self.destinations.items()],
+            "accepted": sorted(self.accepted),
+            "message_id": self.message_id,
+            "channel_id": self.channel_id,
+        }
+
+    def validate_trade(self, league: League):
+        return league.validate_trades([self])[0]
@@ -0,0 +1,172 @@
+"""
+Roster and trade events, and the statistics kept up to date from them.
+
+Every change to a league is recorded as an event in an append-only ledger
+next to the league's data. LeagueStats folds events into materialized
+views as they happen, so answering /league stats or /league history never
+looks at the ledger. The views are snapshotted now and then, and loading a
+league only replays the events recorded after the last snapshot.
+"""
+from bisect import bisect_left, insort
+from collections import Counter, deque
+
+# event types
+CREATE = "create"
+DELETE = "delete"
+ADD = "add"
+DROP = "drop"
+PROPOSE = "propose"
+ACCEPT = "accept"
+DENY = "deny"
+CANCEL = "cancel"
+EXPIRE = "expire"
+IMPORT = "import"
+
+RECENT_EVENTS = 25
+RECENT_TEAM_EVENTS = 10
+
+
+class Leaderboard:
+    """Counts kept sorted as they change, so the top entries are always at hand"""
+
+    def __init__(self, counts: dict = None):
+        self.counts = dict(counts or {})
+        self.ranked = sorted((-count, key) for key, count in self.counts.items())  # (-count, key)
+
+    def __getitem__(self, key):
+        return self.counts.get(key, 0)
+
+    def inc(self, key, amount: int = 1):
+        old = self.counts.get(key, 0)
+        if old:
+            del self.ranked[bisect_left(self.ranked, (-old, key))]
+
+        self.counts[key] = old + amount
+        insort(self.ranked, (-(old + amount), key))
+
+    def top(self, n: int):
+        return [(key, -count) for count, key in self.ranked[:n]]
+
+
+class LeagueStats:
+    def __init__(self):
+        self.last_event = 0
+        # highest trade id any event mentions, ids are never handed out twice
+        self.last_trade = 0
+        self.totals = Counter()            # event type -> count
+        self.traded = Leaderboard()        # player -> accepted trades
+        self.transactions = Leaderboard()  # user_id -> adds, drops and accepted trades
+        # player -> (user_id, since), oldest first because a player is
+        # moved to the end whenever they join a new team
+        self.tenure = {}
+        self.recent = deque(maxlen=RECENT_EVENTS)
+        self.team_recent = {}              # user_id -> deque of events
+
+    def apply(self, event: dict):
+        kind = event["type"]
+        self.last_event = event["id"]
+        if "trade_id" in event:
+            self.last_trade = max(self.last_trade, event["trade_id"])
+        self.totals[kind] += 1
+        self.recent.append(event)
+
+        for user_id in event_teams(event):
+            self.team_recent.setdefault(user_id, deque(maxlen=RECENT_TEAM_EVENTS)).append(event)
+
+        if kind == ADD:
+            self.join(event["player"], event["user_id"], event["time"])
+            self.transactions.inc(event["user_id"])
+        elif kind == DROP:
+            self.tenure.pop(event["player"], None)
+            self.transactions.inc(event["user_id"])
+        elif kind == ACCEPT:
+            for player, _, user_id in trade_moves(event):
+                self.join(player, user_id, event["time"])
+                self.traded.inc(player)
+            for user_id, _ in trade_sides(event):
+                self.transactions.inc(user_id)
+        elif kind == DELETE:
+            for player in event["players"]:
+                self.tenure.pop(player, None)
+        elif kind == IMPORT:
+            for player in event["released"]:
+                self.tenure.pop(player, None)
+            for user_id, players in event["teams"]:
+                for player in players:
+                    # players that stay on their team keep their tenure
+                    owner = self.tenure.get(player)
+                    if owner is None or owner[0] != user_id:
+                        self.join(player, user_id, event["time"])
+
+    def join(self, player: str, user_id: int, since: float):
+        self.tenure.pop(player, None)
+        self.tenure[player] = (user_id, since)
+
+    def longest_tenure(self, n: int):
+        # the dict is in joining order, the first entries have been around longest
+        result = []
+        for player, (user_id, since) in self.tenure.items():
+            if len(result) == n:
+                break
+            result.append((player, user_id, since))
+
+        return result
+
+    def history(self, user_id: int = None):
+        """Most recent events first, for the whole league or one team"""
+        events = self.recent if user_id is None else self.team_recent.get(user_id, ())
+        return list(reversed(events))
+
+    def to_dict(self):
+        return {
+            "last_event": self.last_event,
+            "last_trade": self.last_trade,
+            "totals": dict(self.totals),
+            "traded": list(self.traded.counts.items()),
+            "transactions": list(self.transactions.counts.items()),
+            "tenure": [[player, user_id, since] for player, (user_id, since) in self.tenure.items()],
+            "recent": list(self.recent),
+            "team_recent": [[user_id, list(events)] for user_id, events in self.team_recent.items()],
+        }
+
+    @staticmethod
+    def from_dict(stats_dict: dict):
+        stats = LeagueStats()
+        stats.last_event = stats_dict["last_event"]
+        # None for snapshots taken before it was kept, the league works it out from the ledger
+        stats.last_trade = stats_dict.get("last_trade")
+        stats.totals = Counter(stats_dict["totals"])
+        stats.traded = Leaderboard(dict(stats_dict["traded"]))
+        stats.transactions = Leaderboard(dict(stats_dict["transactions"]))
+        stats.tenure = {player: (user_id, since) for player, user_id, since in stats_dict["tenure"]}
+        stats.recent = deque(stats_dict["recent"], maxlen=RECENT_EVENTS)
+        stats.team_recent = {user_id: deque(events, maxlen=RECENT_TEAM_EVENTS) for user_id, events in stats_dict["team_recent"]}
+        return stats
+
+
+def trade_sides(event: dict):
+    """[user_id, players given up] for every team in a trade event"""
+    if "sides" in event:
+        return event["sides"]
+
+    # one for one trades recorded before trades could have more players
+    return [[event["user1_id"], [event["user1_trade"]]], [event["user2_id"], [event["user2_trade"]]]]
+
+
+def trade_moves(event: dict):
+    """[player, from user_id, to user_id] for every player in a trade event"""
+    if "moves" in event:
+        return event["moves"]
+
+    return [[event["user1_trade"], event["user1_id"], event["user2_id"]], [event["user2_trade"], event["user2_id"], event["user1_id"]]]
+
+
+def event_teams(event: dict):
+    """The teams an event belongs to"""
+    if "trade_id" in event:
+        return {user_id for user_id, _ in trade_sides(event)}
+
+    if event["type"] == IMPORT:
+        return {user_id for user_id, _ in event["teams"]} | set(event["removed"])
+
+    return {event["user_id"]}
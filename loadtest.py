@@ -0,0 +1,574 @@
+"""
+End to end load test of the bot's command handlers against a fake Discord.
+
+    python loadtest.py                                    # 200 users in 10 guilds for 20 seconds
+    python loadtest.py --users 500 --latency 0.1 --rate-limit 0.05
+    python loadtest.py --backend sqlite --duration 60
+    python loadtest.py --draft --pick-seconds 1           # rosters filled by a snake draft
+
+main.py is imported without connecting the bot. Every simulated user
+creates a team and then keeps adding and dropping players and creating,
+accepting, denying and cancelling trades, with the autocomplete calls a
+person would make along the way, through the same handlers discord calls.
+With --draft the first user of every guild starts a draft instead, and
+rosters are filled by picks, queues and the draft clock's auto-picks.
+Interaction responses, the fetch_user lookups behind get_name and the
+outbox's embed edits go to a fake REST API with a configurable latency and
+chance of a 429.
+
+Prints p50/p95/p99 latency and discord calls per command, then checks the
+leagues for broken invariants: a player on two teams, indexes or stats out
+of sync with the rosters, pending trades that can't go through and data
+that doesn't come back the same after a reload. Exits 1 if there were any,
+or if a handler raised.
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import cluster
+import draft
+import main as bot
+import outbox
+from league import League, ReturnCodes
+
+USERS = 200
+GUILDS = 10
+DURATION = 20
+LATENCY = 0.05
+RATE_LIMIT = 0.02
+THINK_TIME = 0.5
+ROSTER_SIZE = 4
+PICK_SECONDS = 2
+
+# seconds to wait for queued embed edits after the run
+DRAIN_TIMEOUT = 10
+
+# share of members in the gateway cache, the rest need a fetch_user
+CACHED_MEMBERS = 0.8
+
+# the command whose handler is running, discord calls are counted against it
+current_command = contextvars.ContextVar("current_command", default="background")
+
+
+class FakeDiscord:
+    """REST API where every call takes about `latency` seconds and gets a 429 with a chance of `rate_limit`"""
+
+    def __init__(self, rng: random.Random, latency: float, rate_limit: float):
+        self.rng = rng
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.calls = Counter()         # command -> discord calls
+        self.rate_limited = Counter()  # route -> 429s
+        self.message_ids = itertools.count(1 << 40)
+
+    async def request(self, route: str, retry: bool = True):
+        while True:
+            self.calls[current_command.get()] += 1
+            await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+            if self.rng.random() >= self.rate_limit:
+                return
+
+            self.rate_limited[route] += 1
+            retry_after = self.rng.uniform(0.1, 1.0)
+            if not retry:
+                raise outbox.RateLimited(retry_after)
+
+            # nextcord waits out a 429 and retries on its own
+            await asyncio.sleep(retry_after)
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def respond(self, content=None):
+        if self.done:
+            raise RuntimeError("This interaction has already been responded to")
+
+        self.done = True
+        await self.interaction.discord.request("interaction_response")
+        if content is not None:
+            self.interaction.messages.append(content)
+
+    async def send_message(self, content=None, embed=None, file=None, view=None, ephemeral=False):
+        await self.respond(content)
+        self.interaction.view = view
+
+    async def edit_message(self, embed=None, view=None):
+        await self.respond()
+        self.interaction.view = view
+
+    async def defer(self, ephemeral=False):
+        await self.respond()
+
+    async def send_autocomplete(self, choices):
+        self.interaction.choices = choices
+        await self.respond()
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, content=None, embed=None, file=None, view=None, ephemeral=False, wait=False):
+        await self.interaction.discord.request("followup")
+        if content is not None:
+            self.interaction.messages.append(content)
+        self.interaction.view = view
+
+        message = fake_message(next(self.interaction.discord.message_ids), self.interaction.channel_id)
+        self.interaction.sent.append(message)
+        return message
+
+
+class FakeInteraction:
+    def __init__(self, discord: FakeDiscord, user_id: int, guild_id: int, channel_id: int, data: dict = None):
+        self.discord = discord
+        self.user = SimpleNamespace(id=user_id)
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.data = data or {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+        self.messages = []  # text of everything sent
+        self.sent = []      # followup messages
+        self.choices = None
+        self.view = None    # buttons sent with the response
+
+
+def fake_message(message_id: int, channel_id: int):
+    return SimpleNamespace(id=message_id, channel=SimpleNamespace(id=channel_id))
+
+
+class FakeBot:
+    """Member cache and fetch_user for NameCache, every guild has the same members"""
+
+    def __init__(self, discord: FakeDiscord, cached: float):
+        self.discord = discord
+        self.cached = cached
+
+    def get_guild(self, guild_id: int):
+        return self
+
+    def get_member(self, user_id: int):
+        if user_id % 100 >= self.cached * 100:
+            return None
+
+        return SimpleNamespace(nick=None, name=f'user{user_id}')
+
+    async def fetch_user(self, user_id: int):
+        await self.discord.request("fetch_user")
+        return SimpleNamespace(name=f'user{user_id}')
+
+
+class FakeDiscordClient:
+    """The outbox's client, its 429s are left to the outbox to retry"""
+
+    def __init__(self, discord: FakeDiscord):
+        self.discord = discord
+
+    async def edit_message(self, channel_id: int, message_id: int, embed):
+        await self.discord.request("edit_message", retry=False)
+
+    async def send_message(self, channel_id: int, content: str):
+        await self.discord.request("send_message", retry=False)
+
+
+class Harness:
+    """Calls main.py's handlers the way discord would and records how they did"""
+
+    def __init__(self, discord: FakeDiscord):
+        self.discord = discord
+        self.latencies = {}       # command -> [seconds]
+        self.errors = Counter()   # command -> handlers that raised
+        self.conflicts = Counter()
+        self.first_errors = {}    # command -> repr of its first exception
+
+        # resolves the options of every command, including their autocomplete callbacks
+        bot.bot.add_all_application_commands()
+        self.groups = {"team": bot.team_cmd, "league": bot.league_cmd, "trade": bot.trade_cmd, "admin": bot.admin_cmd, "draft": bot.draft_cmd}
+        self.message_commands = {"Accept Trade": bot.accept_trade_cmd, "Deny Trade": bot.deny_trade_cmd, "Cancel Trade": bot.cancel_trade_cmd}
+
+    def command(self, name: str):
+        group, subcommand = name.split()
+        return self.groups[group].children[subcommand]
+
+    def interaction(self, user_id: int, guild_id: int, data: dict = None):
+        # one channel per guild, like a league's trading channel
+        return FakeInteraction(self.discord, user_id, guild_id, guild_id, data)
+
+    async def run(self, command: str, interaction: FakeInteraction, call):
+        token = current_command.set(command)
+        start = time.perf_counter()
+        try:
+            await call
+        except Exception as e:
+            self.errors[command] += 1
+            self.first_errors.setdefault(command, repr(e))
+        finally:
+            self.latencies.setdefault(command, []).append(time.perf_counter() - start)
+            current_command.reset(token)
+
+        if bot.CONFLICT_MESSAGE in interaction.messages:
+            self.conflicts[command] += 1
+
+    async def slash(self, name: str, user_id: int, guild_id: int, **values):
+        """Runs a slash command, `values` by option name and the rest left at their defaults"""
+        command = self.command(name)
+        kwargs = {option.functional_name: values.get(option.name, option.default) for option in command.options.values()}
+
+        interaction = self.interaction(user_id, guild_id)
+        await self.run(name, interaction, command.callback(interaction, **kwargs))
+        return interaction
+
+    async def autocomplete(self, name: str, option: str, user_id: int, guild_id: int, value: str, **values):
+        """Choices for the focused `option`, with `values` as the options filled in so far"""
+        options = [{"name": other, "value": other_value} for other, other_value in values.items()]
+        options.append({"name": option, "value": value, "focused": True})
+
+        interaction = self.interaction(user_id, guild_id, {"options": [{"name": name.split()[1], "options": options}]})
+        await self.run(f'{name} [{option}]', interaction, self.command(name).options[option].autocomplete_callback(interaction, value))
+        return interaction.choices or []
+
+    async def click_next(self, name: str, user_id: int, guild_id: int, view):
+        """Clicks the next page button of a listing `name` sent"""
+        interaction = self.interaction(user_id, guild_id)
+        await self.run(f'{name} [next]', interaction, view.show(interaction, view.number + 1))
+        return interaction
+
+    async def message_command(self, name: str, user_id: int, guild_id: int, message):
+        interaction = self.interaction(user_id, guild_id)
+        await self.run(name, interaction, self.message_commands[name].callback(interaction, message))
+        return interaction
+
+
+def prefix(name: str, rng: random.Random):
+    # what someone has typed so far
+    return name[:rng.randint(1, 3)]
+
+
+class SimulatedUser:
+    def __init__(self, harness: Harness, rng: random.Random, user_id: int, guild_id: int, think_time: float, roster_size: int, pick_seconds: float = None):
+        self.harness = harness
+        self.rng = rng
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.think_time = think_time
+        self.roster_size = roster_size
+        # set for the user who starts the guild's draft
+        self.pick_seconds = pick_seconds
+
+    @property
+    def league(self):
+        # peeking at the league stands in for what a person sees in discord
+        return bot.leagues.get(self.guild_id)
+
+    async def run(self, deadline: float):
+        await self.harness.slash("team create", self.user_id, self.guild_id, team_name=f'Team {self.user_id}')
+
+        if self.pick_seconds is not None:
+            # give everyone a moment to create their team
+            await asyncio.sleep(self.think_time * 2)
+            await self.harness.slash("admin draft", self.user_id, self.guild_id, rounds=self.roster_size, pick_seconds=self.pick_seconds)
+
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.rng.expovariate(1 / self.think_time))
+
+            players = self.league.get_players(self.user_id)
+            if players == ReturnCodes.NO_TEAM:
+                return
+
+            running = draft.running_draft(self.league)
+            if running and self.user_id in running.order:
+                await self.draft(running)
+                continue
+
+            if len(players) < self.roster_size:
+                await self.add()
+                continue
+
+            action = self.rng.choices(
+                [self.propose, self.respond, self.cancel, self.drop, self.browse],
+                weights=[35, 30, 10, 10, 15],
+            )[0]
+            await action()
+
+    async def draft(self, running: draft.Draft):
+        # some pick when they're up, the others line up players or let the clock pick
+        if running.on_the_clock == self.user_id and self.rng.random() < 0.6:
+            free_agents = self.league.get_free_agents()
+            choices = await self.harness.autocomplete("draft pick", "player", self.user_id, self.guild_id, prefix(self.rng.choice(free_agents).title(), self.rng))
+            if choices:
+                await self.harness.slash("draft pick", self.user_id, self.guild_id, player=self.rng.choice(choices))
+        elif self.rng.random() < 0.3:
+            free_agents = self.league.get_free_agents()
+            queued = self.rng.sample(free_agents, min(len(free_agents), 3))
+            await self.harness.slash("draft queue", self.user_id, self.guild_id, players=", ".join(player.title() for player in queued))
+        elif self.rng.random() < 0.3:
+            await self.harness.slash(self.rng.choice(["draft status", "draft board"]), self.user_id, self.guild_id)
+
+    async def add(self):
+        free_agents = self.league.get_free_agents()
+        if not free_agents:
+            return
+
+        choices = await self.harness.autocomplete("team add", "player", self.user_id, self.guild_id, prefix(self.rng.choice(free_agents).title(), self.rng))
+        if choices:
+            await self.harness.slash("team add", self.user_id, self.guild_id, player=self.rng.choice(choices))
+
+    async def drop(self):
+        players = self.league.get_players(self.user_id)
+        choices = await self.harness.autocomplete("team drop", "player", self.user_id, self.guild_id, prefix(self.rng.choice(players).title(), self.rng))
+        if choices:
+            await self.harness.slash("team drop", self.user_id, self.guild_id, player=self.rng.choice(choices))
+
+    async def pick_players(self, option: str, user_id: int, **values):
+        """One or two of user_id's players, chosen through the autocomplete"""
+        players = self.league.get_players(user_id)
+        if not players:
+            return None
+
+        picked = self.rng.sample(players, min(len(players), self.rng.choice([1, 1, 2])))
+        text = ", ".join(player.title() for player in picked[:-1])
+        text += ", " if text else ""
+
+        choices = await self.harness.autocomplete("trade create", option, self.user_id, self.guild_id, text + prefix(picked[-1].title(), self.rng), **values)
+        return self.rng.choice(choices) if choices else None
+
+    async def pick_team(self, option: str, exclude):
+        teams = [team for team in self.league.get_teams() if team["user_id"] not in exclude and team["players"]]
+        if not teams:
+            return None
+
+        choices = await self.harness.autocomplete("trade create", option, self.user_id, self.guild_id, prefix(self.rng.choice(teams)["team_name"], self.rng))
+        # choices are team name -> user id
+        choices = [user_id for user_id in dict(choices).values() if int(user_id) not in exclude]
+        return self.rng.choice(choices) if choices else None
+
+    async def propose(self):
+        other_team = await self.pick_team("other_team", {self.user_id})
+        if other_team is None:
+            return
+
+        values = {"other_team": other_team}
+        values["your_players"] = await self.pick_players("your_players", self.user_id, **values)
+        values["for_players"] = await self.pick_players("for_players", int(other_team), **values)
+
+        # now and then a three team trade
+        if self.rng.random() < 0.1:
+            third_team = await self.pick_team("third_team", {self.user_id, int(other_team)})
+            if third_team is not None:
+                values["third_team"] = third_team
+                values["third_team_players"] = await self.pick_players("third_team_players", int(third_team), **values)
+
+        if all(values.values()):
+            await self.harness.slash("trade create", self.user_id, self.guild_id, **values)
+
+    async def respond(self):
+        trades = [trade for trade in self.league.get_user_trades(self.user_id)
+                  if self.user_id in trade.partners() and self.user_id not in trade.accepted and trade.message_id]
+        if trades:
+            trade = self.rng.choice(trades)
+            name = "Accept Trade" if self.rng.random() < 0.75 else "Deny Trade"
+            await self.harness.message_command(name, self.user_id, self.guild_id, fake_message(trade.message_id, trade.channel_id))
+
+    async def cancel(self):
+        trades = [trade for trade in self.league.get_user_trades(self.user_id) if trade.proposer == self.user_id and trade.message_id]
+        if trades:
+            trade = self.rng.choice(trades)
+            await self.harness.message_command("Cancel Trade", self.user_id, self.guild_id, fake_message(trade.message_id, trade.channel_id))
+
+    async def browse(self):
+        name = self.rng.choice(["team view", "league trades", "league teams", "league history", "league free_agents"])
+        interaction = await self.harness.slash(name, self.user_id, self.guild_id)
+
+        # leafing through the pages of a long listing
+        view = interaction.view
+        while view is not None and not view.next.disabled and self.rng.random() < 0.5:
+            interaction = await self.harness.click_next(name, self.user_id, self.guild_id, view)
+            view = interaction.view
+
+
+def check_invariants(registry):
+    """Everything that should hold for the loaded leagues, as a list of what doesn't"""
+    problems = []
+    for guild_id, league in registry.leagues.items():
+        owners = {}
+        for user_id, team in league.teams.items():
+            for player in team["players"]:
+                if player in owners:
+                    problems.append(f'guild {guild_id}: {player} is on teams {owners[player]} and {user_id}')
+                owners[player] = user_id
+
+            if league.rosters.get(user_id) != league.pool.bits(team["players"]):
+                problems.append(f'guild {guild_id}: roster bitset of team {user_id} is out of sync')
+
+        if league.player_owners != owners:
+            problems.append(f'guild {guild_id}: player owner index is out of sync')
+
+        owned = 0
+        for roster in league.rosters.values():
+            owned |= roster
+        if owned != league.owned:
+            problems.append(f'guild {guild_id}: owned players bitset is out of sync')
+
+        trades = league.get_trades()
+        for trade, result in zip(trades, league.validate_trades(trades)):
+            if result != ReturnCodes.SUCCESS:
+                problems.append(f'guild {guild_id}: trade {trade.trade_id} is pending but {result.name}')
+
+        tenure = {player: user_id for player, (user_id, _) in league.stats.tenure.items()}
+        if tenure != owners:
+            problems.append(f'guild {guild_id}: stats tenure disagrees with rosters for {len(set(tenure.items()) ^ set(owners.items()))} players')
+
+        # a draft that ran out of players ends early, otherwise every pick is recorded once
+        current = draft.get_draft(league)
+        if current and not current.done and current.pick != len(current.picks):
+            problems.append(f'guild {guild_id}: draft is at pick {current.pick} but made {len(current.picks)}')
+        drafted = [player for _, player, _ in current.picks if player] if current else []
+        if len(drafted) != len(set(drafted)):
+            problems.append(f'guild {guild_id}: a player was drafted twice')
+
+    return problems
+
+
+def check_reload(registry):
+    """Closes every league and loads it again from disk, the result has to match"""
+    expected = {}
+    for guild_id, league in registry.leagues.items():
+        teams = {user_id: team["players"] for user_id, team in league.teams.items()}
+        expected[guild_id] = (teams, {trade.trade_id: trade.to_dict() for trade in league.get_trades()}, league.draft)
+
+    registry.close()
+
+    problems = []
+    for guild_id, (teams, trades, draft_state) in expected.items():
+        league = League(*registry.paths(guild_id), guild_id=guild_id)
+        if {user_id: team["players"] for user_id, team in league.teams.items()} != teams:
+            problems.append(f'guild {guild_id}: teams changed after a reload')
+        if {trade.trade_id: trade.to_dict() for trade in league.get_trades()} != trades:
+            problems.append(f'guild {guild_id}: trades changed after a reload')
+        if league.draft != draft_state:
+            problems.append(f'guild {guild_id}: draft changed after a reload')
+        league.close()
+
+    return problems
+
+
+def percentile(values: list, q: float):
+    # nearest rank of sorted values
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(harness: Harness, discord: FakeDiscord, elapsed: float):
+    print(f'{"command":<36}{"calls":>7}{"errors":>8}{"conflicts":>11}{"p50":>10}{"p95":>10}{"p99":>10}{"discord":>9}')
+
+    for command in sorted(harness.latencies):
+        latencies = sorted(harness.latencies[command])
+        row = f'{command:<36}{len(latencies):>7}{harness.errors[command]:>8}{harness.conflicts[command]:>11}'
+        row += "".join(f'{percentile(latencies, q) * 1000:>8.1f}ms' for q in (0.5, 0.95, 0.99))
+        print(row + f'{discord.calls[command] / len(latencies):>9.2f}')
+
+    calls = sum(len(latencies) for latencies in harness.latencies.values())
+    print(f'\n{calls} commands in {elapsed:.1f}s ({calls / elapsed:.0f}/s), {discord.calls["background"]} discord calls in the background')
+    if discord.rate_limited:
+        print("429s: " + ", ".join(f'{route} {count}' for route, count in sorted(discord.rate_limited.items())))
+
+    for command, error in sorted(harness.first_errors.items()):
+        print(f'{command} raised {error}')
+
+
+async def simulate(args, directory: str):
+    rng = random.Random(args.seed)
+    discord = FakeDiscord(rng, args.latency, args.rate_limit)
+
+    # everything that would talk to discord or the real data directory
+    bot.names.bot = FakeBot(discord, args.cached_members)
+    bot.discord_calls.client = FakeDiscordClient(discord)
+    bot.bus = cluster.Bus(os.path.join(directory, ".bus"), on_message=bot.on_bus_message)
+    bot.leagues.bus = bot.bus
+    bot.leagues.data_dir = directory
+    bot.leagues.backend = args.backend
+    bot.leagues.max_active = max(bot.leagues.max_active, args.guilds)
+
+    harness = Harness(discord)
+    bot.start_background_tasks()
+
+    users = [
+        SimulatedUser(harness, random.Random(rng.random()), user_id, 1 + user_id % args.guilds, args.think_time, args.roster_size,
+                      args.pick_seconds if args.draft and user_id < 1000 + args.guilds else None)
+        for user_id in range(1000, 1000 + args.users)
+    ]
+
+    start = time.monotonic()
+    await asyncio.gather(*(user.run(start + args.duration) for user in users))
+    elapsed = time.monotonic() - start
+
+    # embed edits still queued count as background work, a busy trading
+    # channel can easily be behind by more than its rate limit lets through
+    try:
+        await asyncio.wait_for(bot.discord_calls.drain(), DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f'{len(bot.discord_calls)} embed edits were still queued {DRAIN_TIMEOUT}s after the run')
+
+    bot.draft_clock.close()
+    for task in bot.background_tasks:
+        task.cancel()
+    await bot.discord_calls.close()
+    bot.bus.close()
+
+    return harness, discord, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the command handlers against a fake discord")
+    parser.add_argument("--users", type=int, default=USERS, help="simulated users")
+    parser.add_argument("--guilds", type=int, default=GUILDS, help="guilds the users are spread over, each has its own league")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds to run for")
+    parser.add_argument("--latency", type=float, default=LATENCY, help="average seconds per discord call")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT, help="chance of a 429 for every discord call")
+    parser.add_argument("--think-time", type=float, default=THINK_TIME, help="average seconds between a user's commands")
+    parser.add_argument("--roster-size", type=int, default=ROSTER_SIZE, help="players a user adds before trading")
+    parser.add_argument("--cached-members", type=float, default=CACHED_MEMBERS, help="share of members get_name finds without a fetch_user")
+    parser.add_argument("--draft", action="store_true", help="fill rosters with a snake draft instead of /team add")
+    parser.add_argument("--pick-seconds", type=float, default=PICK_SECONDS, help="time per draft pick")
+    parser.add_argument("--backend", choices=["tinydb", "sqlite"], default="tinydb")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as directory:
+        harness, discord, elapsed = asyncio.run(simulate(args, directory))
+        report(harness, discord, elapsed)
+
+        problems = check_invariants(bot.leagues) + check_reload(bot.leagues)
+
+    if problems:
+        print(f'\n{len(problems)} invariant violations:')
+        for problem in problems:
+            print(f'- {problem}')
+
+    if problems or harness.errors:
+        sys.exit(1)
+
+    print("\nNo invariant violations")
+
+
+if __name__ == "__main__":
+    main()
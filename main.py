@@ -1,332 +1,664 @@
-from calendar import c
+import asyncio
+import io
 import nextcord
 from nextcord.ext import commands
 import os
-import tinydb
-from league import League, Trade, ReturnCodes, ALL_CHARACHTERS
+import random
+from functools import partial
+from league import Trade, ReturnCodes
+from registry import LeagueRegistry
+from async_league import AsyncLeague
+from names import NameCache
+from fanout import fan_out
+import pages
+from pages import team_label, format_players, pick_text
+import bulk
+import draft
+import ledger
+import outbox
+from outbox import Outbox, DiscordClient
+import cluster
+import metrics
 import logging
 
-logging.basicConfig(level=logging.INFO)
+# the original guild, its league lives directly in data/ instead of data/<guild_id>/
+TESTING_GUILD_ID = 1190771563625201724  # Replace with your guild ID
 
-#set logging level of nextcord
-logging.getLogger('nextcord').setLevel(logging.ERROR)
+# register commands in these guilds only (instant) instead of globally, e.g. "123,456"
+GUILD_IDS = [int(guild_id) for guild_id in os.getenv("GUILD_IDS", "").split(",") if guild_id] or None
 
-TESTING_GUILD_ID = 1190771563625201724  # Replace with your guild ID
+# leagues untouched for this long are flushed and unloaded
+LEAGUE_IDLE_TIMEOUT = 60 * 60
+
+# shown when a command times out waiting for a conflicting one
+CONFLICT_MESSAGE = "Someone else is changing this right now, try again!"
+
+# how long a command waits for another process to hand over its league,
+# discord wants an answer within 3 seconds
+LEAGUE_WAIT = 2
+
+# "tinydb" (json files) or "sqlite", see `python storage.py migrate data` to convert
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "tinydb")
+
+# set by cluster.py when running as one of several worker processes, each
+# connecting SHARD_IDS out of SHARD_COUNT gateway shards
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or 0) or None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id] or None
 
 # member intent
 intents = nextcord.Intents.default()
 intents.members = True
 
-bot = commands.Bot(intents=intents)
+if SHARD_COUNT:
+    # commands are the same everywhere, only the worker with shard 0 registers them
+    rollout = not SHARD_IDS or 0 in SHARD_IDS
+    bot = commands.AutoShardedBot(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS,
+                                  rollout_register_new=rollout, rollout_update_known=rollout, rollout_delete_unknown=rollout)
+else:
+    bot = commands.Bot(intents=intents)
 
-league = League("data/league.json", "data/trades.json")
+names = NameCache(bot)
 
+# rendered pages of the listing commands, valid until their league changes
+page_cache = pages.PageCache()
 
-async def get_name(user_id: int):
-    guild = bot.get_guild(TESTING_GUILD_ID)
-    # get username of owner from user id
-    try:
-        name = (await bot.fetch_user(user_id)).name
-    except nextcord.errors.NotFound:
-        logging.warn(f'User {user_id} not found!')
-        return "Unknown Owner"
+# embed edits go through a rate limit aware queue instead of being awaited by commands
+discord_calls = Outbox(DiscordClient(bot))
+
+
+def on_league_load(guild_id: int, league: AsyncLeague):
+    league.add_listener(partial(queue_expired_trades, league))
+
+    # catch trades that went stale while the league wasn't loaded
+    check_trades(league)
+
+    # a running draft picks up where it left off
+    schedule_draft(guild_id, league)
 
+def on_bus_message(message: dict):
+    # another process needs a league we have loaded
+    if message.get("type") == cluster.RELEASE:
+        guild_id = leagues.find(message["path"])
+        if guild_id is not None:
+            task = asyncio.create_task(release_league(guild_id))
+            release_tasks.add(task)
+            task.add_done_callback(release_tasks.discard)
 
-    # get nickname of owner from user id
-    member = guild.get_member(user_id)
-    if member.nick:
-        logging.info(f'Using nickname {member.nick} for {name}')
-        name = member.nick
+def on_league_evict(guild_id: int):
+    # whoever loads the league next runs its clock
+    draft_clock.cancel(guild_id)
 
-    return name
+async def release_league(guild_id: int):
+    # no auto-pick may start now, the other process takes the draft over
+    draft_clock.cancel(guild_id)
+
+    # let commands that are halfway through a change finish first
+    league = leagues.leagues.get(guild_id)
+    while league is not None and league.locks.locks:
+        await asyncio.sleep(cluster.LOCK_POLL)
+
+    await leagues.evict_async(guild_id)
+    names.forget_guild(guild_id)
+    logging.info(f'Released league for guild {guild_id} to another process')
+
+release_tasks = set()
+
+# leagues are shared with other workers and bulk.py through the data directory
+bus = cluster.Bus(cluster.BUS_DIR, on_message=on_bus_message)
+
+leagues = LeagueRegistry("data", idle_timeout=LEAGUE_IDLE_TIMEOUT, legacy_guild_id=TESTING_GUILD_ID, on_load=on_league_load, backend=STORAGE_BACKEND, write_behind=True, wrap=AsyncLeague, bus=bus, on_evict=on_league_evict)
+
+
+async def get_league(interaction: nextcord.Interaction) -> AsyncLeague:
+    # raises cluster.LeagueBusy, answered by on_application_command_error
+    return await leagues.get_async(interaction.guild_id, LEAGUE_WAIT)
+
+async def send_listing(interaction: nextcord.Interaction, listing: pages.Listing):
+    await pages.send(interaction, page_cache, listing, await get_league(interaction), partial(leagues.get_async, interaction.guild_id, LEAGUE_WAIT))
+
+async def get_name(guild_id: int, user_id: int):
+    # nickname if the owner has one, username otherwise
+    return await names.get(guild_id, user_id)
 
 @bot.event
 async def on_ready():
     logging.info(f'We have logged in as {bot.user}')
     logging.info(f'Bot is in {len(bot.guilds)} guilds')
-    logging.info(f'Guild ID: {TESTING_GUILD_ID}')
+
+    # every guild gets an equal share of the name cache, so warming one doesn't push out the others
+    share = names.max_size // max(1, len(bot.guilds))
+    for guild in bot.guilds:
+        await names.warm(guild, share)
+
+    # leagues with a draft running need their clock ticking before anyone uses them
+    for guild in bot.guilds:
+        if os.path.exists(draft_marker(guild.id)):
+            try:
+                await leagues.get_async(guild.id)
+            except cluster.LeagueBusy:
+                logging.warning(f'League of guild {guild.id} is busy, its draft resumes once it is loaded')
+
+    # keep expired trade embeds up to date and unload idle leagues in the background
+    if not background_tasks:
+        start_background_tasks()
+
+@bot.event
+async def on_application_command_error(interaction: nextcord.Interaction, error: Exception):
+    error = getattr(error, "original", error)
+    if isinstance(error, cluster.LeagueBusy):
+        # another process didn't hand the league over in time, it will soon
+        await pages.answer_busy(interaction)
+        return
+
+    logging.error(f'Command {interaction.application_command} failed', exc_info=error)
+
+async def dump_metrics():
+    while True:
+        await asyncio.sleep(60)
+        metrics.dump()
+
+async def evict_idle_leagues():
+    while True:
+        await asyncio.sleep(LEAGUE_IDLE_TIMEOUT / 4)
+        await leagues.evict_idle()
+
+@bot.event
+async def on_member_update(before: nextcord.Member, after: nextcord.Member):
+    names.update_member(after)
+
+@bot.event
+async def on_user_update(before: nextcord.User, after: nextcord.User):
+    names.update_user(after)
 
 ########## TEAM COMMANDS ##########
 
-@bot.slash_command(guild_ids=[TESTING_GUILD_ID], name="team", description="Manage your team")
+@bot.slash_command(guild_ids=GUILD_IDS, dm_permission=False, name="team", description="Manage your team")
 async def team_cmd(interaction: nextcord.Interaction):
     pass
 
 @team_cmd.subcommand(description="View your team")
+@metrics.timed("command_seconds", command="team view")
 async def view(interaction: nextcord.Interaction, team: str = nextcord.SlashOption("team", required=False, description="The name of the team you want to view")):
+    league = await get_league(interaction)
     if team:
-        team = league.teams_db.get(tinydb.Query().user_id == int(team))
+        team = league.get_team(int(team))
     else:
         team = league.get_team(interaction.user.id)
 
     if team:
-        msg = f'## {team["team_name"]}'
-        if len(team["players"]) == 0:
-            msg += "\nNo Players Yet!"
-        else:
-            msg += "\nPlayers:\n"
-            for player in team["players"]:
-                msg += f'- {player.title()}\n'
-
-        await interaction.response.send_message(msg, ephemeral=True)
+        await send_listing(interaction, pages.Roster(team["user_id"]))
     else:
         await interaction.response.send_message("You don't have a team!", ephemeral=True)
 
 @view.on_autocomplete("team")
+@metrics.timed("autocomplete_seconds", command="team view", option="team")
 async def view_autocomplete(interaction: nextcord.Interaction, team: str):
-    choices = league.get_teams(True)
+    league = await get_league(interaction)
+    choices = league.search_teams(team)
     await interaction.response.send_autocomplete(choices)
 
 @team_cmd.subcommand(description="Create a new team")
+@metrics.timed("command_seconds", command="team create")
 async def create(interaction: nextcord.Interaction, team_name: str = nextcord.SlashOption(required=True, description="The name of your team")):
-    
+    league = await get_league(interaction)
     # check if user already has a team
     if league.get_team(interaction.user.id):
         await interaction.response.send_message("You already have a team!", ephemeral=True)
         return
 
     # create team
-    league.create_team(interaction.user.id, team_name)
+    team = await league.create_team(interaction.user.id, team_name)
+    if team == ReturnCodes.ALREADY_HAS_TEAM:
+        await interaction.response.send_message("You already have a team!", ephemeral=True)
+        return
+    elif team == ReturnCodes.CONFLICT:
+        await interaction.response.send_message(CONFLICT_MESSAGE, ephemeral=True)
+        return
 
-    await interaction.response.send_message(f'{await get_name(interaction.user.id)} created a team called {team_name}!')
-    logging.info(f'{await get_name(interaction.user.id)} created a team called {team_name}')
+    name = await get_name(interaction.guild_id, interaction.user.id)
+    await interaction.response.send_message(f'{name} created a team called {team_name}!')
+    logging.info(f'{name} created a team called {team_name}')
 
 @team_cmd.subcommand(description="Delete your team")
+@metrics.timed("command_seconds", command="team delete")
 async def delete(interaction: nextcord.Interaction):
-    if league.delete_team(interaction.user.id) == ReturnCodes.SUCCESS:
-        await interaction.response.send_message(f'{await get_name(interaction.user.id)} deleted their team!')
-
-        logging.info(f'{await get_name(interaction.user.id)} deleted their team')
+    league = await get_league(interaction)
+    result = await league.delete_team(interaction.user.id)
+    if result == ReturnCodes.SUCCESS:
+        name = await get_name(interaction.guild_id, interaction.user.id)
+        await interaction.response.send_message(f'{name} deleted their team!')
+
+        logging.info(f'{name} deleted their team')
+    elif result == ReturnCodes.CONFLICT:
+        await interaction.response.send_message(CONFLICT_MESSAGE, ephemeral=True)
     else:
         await interaction.response.send_message("You don't have a team!", ephemeral=True)
 
 @team_cmd.subcommand(description="Add a player to your team")
+@metrics.timed("command_seconds", command="team add")
 async def add(interaction: nextcord.Interaction, player: str = nextcord.SlashOption(required=True, description="The name of the player you want to add")):
+    league = await get_league(interaction)
     team = league.get_team(interaction.user.id)
     player = player.upper()
 
     if team:
-        if player in team["players"]:
+        # teams that aren't in the draft keep picking up free agents as usual
+        running = draft.running_draft(league)
+        if running and interaction.user.id in running.order:
+            await interaction.response.send_message("The draft is on, use /draft pick or /draft queue!", ephemeral=True)
+            return
+
+        if league.get_owner(player) == interaction.user.id:
             await interaction.response.send_message("Player is already on your team!", ephemeral=True)
             return
 
-        if player not in league.free_agents:
-            if player in ALL_CHARACHTERS:
+        if not league.is_free_agent(player):
+            if league.is_character(player):
                 await interaction.response.send_message("Player is not a free agent!", ephemeral=True)
                 return
             else:
-                await interaction.response.send_message("Player does not exist!", ephemeral=True)
+                suggestion = league.search_characters(player)
+                if suggestion:
+                    await interaction.response.send_message(f'Player does not exist! Did you mean {suggestion[0]}?', ephemeral=True)
+                else:
+                    await interaction.response.send_message("Player does not exist!", ephemeral=True)
                 return
 
-        league.add_player(interaction.user.id, player)
-        await interaction.response.send_message(f'{await get_name(interaction.user.id)} added {player.title()} to their team!')
+        # someone else may have picked the player while we were checking
+        result = await league.add_player(interaction.user.id, player)
+        if result == ReturnCodes.NOT_FREE_AGENT:
+            await interaction.response.send_message("Player was just picked by someone else!", ephemeral=True)
+            return
+        elif result != ReturnCodes.SUCCESS:
+            await interaction.response.send_message(CONFLICT_MESSAGE, ephemeral=True)
+            return
+
+        name = await get_name(interaction.guild_id, interaction.user.id)
+        await interaction.response.send_message(f'{name} added {player.title()} to their team!')
 
-        logging.info(f'{await get_name(interaction.user.id)} added {player.title()} to their team')
+        logging.info(f'{name} added {player.title()} to their team')
     else:
         await interaction.response.send_message("You don't have a team!", ephemeral=True)
 
 @add.on_autocomplete("player")
+@metrics.timed("autocomplete_seconds", command="team add", option="player")
 async def add_autocomplete(interaction: nextcord.Interaction, player: str):
-    choices = league.free_agents
-    choices = [c.title() for c in choices if c.upper().startswith(player.upper())]
+    league = await get_league(interaction)
+    choices = league.search_free_agents(player)
 
-    await interaction.response.send_autocomplete(choices[:25])
+    await interaction.response.send_autocomplete(choices)
 
 @team_cmd.subcommand(description="Drop a player from your team")
+@metrics.timed("command_seconds", command="team drop")
 async def drop(interaction: nextcord.Interaction, player: str = nextcord.SlashOption("player", required=True, description="The name of the player you want to remove")):
+    league = await get_league(interaction)
     team = league.get_team(interaction.user.id)
     player = player.upper()
 
     if team:
-        if player not in team["players"]:
+        if league.get_owner(player) != interaction.user.id:
             await interaction.response.send_message("Player is not on your team!", ephemeral=True)
             return
 
-        league.remove_player(interaction.user.id, player)
-        await interaction.response.send_message(f'{await get_name(interaction.user.id)} dropped {player.title()} from their team!')
+        result = await league.remove_player(interaction.user.id, player)
+        if result == ReturnCodes.NOT_ON_TEAM:
+            await interaction.response.send_message("Player is not on your team anymore!", ephemeral=True)
+            return
+        elif result != ReturnCodes.SUCCESS:
+            await interaction.response.send_message(CONFLICT_MESSAGE, ephemeral=True)
+            return
+
+        name = await get_name(interaction.guild_id, interaction.user.id)
+        await interaction.response.send_message(f'{name} dropped {player.title()} from their team!')
 
-        logging.info(f'{await get_name(interaction.user.id)} dropped {player.title()} from their team')
+        logging.info(f'{name} dropped {player.title()} from their team')
     else:
         await interaction.response.send_message("You don't have a team!", ephemeral=True)
 
 @drop.on_autocomplete("player")
+@metrics.timed("autocomplete_seconds", command="team drop", option="player")
 async def drop_autocomplete(interaction: nextcord.Interaction, drop: str):
-    choices = league.get_team(interaction.user.id)["players"]
-    choices = [c.title() for c in choices if c.upper().startswith(drop.upper())]
+    league = await get_league(interaction)
+    choices = league.search_roster(interaction.user.id, drop)
 
     await interaction.response.send_autocomplete(choices)
 
 ########## LEAGUE COMMANDS ##########
 
-@bot.slash_command(guild_ids=[TESTING_GUILD_ID], description="View league information", name="league")
+@bot.slash_command(guild_ids=GUILD_IDS, dm_permission=False, description="View league information", name="league")
 async def league_cmd(interaction: nextcord.Interaction):
     pass
 
 @league_cmd.subcommand(description="View all free agents")
+@metrics.timed("command_seconds", command="league free_agents")
 async def free_agents(interaction: nextcord.Interaction):
-    free_agents = league.get_free_agents()
-
-    msg = "## Free Agents\n"
-    if len(free_agents) == 0:
-        msg += "No free agents yet!"
-    else:
-        for player in free_agents:
-            msg += f'- {player.title()}\n'
-
-    await interaction.response.send_message(msg, ephemeral=True)
+    await send_listing(interaction, pages.FreeAgents())
 
 @league_cmd.subcommand(description="View all teams")
+@metrics.timed("command_seconds", command="league teams")
 async def teams(interaction: nextcord.Interaction):
-    teams = league.get_teams()
-
-    msg = "## Teams\n"
-    if len(teams) == 0:
-        msg += "No teams yet!"
-    else:
-        for team in teams:
-            msg += f'- {team["team_name"]} - (Owner: {await get_name(team["user_id"])})\n'
-
-    await interaction.response.send_message(msg, ephemeral=True)
+    await send_listing(interaction, pages.Teams(partial(get_name, interaction.guild_id)))
 
 @league_cmd.subcommand(description="View all trades")
+@metrics.timed("command_seconds", command="league trades")
 async def trades(interaction: nextcord.Interaction):
-    trades = league.get_trades()
+    await send_listing(interaction, pages.Trades())
 
-    msg = "## Pending Trades\n"
-    if len(trades) == 0:
-        msg += "No trades yet!"
-    else:
-        for trade in trades:
-            user1_team = league.get_team(trade.user1_id)
-            user2_team = league.get_team(trade.user2_id)
+@league_cmd.subcommand(description="View recent roster moves and trades")
+@metrics.timed("command_seconds", command="league history")
+async def history(interaction: nextcord.Interaction, team: str = nextcord.SlashOption("team", required=False, description="Only show this team")):
+    await send_listing(interaction, pages.History(int(team) if team else None))
+
+@history.on_autocomplete("team")
+@metrics.timed("autocomplete_seconds", command="league history", option="team")
+async def history_autocomplete(interaction: nextcord.Interaction, team: str):
+    league = await get_league(interaction)
+    await interaction.response.send_autocomplete(league.search_teams(team))
+
+@league_cmd.subcommand(description="View league statistics")
+@metrics.timed("command_seconds", command="league stats")
+async def stats(interaction: nextcord.Interaction):
+    league = await get_league(interaction)
+    stats = league.stats
 
-            msg += f'- {user1_team["team_name"]} wants to trade {trade.user1_trade.title()} for {user2_team["team_name"]}\'s {trade.user2_trade.title()}\n'
+    msg = "## League Stats\n"
+    msg += f'{stats.totals[ledger.ACCEPT]} trades, {stats.totals[ledger.ADD]} adds and {stats.totals[ledger.DROP]} drops so far\n'
+
+    msg += "### Most Traded Players\n"
+    for player, count in stats.traded.top(5):
+        msg += f'- {player.title()} ({count})\n'
+
+    msg += "### Most Active Teams\n"
+    for user_id, count in stats.transactions.top(5):
+        msg += f'- {team_label(league, user_id)} ({count})\n'
+
+    msg += "### Longest Tenured Players\n"
+    for player, user_id, since in stats.longest_tenure(5):
+        msg += f'- {player.title()} on {team_label(league, user_id)} since <t:{int(since)}:D>\n'
 
-            # add indented link to message
-            msg += f'  - [View Trade](https://discord.com/channels/{TESTING_GUILD_ID}/{interaction.channel_id}/{trade.message_id})\n'
     await interaction.response.send_message(msg, ephemeral=True)
 
+########## ADMIN COMMANDS ##########
+
+@bot.slash_command(guild_ids=GUILD_IDS, dm_permission=False, description="Manage the whole league", name="admin", default_member_permissions=nextcord.Permissions(administrator=True))
+async def admin_cmd(interaction: nextcord.Interaction):
+    pass
+
+@admin_cmd.subcommand(name="import", description="Load teams, rosters and trades from a json or csv file")
+@metrics.timed("command_seconds", command="admin import")
+async def import_league(
+    interaction: nextcord.Interaction,
+    file: nextcord.Attachment = nextcord.SlashOption(required=True, description="A json or csv file, see bulk.py for the format"),
+    replace: bool = nextcord.SlashOption(required=False, default=False, description="Delete teams and trades that aren't in the file"),
+):
+    league = await get_league(interaction)
+    await interaction.response.defer(ephemeral=True)
+
+    try:
+        data = bulk.parse((await file.read()).decode("utf-8-sig"), file.filename)
+    except (ValueError, UnicodeDecodeError) as e:
+        await interaction.followup.send(f'Could not read {file.filename}: {e}', ephemeral=True)
+        return
+
+    result = await league.import_league(data, replace)
+    if result == ReturnCodes.CONFLICT:
+        await interaction.followup.send(CONFLICT_MESSAGE, ephemeral=True)
+        return
+    elif result != ReturnCodes.SUCCESS:
+        msg = f'Nothing was imported, {len(result)} problems:\n'
+        msg += "".join(f'- {error}\n' for error in result[:bulk.MAX_ERRORS])
+        if len(result) > bulk.MAX_ERRORS:
+            msg += f'- and {len(result) - bulk.MAX_ERRORS} more\n'
+        await interaction.followup.send(msg, ephemeral=True)
+        return
+
+    await interaction.followup.send(f'Imported {len(data["teams"])} teams and {len(data["trades"])} trades!', ephemeral=True)
+    logging.info(f'{interaction.user.id} imported {len(data["teams"])} teams into guild {interaction.guild_id}')
+
+@admin_cmd.subcommand(name="export", description="Download the whole league")
+@metrics.timed("command_seconds", command="admin export")
+async def export_league(
+    interaction: nextcord.Interaction,
+    format: str = nextcord.SlashOption(required=False, default="json", choices=["json", "csv"], description="csv only has teams and rosters"),
+):
+    league = await get_league(interaction)
+    data = bulk.dumps(league, format)
+    await interaction.response.send_message(file=nextcord.File(io.BytesIO(data.encode()), filename=f'league.{format}'), ephemeral=True)
+
 ########## TRADE COMMANDS ##########
     
-async def check_trades():
-    # check if any trades have expired
-    trades = league.get_trades()
-    for trade in trades:
-        if trade.validate_trade(league) != ReturnCodes.SUCCESS:
-            league.cancel_trade(trade)
-
-            # update trade embed
-            msg = await bot.get_channel(trade.channel_id).fetch_message(trade.message_id)
-            embed = await trade_embed(trade)
-            embed.color = nextcord.Color.red()
-            await msg.edit(embed=embed)
-
+# (league, trade) pairs expired by roster changes, their embeds are updated in the background
+trade_updates = asyncio.Queue()
+background_tasks = []
+
+def queue_expired_trades(league, players, user_ids, expired):
+    for trade in expired:
+        trade_updates.put_nowait((league, trade))
+
+def start_background_tasks():
+    bus.start()
+    discord_calls.start()
+    background_tasks.append(asyncio.create_task(update_expired_trades()))
+    background_tasks.append(asyncio.create_task(evict_idle_leagues()))
+    if metrics.FILE:
+        background_tasks.append(asyncio.create_task(dump_metrics()))
+
+async def update_expired_trades():
+    while True:
+        # take everything that queued up so a burst is updated together
+        expired = [await trade_updates.get()]
+        while not trade_updates.empty():
+            expired.append(trade_updates.get_nowait())
+
+        await update_trade_embeds(expired)
+
+def check_trades(league: AsyncLeague):
+    # full sweep over every open trade, roster changes already expire the
+    # trades they affect so this is only needed when a league is loaded.
+    # the league's listeners queue the embed updates
+    league.sweep_trades()
+
+async def update_trade_embeds(expired):
+    # build the embeds together, one failing doesn't stop the rest
+    results = await fan_out(expire_trade_embed, expired)
+    for (league, trade), result in zip(expired, results):
+        if not isinstance(result, Exception):
             logging.info(f'Trade {trade.message_id} expired')
 
+async def expire_trade_embed(item):
+    league, trade = item
+    if trade.message_id is None or trade.channel_id is None:
+        return
+
+    embed = await trade_embed(league, trade)
+    embed.color = nextcord.Color.red()
+    discord_calls.edit_message(trade.channel_id, trade.message_id, embed, priority=outbox.LOW)
 
-async def trade_embed(trade: Trade):
-    user1_team = league.get_team(trade.user1_id)
-    user2_team = league.get_team(trade.user2_id)
+
+async def trade_embed(league: AsyncLeague, trade: Trade):
+    # every owner is resolved together
+    names = await fan_out(partial(get_name, league.guild_id), list(trade.sides))
 
     embed=nextcord.Embed(title="Trade Proposal", description="A trade proposal has been created!", color=nextcord.Color.blue())
-    embed.add_field(name=trade.user1_trade.title(), value=f'{user1_team["team_name"]} - {await get_name(user1_team["user_id"])}', inline=True)
-    embed.add_field(name="for", value="", inline=True)
-    embed.add_field(name=trade.user2_trade.title(), value=f'{user2_team["team_name"]} - {await get_name(user2_team["user_id"])}', inline=True)
+    for (user_id, players), name in zip(trade.sides.items(), names):
+        name = "Unknown Owner" if isinstance(name, Exception) else name
+
+        # an expired trade can refer to a team that has since been deleted
+        team = league.get_team(user_id)
+        team_name = team["team_name"] if team else "Deleted Team"
+
+        embed.add_field(name=f'{team_name} - {name}', value=f'Gives: {format_players(players)}\nGets: {format_players(trade.receives(user_id))}', inline=True)
     embed.set_footer(text="Right click or long press this message then click Apps -> Accept/Deny Trade")
 
     return embed
 
-@bot.slash_command(guild_ids=[TESTING_GUILD_ID], description="Manage trades", name="trade")
+@bot.slash_command(guild_ids=GUILD_IDS, dm_permission=False, description="Manage trades", name="trade")
 async def trade_cmd(interaction: nextcord.Interaction):
     pass
 
+def parse_players(text: str):
+    # comma separated, in the order given and without repeats
+    return list(dict.fromkeys(player.strip().upper() for player in (text or "").split(",") if player.strip()))
+
+def complete_players(text: str, search):
+    # completes the last name of a comma separated list and keeps the ones before it
+    *done, current = text.split(",")
+    done = [player.strip() for player in done if player.strip()]
+    prefix = "".join(f'{player}, ' for player in done)
+    taken = {player.upper() for player in done}
+
+    return [prefix + player for player in search(current.strip()) if player.upper() not in taken][:25]
+
+def option_value(interaction: nextcord.Interaction, name: str):
+    for option in interaction.data["options"][0]["options"]:
+        if option["name"] == name:
+            return option.get("value")
+
+    return None
+
 @trade_cmd.subcommand(description="Create a trade")
-async def create(interaction: nextcord.Interaction, user2: str = nextcord.SlashOption("other_team", required=True, description="The team you want to trade with"), user1_trade: str = nextcord.SlashOption(required=True, description="The player you want to trade", name="your_player"), user2_trade: str = nextcord.SlashOption(required=True, description="The player you want to trade for", name="for_player")):
+@metrics.timed("command_seconds", command="trade create")
+async def create(interaction: nextcord.Interaction,
+                 user2: str = nextcord.SlashOption("other_team", required=True, description="The team you want to trade with"),
+                 user1_trade: str = nextcord.SlashOption(required=True, description="The players you want to trade, separated by commas", name="your_players"),
+                 user2_trade: str = nextcord.SlashOption(required=True, description="The players you want from them, separated by commas", name="for_players"),
+                 user3: str = nextcord.SlashOption("third_team", required=False, default=None, description="A third team: your players go to the other team, theirs to the third team and the third team's to you"),
+                 user3_trade: str = nextcord.SlashOption(required=False, default=None, description="The players you want from the third team, separated by commas", name="third_team_players")):
+    league = await get_league(interaction)
     user2 = int(user2)
-    user1_team = league.get_team(interaction.user.id)
-    user2_team = league.get_team(user2)
+    user3 = int(user3) if user3 else None
 
-    user1_trade = user1_trade.upper()
-    user2_trade = user2_trade.upper()
+    user1_players = parse_players(user1_trade)
+    user2_players = parse_players(user2_trade)
+    user3_players = parse_players(user3_trade)
 
-    if interaction.user.id == user2:
+    if interaction.user.id in (user2, user3):
         await interaction.response.send_message("You can't trade with yourself!", ephemeral=True)
         return
 
-    if user1_team and user2_team:
-        if user1_trade not in user1_team["players"]:
-            await interaction.response.send_message("You don't have that player!", ephemeral=True)
-            return
+    if user2 == user3 or bool(user3) != bool(user3_players):
+        await interaction.response.send_message("A three team trade needs a different third team and players from it!", ephemeral=True)
+        return
 
-        if user2_trade not in user2_team["players"]:
-            await interaction.response.send_message("They don't have that player!", ephemeral=True)
-            return
+    if not league.get_team(interaction.user.id):
+        await interaction.response.send_message("You don't have a team!", ephemeral=True)
+        return
 
-        trade = league.create_trade(interaction.user.id, user2, user1_trade, user2_trade)
-        if trade == ReturnCodes.INVALID_TRADE:
-            await interaction.response.send_message("Invalid trade!", ephemeral=True)
-            return
+    if not league.get_team(user2) or (user3 and not league.get_team(user3)):
+        await interaction.response.send_message("That team doesn't exist!", ephemeral=True)
+        return
 
-        # create ping for other user
-        user2_ping = f'<@{user2}> you have a new trade proposal!'
+    for user_id, players, whose in ((interaction.user.id, user1_players, "You don't"), (user2, user2_players, "They don't"), (user3, user3_players, "The third team doesn't")):
+        for player in players:
+            if league.get_owner(player) != user_id:
+                await interaction.response.send_message(f'{whose} have {player.title()}!', ephemeral=True)
+                return
 
-        # send embed
-        embed = await trade_embed(trade)
-        msg = await interaction.response.send_message(user2_ping, embed=embed)
-        full_msg: nextcord.Message = await msg.fetch()
+    # a third team makes it a loop: you -> other team -> third team -> you
+    sides = {interaction.user.id: user1_players, user2: user2_players}
+    destinations = None
+    if user3:
+        sides[user3] = user3_players
+        destinations = {player: user2 for player in user1_players}
+        destinations.update({player: user3 for player in user2_players})
+        destinations.update({player: interaction.user.id for player in user3_players})
+
+    trade = await league.create_trade(sides, destinations)
+    if trade == ReturnCodes.INVALID_TRADE:
+        await interaction.response.send_message("Invalid trade!", ephemeral=True)
+        return
+    elif trade == ReturnCodes.CONFLICT:
+        await interaction.response.send_message(CONFLICT_MESSAGE, ephemeral=True)
+        return
 
-        # update trade with message id
-        league.assign_trade_message(trade, full_msg.id)
+    # building the embed can take longer than discord's 3 second window.
+    # a public defer makes every followup public, so it waits until there's
+    # a trade to show
+    await interaction.response.defer()
 
-        logging.info(f'{await get_name(interaction.user.id)} created a trade with {await get_name(user2)}')
-    else:
-        await interaction.response.send_message("You don't have a team!", ephemeral=True)
+    # create ping for the other teams
+    pings = f'{", ".join(f"<@{user_id}>" for user_id in trade.partners())} you have a new trade proposal!'
+
+    # send embed
+    embed = await trade_embed(league, trade)
+    full_msg: nextcord.WebhookMessage = await interaction.followup.send(pings, embed=embed, wait=True)
+
+    # update trade with message id
+    await league.assign_trade_message(trade, full_msg.id, interaction.channel_id)
+
+    logging.info(f'{await get_name(interaction.guild_id, interaction.user.id)} created trade {trade.trade_id} with {len(trade.partners())} teams')
 
 @create.on_autocomplete("user2")
+@metrics.timed("autocomplete_seconds", command="trade create", option="user2")
 async def create_autocomplete(interaction: nextcord.Interaction, other_team: str):
-    choices = league.get_teams()
-    choices_new = {}
-    for c in choices:
-        if c["user_id"] == interaction.user.id:
-            continue
-        if c["team_name"].upper().startswith(other_team.upper()):
-            choices_new[c["team_name"]] = str(c["user_id"])
+    league = await get_league(interaction)
+    choices = league.search_teams(other_team, exclude_user_id=interaction.user.id)
+
+    await interaction.response.send_autocomplete(choices)
 
-    await interaction.response.send_autocomplete(choices_new)
+@create.on_autocomplete("user3")
+@metrics.timed("autocomplete_seconds", command="trade create", option="user3")
+async def create_autocomplete(interaction: nextcord.Interaction, third_team: str):
+    league = await get_league(interaction)
+    choices = league.search_teams(third_team, exclude_user_id=interaction.user.id)
+
+    await interaction.response.send_autocomplete(choices)
 
 @create.on_autocomplete("user1_trade")
-async def create_autocomplete(interaction: nextcord.Interaction, your_player: str):
-    choices = league.get_team(interaction.user.id)["players"]
-    choices = [c.title() for c in choices if c.upper().startswith(your_player.upper())]
+@metrics.timed("autocomplete_seconds", command="trade create", option="user1_trade")
+async def create_autocomplete(interaction: nextcord.Interaction, your_players: str):
+    league = await get_league(interaction)
+    choices = complete_players(your_players, partial(league.search_roster, interaction.user.id))
 
     await interaction.response.send_autocomplete(choices)
 
 @create.on_autocomplete("user2_trade")
-async def create_autocomplete(interaction: nextcord.Interaction, for_player: str):
+@metrics.timed("autocomplete_seconds", command="trade create", option="user2_trade")
+async def create_autocomplete(interaction: nextcord.Interaction, for_players: str):
+    league = await get_league(interaction)
     try:
-        choices = league.get_team(int(interaction.data["options"][0]["options"][0]["value"]))["players"]
-    except ValueError:
+        choices = complete_players(for_players, partial(league.search_roster, int(option_value(interaction, "other_team"))))
+    except (TypeError, ValueError):
+        return
+
+    await interaction.response.send_autocomplete(choices)
+
+@create.on_autocomplete("user3_trade")
+@metrics.timed("autocomplete_seconds", command="trade create", option="user3_trade")
+async def create_autocomplete(interaction: nextcord.Interaction, third_team_players: str):
+    league = await get_league(interaction)
+    try:
+        choices = complete_players(third_team_players, partial(league.search_roster, int(option_value(interaction, "third_team"))))
+    except (TypeError, ValueError):
         return
-    
-    choices = [c.title() for c in choices if c.upper().startswith(for_player.upper())]
 
     await interaction.response.send_autocomplete(choices)
 
 # handle trade accept/deny
-@bot.message_command(name="Accept Trade")
+@bot.message_command(guild_ids=GUILD_IDS, dm_permission=False, name="Accept Trade")
+@metrics.timed("command_seconds", command="Accept Trade")
 async def accept_trade_cmd(interaction: nextcord.Interaction, message: nextcord.Message):
+    league = await get_league(interaction)
     trade = league.get_trade(message.id)
 
     if trade and trade.validate_trade(league) == ReturnCodes.SUCCESS:
-        if interaction.user.id == trade.user2_id:
-            league.process_trade(trade)
+        if interaction.user.id in trade.partners():
+            # a player may have been dropped or traded in the meantime
+            result = await league.accept_trade(trade, interaction.user.id)
+            if result == ReturnCodes.WAITING_FOR_TEAMS:
+                waiting = [f'<@{user_id}>' for user_id in trade.partners() if user_id != interaction.user.id and user_id not in trade.accepted]
+                await interaction.response.send_message(f'<@{interaction.user.id}> accepted the trade, waiting on {", ".join(waiting)}')
+                return
+            elif result != ReturnCodes.SUCCESS:
+                await interaction.response.send_message(CONFLICT_MESSAGE if result == ReturnCodes.CONFLICT else "This trade is no longer valid!", ephemeral=True)
+                return
 
-            await interaction.response.send_message(f'<@{trade.user1_id}>, <@{trade.user2_id}> accepted the trade!')
+            await interaction.response.send_message(f'{", ".join(f"<@{user_id}>" for user_id in trade.sides)} accepted the trade!')
 
             # change color of embed
-            embed = await trade_embed(trade)
+            embed = await trade_embed(league, trade)
             embed.color = nextcord.Color.green()
-            await message.edit(embed=embed)
+            discord_calls.edit_message(message.channel.id, message.id, embed, priority=outbox.HIGH)
 
             logging.info(f'Trade {trade.message_id} accepted')
         else:
@@ -334,19 +666,25 @@ async def accept_trade_cmd(interaction: nextcord.Interaction, message: nextcord.
     else:
         await interaction.response.send_message("This trade is no longer valid!", ephemeral=True)
 
-@bot.message_command(name="Deny Trade")
+@bot.message_command(guild_ids=GUILD_IDS, dm_permission=False, name="Deny Trade")
+@metrics.timed("command_seconds", command="Deny Trade")
 async def deny_trade_cmd(interaction: nextcord.Interaction, message: nextcord.Message):
+    league = await get_league(interaction)
     trade = league.get_trade(message.id)
 
     if trade and trade.validate_trade(league) == ReturnCodes.SUCCESS:
-        if interaction.user.id == trade.user2_id:
-            league.cancel_trade(trade)
-            await interaction.response.send_message(f'<@{trade.user1_id}>, <@{trade.user2_id}> denied the trade!')
+        if interaction.user.id in trade.partners():
+            result = await league.cancel_trade(trade, interaction.user.id)
+            if result != ReturnCodes.SUCCESS:
+                await interaction.response.send_message(CONFLICT_MESSAGE if result == ReturnCodes.CONFLICT else "This trade is no longer valid!", ephemeral=True)
+                return
+
+            await interaction.response.send_message(f'<@{trade.proposer}>, <@{interaction.user.id}> denied the trade!')
 
             # change color of embed
-            embed = await trade_embed(trade)
+            embed = await trade_embed(league, trade)
             embed.color = nextcord.Color.red()
-            await message.edit(embed=embed)
+            discord_calls.edit_message(message.channel.id, message.id, embed, priority=outbox.HIGH)
 
             logging.info(f'Trade {trade.message_id} denied')
         else:
@@ -354,19 +692,25 @@ async def deny_trade_cmd(interaction: nextcord.Interaction, message: nextcord.Me
     else:
         await interaction.response.send_message("This trade is no longer valid!", ephemeral=True)
 
-@bot.message_command(name="Cancel Trade")
+@bot.message_command(guild_ids=GUILD_IDS, dm_permission=False, name="Cancel Trade")
+@metrics.timed("command_seconds", command="Cancel Trade")
 async def cancel_trade_cmd(interaction: nextcord.Interaction, message: nextcord.Message):
+    league = await get_league(interaction)
     trade = league.get_trade(message.id)
 
     if trade and trade.validate_trade(league) == ReturnCodes.SUCCESS:
-        if interaction.user.id == trade.user1_id:
-            league.cancel_trade(trade)
-            await interaction.response.send_message(f'<@{trade.user2_id}>, <@{trade.user1_id}> cancelled the trade!')
+        if interaction.user.id == trade.proposer:
+            result = await league.cancel_trade(trade, interaction.user.id)
+            if result != ReturnCodes.SUCCESS:
+                await interaction.response.send_message(CONFLICT_MESSAGE if result == ReturnCodes.CONFLICT else "This trade is no longer valid!", ephemeral=True)
+                return
+
+            await interaction.response.send_message(f'{", ".join(f"<@{user_id}>" for user_id in trade.partners())}, <@{trade.proposer}> cancelled the trade!')
 
             # change color of embed
-            embed = await trade_embed(trade)
+            embed = await trade_embed(league, trade)
             embed.color = nextcord.Color.red()
-            await message.edit(embed=embed)
+            discord_calls.edit_message(message.channel.id, message.id, embed, priority=outbox.HIGH)
 
             logging.info(f'Trade {trade.message_id} cancelled')
         else:
@@ -374,4 +718,248 @@ async def cancel_trade_cmd(interaction: nextcord.Interaction, message: nextcord.
     else:
         await interaction.response.send_message("This trade is no longer valid!", ephemeral=True)
 
-bot.run(os.getenv("BOT_TOKEN"))
\ No newline at end of file
+########## DRAFT COMMANDS ##########
+
+# at most this many picks are listed in one announcement
+MAX_ANNOUNCED_PICKS = 25
+
+def draft_marker(guild_id: int):
+    # exists while the guild's draft is running, so a restart can find it
+    # without loading every league
+    return leagues.paths(guild_id)[0] + ".drafting"
+
+def schedule_draft(guild_id: int, league: AsyncLeague):
+    running = draft.running_draft(league)
+    draft_clock.schedule(guild_id, running)
+
+    # an idle league would take its clock with it when it's evicted
+    if running:
+        leagues.pinned.add(guild_id)
+    else:
+        leagues.pinned.discard(guild_id)
+
+    marker = draft_marker(guild_id)
+    if running and not os.path.exists(marker):
+        open(marker, "a").close()
+    elif not running and os.path.exists(marker):
+        os.remove(marker)
+
+async def on_draft_timeout(guild_id: int, pick: int):
+    if guild_id not in leagues:
+        # released in the meantime, the process that has it now runs the clock
+        return
+
+    league = leagues.get(guild_id)
+    picks = await league.draft_timeout(pick)
+    if picks != ReturnCodes.CONFLICT and picks:
+        discord_calls.send_message(draft.get_draft(league).channel_id, draft_update(league, picks))
+
+    # on a conflict the timer goes off again right away, the deadline has passed
+    schedule_draft(guild_id, league)
+
+draft_clock = draft.DraftClock(on_draft_timeout)
+
+def draft_update(league, picks):
+    # the picks just made and who is up next
+    current = draft.get_draft(league)
+    lines = [pick_text(league, number, len(current.order), user_id, player, how) for number, user_id, player, how in picks[-MAX_ANNOUNCED_PICKS:]]
+    if len(picks) > MAX_ANNOUNCED_PICKS:
+        lines.insert(0, f'...and {len(picks) - MAX_ANNOUNCED_PICKS} picks before, see /draft board')
+
+    if current.cancelled:
+        lines.append("The draft was cancelled!")
+    elif current.done:
+        lines.append("The draft is over!")
+    else:
+        lines.append(f'<@{current.on_the_clock}> is on the clock, pick <t:{int(current.deadline)}:R>')
+
+    return "\n".join(lines)
+
+async def unknown_player(interaction: nextcord.Interaction, league, player: str):
+    suggestion = league.search_characters(player)
+    if suggestion:
+        await interaction.response.send_message(f'{player.title()} does not exist! Did you mean {suggestion[0]}?', ephemeral=True)
+    else:
+        await interaction.response.send_message(f'{player.title()} does not exist!', ephemeral=True)
+
+@admin_cmd.subcommand(name="draft", description="Start a snake draft")
+@metrics.timed("command_seconds", command="admin draft")
+async def start_draft(
+    interaction: nextcord.Interaction,
+    rounds: int = nextcord.SlashOption(required=True, min_value=1, description="Players every team picks"),
+    pick_seconds: int = nextcord.SlashOption(required=False, default=draft.DEFAULT_PICK_SECONDS, min_value=10, description="Time for each pick before it's made automatically"),
+    order: str = nextcord.SlashOption(required=False, default=None, description="Comma separated team names, teams left out pick after them in random order"),
+    snake: bool = nextcord.SlashOption(required=False, default=True, description="Reverse the order every other round"),
+):
+    league = await get_league(interaction)
+
+    teams = league.get_teams()
+    # names match exactly first, so teams whose names differ only in case can both be placed
+    exact = {team["team_name"]: team["user_id"] for team in teams}
+    folded = {team["team_name"].lower(): team["user_id"] for team in teams}
+    names_given = [name.strip() for name in (order or "").split(",") if name.strip()]
+    unknown = [name for name in names_given if name not in exact and name.lower() not in folded]
+    if unknown:
+        await interaction.response.send_message(f'No team called {", ".join(unknown)}!', ephemeral=True)
+        return
+
+    user_ids = list(dict.fromkeys(exact[name] if name in exact else folded[name.lower()] for name in names_given))
+    rest = [team["user_id"] for team in teams if team["user_id"] not in user_ids]
+    random.shuffle(rest)
+
+    result = await league.start_draft(user_ids + rest, rounds, pick_seconds, snake, interaction.channel_id)
+    if result == ReturnCodes.DRAFT_IN_PROGRESS:
+        await interaction.response.send_message("A draft is already running, cancel it with /admin cancel_draft first!", ephemeral=True)
+        return
+    elif result == ReturnCodes.NO_TEAM:
+        await interaction.response.send_message("There are no teams to draft!", ephemeral=True)
+        return
+    elif result == ReturnCodes.CONFLICT:
+        await interaction.response.send_message(CONFLICT_MESSAGE, ephemeral=True)
+        return
+
+    schedule_draft(interaction.guild_id, league)
+
+    msg = f'## The draft is on!\n{rounds} rounds, {pick_seconds} seconds per pick. Order:\n'
+    msg += "".join(f'{i}. {team_label(league, user_id)}\n' for i, user_id in enumerate(result.order, start=1))
+    msg += draft_update(league, [])
+    await interaction.response.send_message(msg)
+    logging.info(f'{interaction.user.id} started a draft in guild {interaction.guild_id}')
+
+@start_draft.on_autocomplete("order")
+@metrics.timed("autocomplete_seconds", command="admin draft", option="order")
+async def start_draft_autocomplete(interaction: nextcord.Interaction, order: str):
+    league = await get_league(interaction)
+    await interaction.response.send_autocomplete(complete_players(order, lambda query: list(league.search_teams(query))))
+
+@admin_cmd.subcommand(name="cancel_draft", description="Stop the running draft, picks made so far stay")
+@metrics.timed("command_seconds", command="admin cancel_draft")
+async def cancel_draft(interaction: nextcord.Interaction):
+    league = await get_league(interaction)
+    result = await league.cancel_draft()
+    if result == ReturnCodes.NO_DRAFT:
+        await interaction.response.send_message("There is no draft going on!", ephemeral=True)
+        return
+    elif result == ReturnCodes.CONFLICT:
+        await interaction.response.send_message(CONFLICT_MESSAGE, ephemeral=True)
+        return
+
+    schedule_draft(interaction.guild_id, league)
+    await interaction.response.send_message("The draft was cancelled!")
+
+@bot.slash_command(guild_ids=GUILD_IDS, dm_permission=False, description="Take part in the draft", name="draft")
+async def draft_cmd(interaction: nextcord.Interaction):
+    pass
+
+@draft_cmd.subcommand(description="Pick a player while you're on the clock")
+@metrics.timed("command_seconds", command="draft pick")
+async def pick(interaction: nextcord.Interaction, player: str = nextcord.SlashOption(required=True, description="The player you want")):
+    league = await get_league(interaction)
+    player = player.upper()
+    if not league.is_character(player):
+        await unknown_player(interaction, league, player)
+        return
+
+    result = await league.draft_pick(interaction.user.id, player)
+    if result == ReturnCodes.NO_DRAFT:
+        await interaction.response.send_message("There is no draft going on!", ephemeral=True)
+    elif result == ReturnCodes.NOT_YOUR_PICK:
+        await interaction.response.send_message(f'It\'s not your pick, <@{draft.running_draft(league).on_the_clock}> is on the clock!', ephemeral=True)
+    elif result == ReturnCodes.NO_TEAM:
+        await interaction.response.send_message("You don't have a team!", ephemeral=True)
+    elif result == ReturnCodes.NOT_FREE_AGENT:
+        await interaction.response.send_message("Player is not a free agent!", ephemeral=True)
+    elif result == ReturnCodes.CONFLICT:
+        await interaction.response.send_message(CONFLICT_MESSAGE, ephemeral=True)
+    else:
+        schedule_draft(interaction.guild_id, league)
+        await interaction.response.send_message(draft_update(league, result))
+
+@pick.on_autocomplete("player")
+@metrics.timed("autocomplete_seconds", command="draft pick", option="player")
+async def pick_autocomplete(interaction: nextcord.Interaction, player: str):
+    league = await get_league(interaction)
+    await interaction.response.send_autocomplete(league.search_free_agents(player))
+
+@draft_cmd.subcommand(description="Line up players to be picked for you when it's your turn")
+@metrics.timed("command_seconds", command="draft queue")
+async def queue(interaction: nextcord.Interaction, players: str = nextcord.SlashOption(required=False, default=None, description="Comma separated, best first. Leave empty to clear your queue")):
+    league = await get_league(interaction)
+    players = parse_players(players)
+    for player in players:
+        if not league.is_character(player):
+            await unknown_player(interaction, league, player)
+            return
+
+    result = await league.draft_queue(interaction.user.id, players)
+    if result == ReturnCodes.NO_DRAFT:
+        await interaction.response.send_message("There is no draft going on!", ephemeral=True)
+        return
+    elif result == ReturnCodes.NO_TEAM:
+        await interaction.response.send_message("Your team isn't in the draft!", ephemeral=True)
+        return
+    elif result == ReturnCodes.CONFLICT:
+        await interaction.response.send_message(CONFLICT_MESSAGE, ephemeral=True)
+        return
+
+    if result:
+        # it was your turn, announced where the draft is
+        schedule_draft(interaction.guild_id, league)
+        discord_calls.send_message(draft.get_draft(league).channel_id, draft_update(league, result))
+
+    await interaction.response.send_message(f'Your queue: {format_players(players)}' if players else "Your queue is empty!", ephemeral=True)
+
+@queue.on_autocomplete("players")
+@metrics.timed("autocomplete_seconds", command="draft queue", option="players")
+async def queue_autocomplete(interaction: nextcord.Interaction, players: str):
+    league = await get_league(interaction)
+    await interaction.response.send_autocomplete(complete_players(players, league.search_free_agents))
+
+@draft_cmd.subcommand(description="See who is on the clock and your queue")
+@metrics.timed("command_seconds", command="draft status")
+async def status(interaction: nextcord.Interaction):
+    league = await get_league(interaction)
+    running = draft.running_draft(league)
+    if running is None:
+        await interaction.response.send_message("There is no draft going on!", ephemeral=True)
+        return
+
+    msg = f'## Draft\nPick {running.pick + 1} of {running.total_picks}, <@{running.on_the_clock}> is on the clock until <t:{int(running.deadline)}:T>\n'
+    if interaction.user.id in running.order:
+        upcoming = [number for number in range(running.pick, running.total_picks) if running.picker(number) == interaction.user.id]
+        if upcoming and upcoming[0] == running.pick:
+            msg += "You're on the clock!\n"
+        elif upcoming:
+            msg += f'Your next pick is {upcoming[0] + 1}, {upcoming[0] - running.pick} picks from now\n'
+
+        queued = [player for player in running.queues.get(interaction.user.id, []) if league.is_free_agent(player)]
+        msg += f'Your queue: {format_players(queued)}' if queued else "Your queue is empty, you get the best free agent if time runs out"
+
+    await interaction.response.send_message(msg, ephemeral=True)
+
+@draft_cmd.subcommand(description="View every pick so far")
+@metrics.timed("command_seconds", command="draft board")
+async def board(interaction: nextcord.Interaction):
+    await send_listing(interaction, pages.DraftBoard())
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    #set logging level of nextcord
+    logging.getLogger('nextcord').setLevel(logging.ERROR)
+
+    metrics.serve()
+    bot.run(os.getenv("BOT_TOKEN"))
+
+    if discord_calls.pending:
+        logging.warning(f'{len(discord_calls.pending)} embed updates were not sent before shutdown')
+
+    # write final snapshots so the next start doesn't need to replay the journals
+    draft_clock.close()
+    leagues.close()
+    bus.close()
+    metrics.dump()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Minimal Prometheus style metrics. Everything is a no-op unless METRICS_PORT
+(serve /metrics on localhost) or METRICS_FILE (dump to a file) is set, and
+timed() doesn't even wrap the function when metrics are disabled.
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PORT = int(os.getenv("METRICS_PORT") or 0) or None
+FILE = os.getenv("METRICS_FILE") or None
+ENABLED = bool(PORT or FILE)
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+lock = threading.Lock()
+counters = {}    # (name, labels) -> value
+histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+help_texts = {}
+
+
+def describe(name: str, text: str):
+    help_texts[name] = text
+
+
+def labels_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    if not ENABLED:
+        return
+
+    key = (name, labels_key(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def observe(name: str, value: float, **labels):
+    if not ENABLED:
+        return
+
+    key = (name, labels_key(labels))
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(BUCKETS) + 2)
+
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def cache_lookup(cache: str, hit: bool):
+    inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def timed(name: str, **labels):
+    """Records the latency of an async function in the `name` histogram"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+class timer:
+    """Context manager version of timed() for synchronous code"""
+
+    def __init__(self, name: str, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter() if ENABLED else 0
+        return self
+
+    def __exit__(self, *exc):
+        if ENABLED:
+            observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+def format_labels(labels, extra: dict = None):
+    labels = list(labels) + list((extra or {}).items())
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def render():
+    lines = []
+    with lock:
+        names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+        for name in names:
+            if name in help_texts:
+                lines.append(f'# HELP {name} {help_texts[name]}')
+
+            if any(key[0] == name for key in counters):
+                lines.append(f'# TYPE {name} counter')
+                for (key_name, labels), value in sorted(counters.items()):
+                    if key_name == name:
+                        lines.append(f'{name}{format_labels(labels)} {value}')
+            else:
+                lines.append(f'# TYPE {name} histogram')
+                for (key_name, labels), histogram in sorted(histograms.items()):
+                    if key_name != name:
+                        continue
+
+                    for bound, count in zip(BUCKETS, histogram):
+                        lines.append(f'{name}_bucket{format_labels(labels, {"le": bound})} {count}')
+                    lines.append(f'{name}_bucket{format_labels(labels, {"le": "+Inf"})} {histogram[-1]}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram[-2]}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram[-1]}')
+
+    return "\n".join(lines) + "\n"
+
+
+def dump(path: str = None):
+    path = path or FILE
+    if not ENABLED or not path:
+        return
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = None):
+    port = port or PORT
+    if not ENABLED or not port:
+        return None
+
+    # only reachable from this machine
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f'Serving metrics on http://127.0.0.1:{port}/metrics')
+
+    return server
+
+
+describe("command_seconds", "Latency of slash and message commands")
+describe("autocomplete_seconds", "Latency of autocomplete handlers")
+describe("discord_requests_total", "Discord REST calls made by the bot outside of interaction responses")
+describe("storage_seconds", "Latency of league storage operations")
+describe("storage_reads_total", "League storage loads")
+describe("storage_writes_total", "League storage commits and snapshots")
+describe("storage_bytes_written_total", "Bytes written by league storage")
+describe("cache_requests_total", "Cache lookups by result")
@@ -0,0 +1,105 @@
+import logging
+import time
+from collections import OrderedDict
+
+import nextcord
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class NameCache:
+    """
+    Resolves owner display names per guild. Lookups go to the gateway member
+    cache first and only fall back to a REST fetch_user on a miss. Results are
+    kept in an LRU with a TTL and refreshed from member/user update events.
+    """
+
+    def __init__(self, bot: nextcord.Client, max_size: int = 4096, ttl: float = 3600):
+        self.bot = bot
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache = OrderedDict()  # (guild_id, user_id) -> (name, expires_at)
+
+    def put(self, guild_id: int, user_id: int, name: str):
+        key = (guild_id, user_id)
+        self.cache[key] = (name, time.monotonic() + self.ttl)
+        self.cache.move_to_end(key)
+
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def invalidate(self, guild_id: int, user_id: int):
+        self.cache.pop((guild_id, user_id), None)
+
+    def forget_guild(self, guild_id: int):
+        for key in [key for key in self.cache if key[0] == guild_id]:
+            del self.cache[key]
+
+    def lookup(self, guild_id: int, user_id: int):
+        key = (guild_id, user_id)
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+
+        name, expires_at = entry
+        if expires_at < time.monotonic():
+            del self.cache[key]
+            return None
+
+        self.cache.move_to_end(key)
+        return name
+
+    async def get(self, guild_id: int, user_id: int):
+        name = self.lookup(guild_id, user_id)
+        metrics.cache_lookup("names", name is not None)
+        if name is not None:
+            return name
+
+        # the gateway member cache is free, REST is the last resort
+        guild = self.bot.get_guild(guild_id)
+        member = guild.get_member(user_id) if guild else None
+
+        if member:
+            name = member_name(member)
+        else:
+            try:
+                metrics.inc("discord_requests_total", route="fetch_user")
+                name = (await self.bot.fetch_user(user_id)).name
+            except nextcord.errors.NotFound:
+                logger.warning(f'User {user_id} not found!')
+                return "Unknown Owner"
+
+        self.put(guild_id, user_id, name)
+        return name
+
+    def update_member(self, member: nextcord.Member):
+        # only names someone looked up, role changes of everyone else would
+        # push them out of the cache
+        if (member.guild.id, member.id) in self.cache:
+            self.put(member.guild.id, member.id, member_name(member))
+
+    def update_user(self, user: nextcord.User):
+        # usernames are only used when there is no nickname, so let the next
+        # lookup in each guild pick whichever applies
+        for key in [key for key in self.cache if key[1] == user.id]:
+            del self.cache[key]
+
+    async def warm(self, guild: nextcord.Guild, limit: int = None):
+        """Caches the names of up to `limit` members, the whole cache by default"""
+        if not guild.chunked:
+            await guild.chunk()
+
+        limit = self.max_size if limit is None else min(limit, self.max_size)
+        for member in guild.members[:limit]:
+            self.put(guild.id, member.id, member_name(member))
+
+        logger.info(f'Cached names for {min(len(guild.members), limit)} members of {guild.name}')
+
+
+def member_name(member: nextcord.Member):
+    if member.nick:
+        return member.nick
+
+    return member.name
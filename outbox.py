@@ -0,0 +1,282 @@
+"""
+Background queue for Discord calls that don't answer an interaction, like
+recolouring trade embeds or announcing draft picks. Commands enqueue and return right away while a
+few workers drain the queue:
+
+- higher priority jobs (a user just accepted a trade) go before lower ones
+  (embeds of trades expired by a roster change)
+- every route, e.g. edits in one channel, has its own token bucket so a busy
+  channel waits on its own without holding up the others
+- a queued edit of a message that is edited again is replaced by the newer
+  one instead of sending both
+- rate limited and failed calls are retried with exponential backoff, client
+  errors like a deleted message are dropped
+
+All calls go through a client with `edit_message(channel_id, message_id,
+embed)` and `send_message(channel_id, content)`, DiscordClient for the bot
+and any fake with the same methods for testing.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+import nextcord
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HIGH = 0
+LOW = 1
+
+# (calls, per seconds) for each kind of route, discord allows about 5
+# message edits per 5 seconds in a channel
+ROUTE_LIMITS = {
+    "edit_message": (5, 5.0),
+    "send_message": (5, 5.0),
+}
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f'rate limited, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class DiscordClient:
+    """Talks to discord's REST API directly, so editing doesn't need a fetch first"""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def edit_message(self, channel_id: int, message_id: int, embed):
+        await self.request(self.bot.http.edit_message(channel_id, message_id, embeds=[embed.to_dict()]))
+
+    async def send_message(self, channel_id: int, content: str):
+        await self.request(self.bot.http.send_message(channel_id, content))
+
+    async def request(self, call):
+        try:
+            await call
+        except nextcord.HTTPException as e:
+            # nextcord already waited out the rate limit a few times on its own
+            if e.status == 429:
+                raise RateLimited(float(e.response.headers.get("Retry-After", BASE_DELAY)))
+            raise
+
+
+class Bucket:
+    """Token bucket, `rate` calls per `per` seconds"""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def ready_at(self, now: float):
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+        wait = 0 if self.tokens >= 1 else (1 - self.tokens) * self.per / self.rate
+        return max(now + wait, self.blocked_until)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class Job:
+    def __init__(self, key, route, priority: int, call, args):
+        self.key = key
+        self.route = route
+        self.priority = priority
+        self.call = call
+        self.args = args
+        self.attempts = 0
+        self.not_before = 0
+        self.queued = time.monotonic()
+
+
+class Outbox:
+    def __init__(self, client, workers: int = 4, route_limits: dict = None, max_attempts: int = MAX_ATTEMPTS, base_delay: float = BASE_DELAY):
+        self.client = client
+        self.workers = workers
+        self.route_limits = ROUTE_LIMITS if route_limits is None else route_limits
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+
+        self.pending = {}  # key -> Job waiting to run
+        self.heap = []     # (priority, seq, key), entries of replaced jobs are skipped
+        self.seq = itertools.count()
+        self.buckets = {}  # route -> Bucket
+        self.running = set()  # keys of jobs in flight, a key runs one at a time
+        self.tasks = []
+
+        # created in start() so they belong to the loop that runs the workers
+        self.wakeup = None
+        self.idle = None
+
+    def __len__(self):
+        return len(self.pending) + len(self.running)
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        if not self.pending:
+            self.idle.set()
+
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+        if self.pending:
+            logger.warning(f'Dropped {len(self.pending)} queued discord calls on shutdown')
+
+    async def drain(self):
+        """Waits until everything queued so far is done"""
+        await self.idle.wait()
+
+    def edit_message(self, channel_id: int, message_id: int, embed, priority: int = LOW):
+        # only the latest edit of a message matters
+        key = ("edit_message", channel_id, message_id)
+        self.enqueue(Job(key, ("edit_message", channel_id), priority, self.client.edit_message, (channel_id, message_id, embed)))
+
+    def send_message(self, channel_id: int, content: str, priority: int = HIGH):
+        # every message is sent, there's nothing to coalesce
+        key = ("send_message", channel_id, next(self.seq))
+        self.enqueue(Job(key, ("send_message", channel_id), priority, self.client.send_message, (channel_id, content)))
+
+    def enqueue(self, job: Job):
+        queued = self.pending.get(job.key)
+        if queued is not None:
+            # keep the queued job's place in line, unless the new one is more urgent
+            metrics.inc("outbox_coalesced_total", route=job.route[0])
+            queued.args = job.args
+            if job.priority >= queued.priority:
+                return
+
+            queued.priority = job.priority
+            job = queued
+
+        self.pending[job.key] = job
+        heapq.heappush(self.heap, (job.priority, next(self.seq), job.key))
+        if self.wakeup:
+            self.idle.clear()
+            self.wakeup.set()
+
+    def bucket(self, route):
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            rate, per = self.route_limits.get(route[0], (50, 1.0))
+            bucket = self.buckets[route] = Bucket(rate, per)
+
+        return bucket
+
+    def next_job(self):
+        """The most urgent job whose route can go now, or how long until one can"""
+        skipped = []
+        job = None
+        wait = None
+        now = time.monotonic()
+
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            priority, _, key = entry
+            queued = self.pending.get(key)
+            if queued is None or queued.priority != priority:
+                continue
+
+            # an older version of this call is still running, it must land first
+            if key in self.running:
+                skipped.append(entry)
+                continue
+
+            ready_at = max(self.bucket(queued.route).ready_at(now), queued.not_before)
+            if ready_at <= now:
+                job = self.pending.pop(key)
+                break
+
+            skipped.append(entry)
+            wait = ready_at - now if wait is None else min(wait, ready_at - now)
+
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+
+        return job, wait
+
+    async def worker(self):
+        while True:
+            job, wait = self.next_job()
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.running.add(job.key)
+            try:
+                await self.run(job)
+            finally:
+                self.running.discard(job.key)
+                self.wakeup.set()
+                if not self.pending and not self.running:
+                    self.idle.set()
+
+    async def run(self, job: Job):
+        bucket = self.bucket(job.route)
+        bucket.take()
+        job.attempts += 1
+        metrics.inc("discord_requests_total", route=job.route[0])
+
+        try:
+            await job.call(*job.args)
+        except RateLimited as e:
+            bucket.block(e.retry_after)
+            self.retry(job, e.retry_after, e)
+        except Exception as e:
+            status = getattr(e, "status", None)
+            if status is not None and 400 <= status < 500:
+                # deleted message, missing permissions, retrying won't help
+                logger.warning(f'Dropping {job.route[0]} {job.args[:2]}: {e!r}')
+                metrics.inc("outbox_dropped_total", route=job.route[0])
+                return
+
+            self.retry(job, min(MAX_DELAY, self.base_delay * 2 ** (job.attempts - 1)), e)
+        else:
+            metrics.observe("outbox_delay_seconds", time.monotonic() - job.queued, route=job.route[0])
+
+    def retry(self, job: Job, delay: float, error: Exception):
+        if job.attempts >= self.max_attempts:
+            logger.warning(f'Giving up on {job.route[0]} {job.args[:2]} after {job.attempts} attempts: {error!r}')
+            metrics.inc("outbox_dropped_total", route=job.route[0])
+            return
+
+        # a newer version of the same call may have been queued meanwhile
+        if job.key in self.pending:
+            return
+
+        metrics.inc("outbox_retries_total", route=job.route[0])
+        job.not_before = time.monotonic() + delay
+        self.enqueue(job)
+
+
+metrics.describe("outbox_coalesced_total", "Queued discord calls replaced by a newer one")
+metrics.describe("outbox_retries_total", "Discord calls retried after a rate limit or error")
+metrics.describe("outbox_dropped_total", "Discord calls given up on")
+metrics.describe("outbox_delay_seconds", "Time from queueing a discord call until it succeeded")
@@ -0,0 +1,382 @@
+"""
+Paginated listings (rosters, free agents, teams, trades, draft picks and
+history) sent as embeds with previous/next buttons.
+
+Only the page someone looks at is rendered, and rendered pages are cached
+per league under the league's version, which every change bumps. Looking at
+a page again before anything changed is a dictionary lookup, after a change
+the page is rendered again the next time it's looked at.
+"""
+import weakref
+from collections import OrderedDict
+
+import nextcord
+
+import draft
+import ledger
+import metrics
+from cluster import LeagueBusy
+from fanout import fan_out
+from league import ReturnCodes, Trade
+
+# rendered pages kept per league, least recently viewed go first
+MAX_CACHED_PAGES = 128
+
+# buttons stop working after this long without a click
+VIEW_TIMEOUT = 300
+
+COLOR = nextcord.Color.blue()
+
+# another process holds the league and didn't hand it over in time
+BUSY_MESSAGE = "This league is busy right now, try again in a moment!"
+
+
+def team_label(league, user_id: int):
+    team = league.get_team(user_id)
+    return team["team_name"] if team else f'<@{user_id}>'
+
+
+def format_players(players):
+    return ", ".join(player.title() for player in players)
+
+
+def trade_text(league, sides, moves):
+    # "A's Mario for B's Luigi, Peach" between two teams, who gets whom with more
+    if len(sides) == 2:
+        return " for ".join(f'{team_label(league, user_id)}\'s {format_players(players)}' for user_id, players in sides)
+
+    return "; ".join(f'{team_label(league, user_id)} gets {format_players([player for player, _, to_id in moves if to_id == user_id])}' for user_id, _ in sides)
+
+
+def pick_text(league, number: int, teams: int, user_id: int, player: str, how: str):
+    # "3.2" is the second pick of the third round
+    round_number, slot = divmod(number, teams)
+    text = f'**{round_number + 1}.{slot + 1}** {team_label(league, user_id)}'
+    if how == draft.SKIPPED:
+        return f'{text} was skipped'
+
+    text += f' takes {player.title()}'
+    if how in (draft.QUEUED, draft.AUTO):
+        text += f' ({how})'
+
+    return text
+
+
+def describe_event(league, event: dict):
+    kind = event["type"]
+    when = f'<t:{int(event["time"])}:R>'
+
+    if "trade_id" in event:
+        sides = ledger.trade_sides(event)
+        proposer = team_label(league, sides[0][0])
+        trade = trade_text(league, sides, ledger.trade_moves(event))
+
+        if kind == ledger.DENY:
+            # only denials say who did it, any team but the proposer can
+            text = f'{team_label(league, event["user_id"])} denied {proposer}\'s offer of {trade}'
+        else:
+            text = {
+                ledger.PROPOSE: f'{proposer} offered {trade}',
+                ledger.ACCEPT: f'Traded {trade}',
+                ledger.CANCEL: f'{proposer} withdrew their offer of {trade}',
+                ledger.EXPIRE: f'{proposer}\'s offer of {trade} expired',
+            }[kind]
+    elif kind == ledger.CREATE:
+        text = f'{event["team_name"]} was created'
+    elif kind == ledger.DELETE:
+        text = f'{event["team_name"]} was deleted'
+    elif kind == ledger.ADD:
+        text = f'{team_label(league, event["user_id"])} added {event["player"].title()}'
+    elif kind == ledger.DROP:
+        text = f'{team_label(league, event["user_id"])} dropped {event["player"].title()}'
+    else:
+        text = f'An admin imported {len(event["teams"])} teams'
+
+    return f'{text} {when}'
+
+
+class Page:
+    def __init__(self, embed: nextcord.Embed, number: int, pages: int):
+        self.embed = embed
+        self.number = number
+        self.pages = pages
+
+
+class Listing:
+    """
+    A list of items in a league shown `page_size` at a time. Getting the
+    items has to be cheap, rendering them into lines is only done for the
+    items on the page being shown.
+    """
+    page_size = 20
+    empty = "Nothing here yet!"
+
+    # rendering awaits something slow, like resolving names, so the command
+    # defers before rendering a page that isn't cached
+    slow = False
+
+    def key(self):
+        return (type(self).__name__,)
+
+    def title(self, league):
+        raise NotImplementedError
+
+    def items(self, league):
+        raise NotImplementedError
+
+    async def render(self, league, items):
+        raise NotImplementedError
+
+    async def page(self, league, number: int):
+        items = self.items(league)
+        pages = max(1, -(-len(items) // self.page_size))
+        number = min(max(number, 0), pages - 1)
+
+        visible = items[number * self.page_size:(number + 1) * self.page_size]
+        lines = await self.render(league, visible) if visible else [self.empty]
+
+        embed = nextcord.Embed(title=self.title(league), description="\n".join(lines), color=COLOR)
+        if pages > 1:
+            embed.set_footer(text=f'Page {number + 1}/{pages}')
+
+        return Page(embed, number, pages)
+
+
+class Roster(Listing):
+    empty = "No Players Yet!"
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+
+    def key(self):
+        return ("roster", self.user_id)
+
+    def title(self, league):
+        return team_label(league, self.user_id)
+
+    def items(self, league):
+        team = league.get_team(self.user_id)
+        return team["players"] if team else []
+
+    async def render(self, league, items):
+        return [f'- {player.title()}' for player in items]
+
+
+class FreeAgents(Listing):
+    empty = "No free agents yet!"
+
+    def title(self, league):
+        return "Free Agents"
+
+    def items(self, league):
+        return league.get_free_agents()
+
+    async def render(self, league, items):
+        return [f'- {player.title()}' for player in items]
+
+
+class Teams(Listing):
+    empty = "No teams yet!"
+    slow = True
+
+    def __init__(self, get_name):
+        # get_name(user_id) -> display name of an owner
+        self.get_name = get_name
+
+    def title(self, league):
+        return "Teams"
+
+    def items(self, league):
+        return league.get_teams()
+
+    async def render(self, league, items):
+        # names aren't part of the league, a renamed owner shows up after the next change
+        owners = await fan_out(self.get_name, [team["user_id"] for team in items])
+        lines = []
+        for team, owner in zip(items, owners):
+            if isinstance(owner, Exception):
+                owner = "Unknown Owner"
+
+            lines.append(f'- {team["team_name"]} - (Owner: {owner})')
+
+        return lines
+
+
+class Trades(Listing):
+    page_size = 10
+    empty = "No trades yet!"
+
+    def title(self, league):
+        return "Pending Trades"
+
+    def items(self, league):
+        # ids only, the trades themselves are read for the page being shown
+        return list(league.trades.trades)
+
+    async def render(self, league, items):
+        trades = [Trade.from_dict(league.trades.get(trade_id), trade_id) for trade_id in items]
+
+        # checked together, trades that just became invalid are expired soon after
+        lines = []
+        for trade, result in zip(trades, league.validate_trades(trades)):
+            line = f'- {team_label(league, trade.proposer)} wants to trade {trade_text(league, trade.to_dict()["sides"], trade.moves())}'
+            if result != ReturnCodes.SUCCESS:
+                line += " (no longer valid)"
+            lines.append(line)
+
+            if trade.message_id is not None and trade.channel_id is not None:
+                lines.append(f'  - [View Trade](https://discord.com/channels/{league.guild_id}/{trade.channel_id}/{trade.message_id})')
+
+        return lines
+
+
+class DraftBoard(Listing):
+    empty = "No picks yet!"
+
+    def title(self, league):
+        return "Draft"
+
+    def items(self, league):
+        picks = league.draft["picks"] if league.draft else []
+        return list(enumerate(picks))
+
+    async def render(self, league, items):
+        teams = len(league.draft["order"])
+        return [pick_text(league, number, teams, *pick) for number, pick in items]
+
+
+class History(Listing):
+    # lines about trades get as long as those of Trades
+    page_size = 10
+    empty = "Nothing has happened yet!"
+
+    def __init__(self, user_id: int = None):
+        # None for the whole league
+        self.user_id = user_id
+
+    def key(self):
+        return ("history", self.user_id)
+
+    def title(self, league):
+        return "History" if self.user_id is None else f'History of {team_label(league, self.user_id)}'
+
+    def items(self, league):
+        return league.stats.history(self.user_id)
+
+    async def render(self, league, items):
+        return [f'- {describe_event(league, event)}' for event in items]
+
+
+class PageCache:
+    """Rendered pages per league, each good for as long as the league's version doesn't change"""
+
+    def __init__(self, max_pages: int = MAX_CACHED_PAGES):
+        self.max_pages = max_pages
+
+        # league -> OrderedDict of (listing key, page number) -> (version, Page),
+        # a reloaded league is a new object and starts over
+        self.leagues = weakref.WeakKeyDictionary()
+
+    def get(self, league, listing: Listing, number: int):
+        pages = self.leagues.get(league)
+        key = (listing.key(), number)
+        entry = pages.get(key) if pages is not None else None
+
+        hit = entry is not None and entry[0] == league.version
+        metrics.cache_lookup("pages", hit)
+        if not hit:
+            return None
+
+        pages.move_to_end(key)
+        return entry[1]
+
+    async def page(self, league, listing: Listing, number: int):
+        page = self.get(league, listing, number)
+        if page is None:
+            page = await self.render(league, listing, number)
+
+        return page
+
+    async def render(self, league, listing: Listing, number: int):
+        version = league.version
+        with metrics.timer("page_render_seconds", listing=listing.key()[0]):
+            page = await listing.page(league, number)
+
+        # the league may have changed while the page was rendered
+        if league.version == version:
+            pages = self.leagues.setdefault(league, OrderedDict())
+            key = (listing.key(), number)
+            pages[key] = (version, page)
+            pages.move_to_end(key)
+            while len(pages) > self.max_pages:
+                pages.popitem(last=False)
+
+        return page
+
+
+class PageView(nextcord.ui.View):
+    """Previous/next buttons under a listing, each click shows just the new page"""
+
+    def __init__(self, cache: PageCache, listing: Listing, get_league, page: Page):
+        super().__init__(timeout=VIEW_TIMEOUT)
+        self.cache = cache
+        self.listing = listing
+        # looked up on every click, the league may have been reloaded since
+        self.get_league = get_league
+        self.number = 0
+        self.update(page)
+
+    def update(self, page: Page):
+        self.number = page.number
+        self.previous.disabled = page.number <= 0
+        self.next.disabled = page.number >= page.pages - 1
+
+    @nextcord.ui.button(label="Previous", style=nextcord.ButtonStyle.secondary)
+    async def previous(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        await self.show(interaction, self.number - 1)
+
+    @nextcord.ui.button(label="Next", style=nextcord.ButtonStyle.secondary)
+    async def next(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        await self.show(interaction, self.number + 1)
+
+    async def show(self, interaction: nextcord.Interaction, number: int):
+        page = await self.cache.page(await self.get_league(), self.listing, number)
+        self.update(page)
+        await interaction.response.edit_message(embed=page.embed, view=self)
+
+    async def on_error(self, error: Exception, item: nextcord.ui.Item, interaction: nextcord.Interaction):
+        if isinstance(error, LeagueBusy):
+            await answer_busy(interaction)
+        else:
+            await super().on_error(error, item, interaction)
+
+
+async def answer_busy(interaction: nextcord.Interaction):
+    if interaction.response.is_done():
+        await interaction.followup.send(BUSY_MESSAGE, ephemeral=True)
+    else:
+        await interaction.response.send_message(BUSY_MESSAGE, ephemeral=True)
+
+
+async def send(interaction: nextcord.Interaction, cache: PageCache, listing: Listing, league, get_league):
+    """Answers an interaction with the first page of a listing, with buttons if there are more"""
+    page = cache.get(league, listing, 0)
+    deferred = page is None and listing.slow
+    if deferred:
+        # rendering can take longer than discord's 3 second window
+        await interaction.response.defer(ephemeral=True)
+
+    if page is None:
+        page = await cache.render(league, listing, 0)
+
+    kwargs = {"embed": page.embed, "ephemeral": True}
+    if page.pages > 1:
+        kwargs["view"] = PageView(cache, listing, get_league, page)
+
+    if deferred:
+        await interaction.followup.send(**kwargs)
+    else:
+        await interaction.response.send_message(**kwargs)
+
+
+metrics.describe("page_render_seconds", "Time to render a page of a listing that wasn't cached")
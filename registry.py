@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from cluster import LeagueBusy, lock_league, lock_league_async, lock_path
+from league import League
+
+logger = logging.getLogger(__name__)
+
+# a league fetched this recently may still be used by a command that hasn't
+# locked anything yet, so it isn't evicted to make room for another
+IN_USE_GRACE = 30
+
+
+class LeagueRegistry:
+    """
+    One League per guild, loaded on first use from data/<guild_id>/. Leagues
+    that have been idle for `idle_timeout` seconds, or the least recently
+    used ones past `max_active`, are flushed and dropped from memory. Leagues
+    still in use by a command are kept, even past `max_active`, until they
+    aren't. A league whose write failed is dropped and loaded again from
+    disk the next time it's asked for.
+
+    With a cluster.Bus the registry shares data_dir with other processes,
+    every loaded league is locked and other processes holding it are asked
+    to release it first.
+    """
+
+    def __init__(self, data_dir: str = "data", max_active: int = 32, idle_timeout: float = 3600, legacy_guild_id: int = None, on_load=None, backend: str = "tinydb", write_behind: bool = False, wrap=None, bus=None, on_evict=None):
+        self.data_dir = data_dir
+        # "tinydb" or "sqlite"
+        self.backend = backend
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+        # the guild whose league predates multi guild support and lives directly in data_dir
+        self.legacy_guild_id = legacy_guild_id
+        # called with (guild_id, league) whenever a league is loaded
+        self.on_load = on_load
+        # called with guild_id whenever a league is dropped from memory
+        self.on_evict = on_evict
+        # commit on a writer thread instead of the caller's
+        self.write_behind = write_behind
+        # applied to every loaded League, e.g. AsyncLeague
+        self.wrap = wrap
+        self.bus = bus
+
+        self.leagues = OrderedDict()  # guild_id -> League, least recently used first
+        self.last_used = {}           # guild_id -> monotonic time
+        self.locks = {}               # guild_id -> cluster.FileLock held while loaded
+        self.loading = {}             # guild_id -> task loading it for get_async
+        self.pinned = set()           # guild_ids kept loaded however idle, e.g. with a draft running
+
+    def __contains__(self, guild_id: int):
+        return guild_id in self.leagues
+
+    def __len__(self):
+        return len(self.leagues)
+
+    def paths(self, guild_id: int):
+        if guild_id == self.legacy_guild_id:
+            directory = self.data_dir
+        else:
+            directory = os.path.join(self.data_dir, str(guild_id))
+
+        if self.backend == "sqlite":
+            return os.path.join(directory, "league.db"), None
+
+        return os.path.join(directory, "league.json"), os.path.join(directory, "trades.json")
+
+    def get(self, guild_id: int):
+        if guild_id is None:
+            raise ValueError("Leagues only exist inside a guild")
+
+        if self.failed(guild_id):
+            # start over from what made it to disk
+            self.evict(guild_id)
+
+        league = self.leagues.get(guild_id)
+        if league is None:
+            league = self.load(guild_id)
+        else:
+            self.leagues.move_to_end(guild_id)
+
+        self.last_used[guild_id] = time.monotonic()
+        return league
+
+    async def get_async(self, guild_id: int, timeout: float = None):
+        """
+        get() for the event loop. Neither reading the league from disk nor
+        waiting for another process to release it blocks the loop. Gives up
+        with LeagueBusy after `timeout` seconds while the load itself carries
+        on for the next try.
+        """
+        if guild_id is None:
+            raise ValueError("Leagues only exist inside a guild")
+
+        if self.failed(guild_id):
+            await self.evict_async(guild_id)
+
+        if guild_id not in self.leagues:
+            # shared by every command asking for the league while it loads
+            loading = self.loading.get(guild_id)
+            if loading is None:
+                loading = self.loading[guild_id] = asyncio.ensure_future(self.load_async(guild_id))
+                loading.add_done_callback(self.loaded)
+
+            try:
+                await asyncio.wait_for(asyncio.shield(loading), timeout)
+            except asyncio.TimeoutError:
+                raise LeagueBusy(self.paths(guild_id)[0]) from None
+
+        return self.get(guild_id)
+
+    async def load_async(self, guild_id: int):
+        try:
+            lock = await lock_league_async(self.paths(guild_id)[0], self.bus) if self.bus else None
+            # snapshots, journal replay and repairs are disk work, the loop keeps serving meanwhile
+            league = await asyncio.get_running_loop().run_in_executor(None, self.read, guild_id, lock)
+            league = self.register(guild_id, league, lock)
+        finally:
+            del self.loading[guild_id]
+
+        for candidate in self.excess(guild_id):
+            # may have been used or evicted while an earlier one was closed
+            if candidate in self.leagues and not self.in_use(candidate):
+                await self.evict_async(candidate)
+
+        return league
+
+    def loaded(self, task):
+        # everyone waiting may have given up already, so failures are logged here
+        if not task.cancelled() and task.exception():
+            logger.warning(f'Loading a league failed: {task.exception()!r}')
+
+    def in_use(self, guild_id: int):
+        if guild_id in self.pinned:
+            return True
+
+        # AsyncLeague holds locks for commands halfway through a change
+        league = self.leagues.get(guild_id)
+        if league is not None and getattr(league, "busy", False):
+            return True
+
+        return time.monotonic() - self.last_used.get(guild_id, 0) < IN_USE_GRACE
+
+    def find(self, path: str):
+        """The loaded guild whose league has the lock file `path`, if any"""
+        for guild_id in self.leagues:
+            if lock_path(self.paths(guild_id)[0]) == path:
+                return guild_id
+
+        return None
+
+    def load(self, guild_id: int, lock=None):
+        league = self.open(guild_id, lock)
+        for candidate in self.excess(guild_id):
+            self.evict(candidate)
+
+        return league
+
+    def open(self, guild_id: int, lock=None):
+        if lock is None and self.bus:
+            lock = lock_league(self.paths(guild_id)[0], self.bus)
+
+        return self.register(guild_id, self.read(guild_id, lock), lock)
+
+    def read(self, guild_id: int, lock=None):
+        """Reads a league from disk, touches nothing else so it can run on any thread"""
+        teams_db, trades_db = self.paths(guild_id)
+        try:
+            return League(teams_db, trades_db, guild_id=guild_id, write_behind=self.write_behind)
+        except BaseException:
+            if lock:
+                lock.release()
+            raise
+
+    def register(self, guild_id: int, league: League, lock=None):
+        if lock:
+            self.locks[guild_id] = lock
+        if self.wrap:
+            league = self.wrap(league)
+
+        self.leagues[guild_id] = league
+        self.last_used[guild_id] = time.monotonic()
+        logger.info(f'Loaded league for guild {guild_id} ({len(self.leagues)} active)')
+
+        if self.on_load:
+            self.on_load(guild_id, league)
+
+        return league
+
+    def excess(self, guild_id: int):
+        """Leagues to evict to get back to max_active after loading guild_id, least recently used first"""
+        # skipping leagues a command may still hold
+        candidates = [candidate for candidate in self.leagues if candidate != guild_id and not self.in_use(candidate)]
+        return candidates[:max(0, len(self.leagues) - self.max_active)]
+
+    def failed(self, guild_id: int):
+        # AsyncLeague saw a write fail, memory has changes the disk doesn't
+        league = self.leagues.get(guild_id)
+        return league is not None and getattr(league, "failed", False)
+
+    def unload(self, guild_id: int):
+        """Drops a league from memory, returns it and its lock for close_league"""
+        league = self.leagues.pop(guild_id, None)
+        self.last_used.pop(guild_id, None)
+        self.pinned.discard(guild_id)
+
+        if league and self.on_evict:
+            self.on_evict(guild_id)
+
+        return league, self.locks.pop(guild_id, None)
+
+    def close_league(self, guild_id: int, league, lock):
+        try:
+            if league:
+                league.close()
+                logger.info(f'Evicted league for guild {guild_id}')
+        finally:
+            # only once everything is flushed can another process take over
+            if lock:
+                lock.release()
+
+    def evict(self, guild_id: int):
+        self.close_league(guild_id, *self.unload(guild_id))
+
+    async def evict_async(self, guild_id: int):
+        """evict() for the event loop, the league is flushed and closed on another thread"""
+        # gone from the registry right away, a command asking for it again waits for the lock
+        league, lock = self.unload(guild_id)
+        await asyncio.get_running_loop().run_in_executor(None, self.close_league, guild_id, league, lock)
+
+    async def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for guild_id in [guild_id for guild_id, used in self.last_used.items() if used < cutoff]:
+            if guild_id in self.leagues and not self.in_use(guild_id):
+                await self.evict_async(guild_id)
+
+    def close(self):
+        for guild_id in list(self.leagues):
+            self.evict(guild_id)
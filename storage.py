@@ -0,0 +1,736 @@
+import json
+import logging
+import marshal
+import mmap
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from concurrent.futures import Future
+from functools import partial
+
+import tinydb
+from tinydb.table import Document
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Storage:
+    """
+    Persistence for a League. The league keeps everything in memory, a
+    storage only has to load the documents once and then persist each
+    logical operation atomically.
+    """
+
+    def load(self):
+        """Returns (teams, trades) as {user_id: team} and {trade_id: trade}"""
+        raise NotImplementedError
+
+    def commit(self, teams: dict = None, trades: dict = None, events: list = None, draft: dict = None):
+        """
+        Atomically persist one operation. `teams` maps user_id and `trades`
+        maps trade_id to the new document, or None if it was removed.
+        `events` are appended to the league's ledger as part of it, and
+        `draft` replaces the league's draft state if given.
+        """
+        raise NotImplementedError
+
+    def load_draft(self):
+        """The league's draft state, None if it never had a draft"""
+        raise NotImplementedError
+
+    def read_events(self, after: int = 0):
+        """Every ledger event with an id above `after`, oldest first"""
+        raise NotImplementedError
+
+    def load_stats(self):
+        """(last stats snapshot or None, the events recorded after it)"""
+        raise NotImplementedError
+
+    def save_stats(self, stats: dict):
+        """Persist a snapshot of the league statistics, stats["last_event"] says how far it goes"""
+        raise NotImplementedError
+
+    def barrier(self):
+        """Future that resolves once every commit so far is durable"""
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def close(self):
+        pass
+
+
+def open_storage(teams_path: str, trades_path: str = None, write_behind: bool = False):
+    # a .db file holds the whole league in sqlite, anything else is tinydb json
+    if teams_path.endswith(".db"):
+        storage = SQLiteStorage(teams_path)
+    else:
+        storage = TinyDBStorage(teams_path, trades_path)
+
+    if write_behind:
+        return WriteBehindStorage(storage)
+
+    return storage
+
+
+class WriteBehindStorage(Storage):
+    """
+    Runs another storage's commits on a dedicated writer thread, in order, so
+    the caller never blocks on disk I/O. commit() returns a future and
+    barrier() waits for everything committed so far.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.queue = queue.Queue()
+        self.thread = None
+        self.last = super().barrier()
+        self.closed = False
+        # the first write that failed, everything after it fails too
+        self.error = None
+
+    def load(self):
+        result = self.storage.load()
+
+        self.thread = threading.Thread(target=self.run, name="league-writer", daemon=True)
+        self.thread.start()
+
+        return result
+
+    def commit(self, teams: dict = None, trades: dict = None, events: list = None, draft: dict = None):
+        # copy now, the league keeps changing its documents after we return
+        teams = {k: copy_doc(v) for k, v in teams.items()} if teams else None
+        trades = {k: copy_doc(v) for k, v in trades.items()} if trades else None
+
+        # draft states are replaced rather than changed, no copy needed
+        return self.submit(partial(self.storage.commit, teams=teams, trades=trades, events=events, draft=draft))
+
+    def read_events(self, after: int = 0):
+        self.barrier().result()
+        return self.storage.read_events(after)
+
+    def load_stats(self):
+        return self.storage.load_stats()
+
+    def load_draft(self):
+        return self.storage.load_draft()
+
+    def save_stats(self, stats: dict):
+        return self.submit(partial(self.storage.save_stats, stats))
+
+    def submit(self, write):
+        # nothing would ever run it, and whoever waits on the future would hang
+        if self.closed:
+            raise RuntimeError("League storage is closed")
+
+        future = Future()
+        self.queue.put((write, future))
+        self.last = future
+
+        return future
+
+    def barrier(self):
+        return self.last
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            write, future = item
+            if self.error is not None:
+                # later records build on the one that's missing, and the
+                # last future has to fail for barrier() to report it
+                future.set_exception(self.error)
+                continue
+
+            try:
+                write()
+                future.set_result(None)
+            except Exception as e:
+                logger.exception("League write failed")
+                self.error = e
+                future.set_exception(e)
+
+    def close(self):
+        # let the writer finish everything queued before closing the storage
+        self.closed = True
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+        self.storage.close()
+
+
+class TinyDBStorage(Storage):
+    """
+    Every logical operation is appended to a journal as a single fsync'd
+    record holding the full documents it touched (None for a removal), so
+    replaying records is idempotent. The journal is compacted into TinyDB
+    snapshot files in the background, along with a binary copy of them
+    that loads much faster on the next start.
+
+    Ledger events ride along in the journal records and are moved to the
+    append-only .ledger file when the journal is compacted. Stats snapshots
+    remember how far into the ledger they go, so loading only reads the
+    events after them. The draft state rides along the same way and is
+    written to .draft on compaction.
+    """
+
+    def __init__(self, teams_path: str, trades_path: str, compact_every: int = 200):
+        self.teams_path = teams_path
+        self.trades_path = trades_path
+        self.journal_path = teams_path + ".journal"
+        self.binary_path = binary_snapshot_path(teams_path)
+        self.ledger_path = teams_path + ".ledger"
+        self.stats_path = teams_path + ".stats"
+        self.draft_path = teams_path + ".draft"
+        self.compact_every = compact_every
+
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.pending = 0
+        self.compactor = None
+        self.journal = None
+        # whether the binary snapshot matches the json ones
+        self.binary_current = False
+
+        # mirror of the persisted documents, used to write snapshots
+        self.teams = {}
+        self.trades = {}
+        self.draft = None
+
+        self.unledgered = []  # (seq, event) still only in the journal
+        self.ledger_last = 0  # id of the last event in the ledger file
+        self.stats = None
+        self.loaded_events = []
+
+    def load(self):
+        for directory in {os.path.dirname(self.teams_path), os.path.dirname(self.trades_path)}:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        metrics.inc("storage_reads_total", backend="tinydb")
+        with metrics.timer("storage_seconds", backend="tinydb", operation="load"):
+            snapshot = read_binary_snapshot(self.binary_path, (self.teams_path, self.trades_path))
+            self.binary_current = snapshot is not None
+
+            if snapshot is None:
+                self.teams = {doc["user_id"]: doc for doc in read_snapshot(self.teams_path).values()}
+                self.trades = read_snapshot(self.trades_path)
+            else:
+                self.teams, self.trades = snapshot
+
+            self.draft = read_json(self.draft_path)
+
+        # the ledger after the last stats snapshot, everything before is part of it
+        stats_file = read_json(self.stats_path) or {}
+        self.stats = stats_file.get("stats")
+        ledger_events = read_lines(self.ledger_path, stats_file.get("offset", 0), repair=True)
+        self.ledger_last = ledger_events[-1]["id"] if ledger_events else stats_file.get("ledger_last", 0)
+
+        replayed = 0
+        for record in self.read_journal(repair=True):
+            self.apply(record)
+            self.seq = record["seq"]
+            replayed += 1
+
+            # a crash between writing the ledger and trimming the journal
+            # leaves events in both
+            for event in record.get("events", ()):
+                if event["id"] > self.ledger_last:
+                    self.unledgered.append((record["seq"], event))
+
+        last_event = self.stats["last_event"] if self.stats else 0
+        self.loaded_events = [event for event in ledger_events if event["id"] > last_event]
+        self.loaded_events += [event for _, event in self.unledgered if event["id"] > last_event]
+
+        if replayed:
+            logger.info("Replayed %d journal records from %s", replayed, self.journal_path)
+        self.pending = replayed
+
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+
+        # copies so the league can mutate its documents freely
+        teams = {user_id: copy_doc(doc) for user_id, doc in self.teams.items()}
+        trades = {trade_id: copy_doc(doc) for trade_id, doc in self.trades.items()}
+        return teams, trades
+
+    def read_journal(self, repair: bool = False):
+        return read_lines(self.journal_path, repair=repair)
+
+    def read_events(self, after: int = 0):
+        with self.lock:
+            events = [event for event in read_lines(self.ledger_path) if event["id"] > after]
+            return events + [event for _, event in self.unledgered if event["id"] > after and event["id"] > self.ledger_last]
+
+    def load_stats(self):
+        # read during load(), the league asks right after
+        events, self.loaded_events = self.loaded_events, []
+        return self.stats, events
+
+    def load_draft(self):
+        return self.draft
+
+    def save_stats(self, stats: dict):
+        with self.lock, metrics.timer("storage_seconds", backend="tinydb", operation="stats"):
+            offset = os.path.getsize(self.ledger_path) if os.path.exists(self.ledger_path) else 0
+            written = write_json(self.stats_path, {"offset": offset, "ledger_last": self.ledger_last, "stats": stats})
+            self.stats = stats
+
+        metrics.inc("storage_writes_total", backend="tinydb", operation="stats")
+        metrics.inc("storage_bytes_written_total", written, backend="tinydb")
+
+    def apply(self, record: dict):
+        for user_id, doc in record.get("teams", {}).items():
+            if doc is None:
+                self.teams.pop(int(user_id), None)
+            else:
+                self.teams[int(user_id)] = doc
+
+        for trade_id, doc in record.get("trades", {}).items():
+            if doc is None:
+                self.trades.pop(int(trade_id), None)
+            else:
+                self.trades[int(trade_id)] = doc
+
+        if "draft" in record:
+            self.draft = record["draft"]
+
+    def commit(self, teams: dict = None, trades: dict = None, events: list = None, draft: dict = None):
+        with self.lock, metrics.timer("storage_seconds", backend="tinydb", operation="commit"):
+            self.seq += 1
+            record = {"seq": self.seq}
+            if teams:
+                record["teams"] = {str(k): copy_doc(v) for k, v in teams.items()}
+            if trades:
+                record["trades"] = {str(k): copy_doc(v) for k, v in trades.items()}
+            if events:
+                record["events"] = events
+            if draft is not None:
+                record["draft"] = draft
+
+            line = json.dumps(record) + "\n"
+            self.journal.write(line)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+            metrics.inc("storage_writes_total", backend="tinydb", operation="commit")
+            metrics.inc("storage_bytes_written_total", len(line), backend="tinydb")
+
+            self.apply(record)
+            self.unledgered.extend((self.seq, event) for event in events or ())
+            self.pending += 1
+
+            if self.pending >= self.compact_every and not (self.compactor and self.compactor.is_alive()):
+                self.compactor = threading.Thread(target=self.compact, name="league-compactor", daemon=True)
+                self.compactor.start()
+
+    def compact(self):
+        with self.lock:
+            seq = self.seq
+            teams = list(self.teams.values())
+            trades = dict(self.trades)
+            draft = self.draft
+            self.pending = 0
+
+        with metrics.timer("storage_seconds", backend="tinydb", operation="snapshot"):
+            written = write_snapshot(self.teams_path, dict(enumerate(teams, start=1)))
+            written += write_snapshot(self.trades_path, trades)
+            written += write_binary_snapshot(self.binary_path, {team["user_id"]: team for team in teams}, trades, (self.teams_path, self.trades_path))
+            self.binary_current = True
+            if draft is not None:
+                written += write_json(self.draft_path, draft)
+
+        metrics.inc("storage_writes_total", 3, backend="tinydb", operation="snapshot")
+        metrics.inc("storage_bytes_written_total", written, backend="tinydb")
+
+        # drop the records that are now part of the snapshots, after moving
+        # their events to the ledger
+        with self.lock:
+            events = [event for record_seq, event in self.unledgered if record_seq <= seq]
+            if events:
+                with open(self.ledger_path, "a", encoding="utf-8") as f:
+                    for event in events:
+                        f.write(json.dumps(event) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                self.ledger_last = events[-1]["id"]
+                self.unledgered = [(record_seq, event) for record_seq, event in self.unledgered if record_seq > seq]
+
+            self.journal.close()
+            remaining = [record for record in self.read_journal() if record["seq"] > seq]
+
+            tmp_path = self.journal_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for record in remaining:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(tmp_path, self.journal_path)
+            self.journal = open(self.journal_path, "a", encoding="utf-8")
+
+        logger.info("Compacted journal at seq %d", seq)
+
+    def close(self):
+        if self.compactor:
+            self.compactor.join()
+
+        if self.journal:
+            # nothing to compact if the snapshots already hold everything
+            if self.pending or not self.binary_current:
+                self.compact()
+            self.journal.close()
+            self.journal = None
+
+
+def read_lines(path: str, offset: int = 0, repair: bool = False):
+    """
+    Records of a json lines file, starting at byte `offset`. With `repair`
+    a torn last record is cut off the file, so the next record appended
+    doesn't end up glued onto it and unreadable.
+    """
+    if not os.path.exists(path):
+        return []
+
+    records = []
+    good = offset  # end of the last complete record
+    torn = False
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            try:
+                # every record is written with its newline, one without it never finished
+                if not line.endswith(b"\n"):
+                    raise ValueError("no newline")
+                records.append(json.loads(line))
+            except ValueError:
+                # a torn write from a crash can only be the last line
+                logger.warning("Ignoring incomplete record in %s", path)
+                torn = True
+                break
+
+            good += len(line)
+
+    if torn and repair:
+        with open(path, "r+b") as f:
+            f.truncate(good)
+            f.flush()
+            os.fsync(f.fileno())
+
+        logger.warning("Cut %s back to its last complete record", path)
+
+    return records
+
+
+def read_json(path: str):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json(path: str, data):
+    text = json.dumps(data)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return len(text)
+
+
+def copy_doc(doc):
+    if doc is None:
+        return None
+
+    return {k: list(v) if isinstance(v, list) else v for k, v in doc.items()}
+
+
+def read_snapshot(path: str):
+    if not os.path.exists(path):
+        return {}
+
+    db = tinydb.TinyDB(path)
+    docs = {doc.doc_id: dict(doc) for doc in db.all()}
+    db.close()
+
+    return docs
+
+
+def write_snapshot(path: str, docs: dict):
+    # write to a temporary file and swap it in so a crash never leaves a
+    # half written snapshot behind
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = tinydb.TinyDB(tmp_path)
+    db.insert_multiple(Document(doc, doc_id=doc_id) for doc_id, doc in docs.items())
+    db.close()
+
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+BINARY_SNAPSHOT_MAGIC = b"LEAGUESNAP1\n"
+
+
+def binary_snapshot_path(teams_path: str):
+    return teams_path + ".snap"
+
+
+def snapshot_stamp(paths):
+    # size and mtime of the json snapshots a binary snapshot was built from,
+    # and the marshal format in case python was upgraded in between
+    stamp = [marshal.version]
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            stamp.append(None)
+
+    return stamp
+
+
+def write_binary_snapshot(path: str, teams: dict, trades: dict, sources):
+    data = BINARY_SNAPSHOT_MAGIC + marshal.dumps((snapshot_stamp(sources), teams, trades))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+def read_binary_snapshot(path: str, sources):
+    """
+    (teams, trades) from a binary snapshot, or None if there is none or the
+    json snapshots changed since it was written (edited by hand, or written
+    by a crash between the two)
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+    with f:
+        if os.fstat(f.fileno()).st_size <= len(BINARY_SNAPSHOT_MAGIC):
+            return None
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(BINARY_SNAPSHOT_MAGIC)] != BINARY_SNAPSHOT_MAGIC:
+                return None
+
+            try:
+                with memoryview(data) as view, view[len(BINARY_SNAPSHOT_MAGIC):] as body:
+                    stamp, teams, trades = marshal.loads(body)
+            except (EOFError, ValueError, TypeError):
+                logger.warning("Ignoring corrupt snapshot %s", path)
+                return None
+
+    if stamp != snapshot_stamp(sources):
+        return None
+
+    return teams, trades
+
+
+class SQLiteStorage(Storage):
+    """
+    Keeps a league in a single sqlite database in WAL mode. Every commit is
+    one transaction, and the primary key on roster(player) makes it
+    impossible for a player to be stored on two teams.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS teams (
+            user_id INTEGER PRIMARY KEY,
+            team_name TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS roster (
+            player TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES teams(user_id) ON DELETE CASCADE,
+            position INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS roster_user_id ON roster(user_id);
+        CREATE TABLE IF NOT EXISTS trades (
+            trade_id INTEGER PRIMARY KEY,
+            message_id INTEGER,
+            data TEXT NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS trades_message_id ON trades(message_id);
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS stats (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS draft (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = None
+
+    def load(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(self.SCHEMA)
+
+        metrics.inc("storage_reads_total", backend="sqlite")
+
+        teams = {}
+        for user_id, team_name in self.conn.execute("SELECT user_id, team_name FROM teams"):
+            teams[user_id] = {"user_id": user_id, "team_name": team_name, "players": []}
+
+        for player, user_id in self.conn.execute("SELECT player, user_id FROM roster ORDER BY user_id, position"):
+            teams[user_id]["players"].append(player)
+
+        trades = {trade_id: json.loads(data) for trade_id, data in self.conn.execute("SELECT trade_id, data FROM trades")}
+
+        return teams, trades
+
+    def commit(self, teams: dict = None, trades: dict = None, events: list = None, draft: dict = None):
+        teams = teams or {}
+        trades = trades or {}
+        events = events or []
+
+        metrics.inc("storage_writes_total", backend="sqlite", operation="commit")
+
+        # one transaction, rolled back if anything fails
+        with self.conn, metrics.timer("storage_seconds", backend="sqlite", operation="commit"):
+            # clear every touched roster first so players can move between
+            # the teams of this commit without tripping the unique key
+            self.conn.executemany("DELETE FROM roster WHERE user_id = ?", [(user_id,) for user_id in teams])
+
+            for user_id, team in teams.items():
+                if team is None:
+                    self.conn.execute("DELETE FROM teams WHERE user_id = ?", (user_id,))
+                    continue
+
+                self.conn.execute(
+                    "INSERT INTO teams (user_id, team_name) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET team_name = excluded.team_name",
+                    (user_id, team["team_name"]),
+                )
+
+            for user_id, team in teams.items():
+                if team is not None:
+                    self.conn.executemany(
+                        "INSERT INTO roster (player, user_id, position) VALUES (?, ?, ?)",
+                        [(player, user_id, position) for position, player in enumerate(team["players"])],
+                    )
+
+            for trade_id, trade in trades.items():
+                if trade is None:
+                    self.conn.execute("DELETE FROM trades WHERE trade_id = ?", (trade_id,))
+                else:
+                    # not INSERT OR REPLACE, which would quietly delete another
+                    # trade with the same message_id instead of failing
+                    self.conn.execute(
+                        "INSERT INTO trades (trade_id, message_id, data) VALUES (?, ?, ?) "
+                        "ON CONFLICT(trade_id) DO UPDATE SET message_id = excluded.message_id, data = excluded.data",
+                        (trade_id, trade.get("message_id"), json.dumps(trade)),
+                    )
+
+            self.conn.executemany("INSERT INTO events (id, data) VALUES (?, ?)", [(event["id"], json.dumps(event)) for event in events])
+
+            if draft is not None:
+                self.conn.execute("INSERT OR REPLACE INTO draft (id, data) VALUES (0, ?)", (json.dumps(draft),))
+
+    def read_events(self, after: int = 0):
+        return [json.loads(data) for data, in self.conn.execute("SELECT data FROM events WHERE id > ? ORDER BY id", (after,))]
+
+    def load_stats(self):
+        row = self.conn.execute("SELECT data FROM stats WHERE id = 0").fetchone()
+        stats = json.loads(row[0]) if row else None
+        return stats, self.read_events(stats["last_event"] if stats else 0)
+
+    def load_draft(self):
+        row = self.conn.execute("SELECT data FROM draft WHERE id = 0").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_stats(self, stats: dict):
+        metrics.inc("storage_writes_total", backend="sqlite", operation="stats")
+
+        with self.conn, metrics.timer("storage_seconds", backend="sqlite", operation="stats"):
+            self.conn.execute("INSERT OR REPLACE INTO stats (id, data) VALUES (0, ?)", (json.dumps(stats),))
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+def migrate(teams_path: str, trades_path: str, db_path: str):
+    """Copies a TinyDB league (including its journal) into a new sqlite database"""
+    if os.path.exists(db_path):
+        raise FileExistsError(f'{db_path} already exists')
+
+    source = TinyDBStorage(teams_path, trades_path)
+    teams, trades = source.load()
+    stats, _ = source.load_stats()
+    events = source.read_events()
+    draft = source.load_draft()
+    source.journal.close()
+
+    target = SQLiteStorage(db_path)
+    target.load()
+    target.commit(teams=teams, trades=trades, events=events, draft=draft)
+    if stats:
+        target.save_stats(stats)
+    target.close()
+
+    logger.info(f'Migrated {len(teams)} teams and {len(trades)} trades from {teams_path} to {db_path}')
+
+
+def migrate_all(data_dir: str):
+    # the original league lives in data_dir itself, every other guild in a subdirectory
+    directories = [data_dir] + [os.path.join(data_dir, name) for name in sorted(os.listdir(data_dir))]
+
+    for directory in directories:
+        teams_path = os.path.join(directory, "league.json")
+        db_path = os.path.join(directory, "league.db")
+
+        has_league = os.path.isfile(teams_path) or os.path.isfile(teams_path + ".journal")
+        if has_league and not os.path.exists(db_path):
+            migrate(teams_path, os.path.join(directory, "trades.json"), db_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) != 3 or sys.argv[1] != "migrate":
+        print("usage: python storage.py migrate <data dir>")
+        sys.exit(1)
+
+    migrate_all(sys.argv[2])